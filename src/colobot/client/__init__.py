@@ -21,12 +21,15 @@ import os
 import time
 import logging
 import StringIO
+import threading
+import multiprocessing.pool
 
 import g3d.serialize
 
 # make sure that serializer knows all used modules
 import g3d.model
 import colobot.game
+import colobot.control
 
 CACHE_PATH = os.path.expanduser('~/.cache/colobot')
 
@@ -36,23 +39,137 @@ def sha256(x):
 SHA1_LENGTH = 20
 
 def rpc_wrapper(name):
-    ' Returns function that calls self.rpc.`name` '
+    ' Returns function that calls self.call(`name`, ...) '
     def func(self, *args, **kwargs):
-        return self.rpc.call_func(name, *args, **kwargs)
+        return self.call(name, *args, **kwargs)
     func.__name__ = name
     return func
 
+class BatchCallError(Exception):
+    ' Raised by BatchResult.get when the call failed on server. '
+
+class BatchResult(object):
+    ' Result of a call added to Batch - available after the batch is sent. '
+    def __init__(self, name):
+        self.name = name
+        self._value = None
+        self._error = None
+        self._ready = False
+        self._sent = threading.Event()
+
+    def ready(self):
+        return self._ready
+
+    def _set(self, value=None, error=None):
+        self._value = value
+        self._error = error
+        self._ready = True
+        self._sent.set()
+
+    def get(self):
+        if not self._ready:
+            raise RuntimeError('batch containing %s was not sent yet' % self.name)
+        if self._error:
+            raise BatchCallError(self._error)
+        return self._value
+
+class AsyncCallResult(BatchResult):
+    ' Result of Client.call_async - get() waits until its batch is sent. '
+    def get(self):
+        self._sent.wait()
+        return BatchResult.get(self)
+
+class Batch(object):
+    '''
+    Collects RPC calls and sends them in one message. Calls are executed
+    by server in order. Use as context manager - the batch is sent on exit:
+
+        with client.batch() as batch:
+            batch.call('create_game', 'game')
+            scene = batch.call('load_scene', 'game', 'scene103.txt')
+        scene.get()
+    '''
+    result_class = BatchResult
+
+    def __init__(self, client):
+        self.client = client
+        self.calls = []
+        self.results = []
+
+    def call(self, name, *args, **kwargs):
+        self.calls.append((name, args, kwargs))
+        result = self.result_class(name)
+        self.results.append(result)
+        return result
+
+    def send(self):
+        if not self.calls:
+            return
+        response = self.client.call('batch', self.calls)
+        for result, item in zip(self.results, response):
+            result._set(item.get('result'), item.get('error'))
+        self.calls = []
+        self.results = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        if type is None:
+            self.send()
+
 class Client:
     def __init__(self, address):
-        self.unserializer = g3d.serialize.Unserializer()
+        self.unserializer = g3d.serialize.Unserializer(lazy=True)
         self.socket = multisock.connect(address)
         self.rpc = multisock.jsonrpc.JsonRpcChannel(self.socket.get_main_channel())
+        self._rpc_lock = threading.Lock()
+        self._call_pool = None
+        self._async_lock = threading.Lock()
+        self._async_batch = None
+
+    def call(self, name, *args, **kwargs):
+        ''' Calls RPC method `name` and returns its result. Calls from
+        different threads are sent one at a time - JsonRpcChannel doesn't
+        promise to match concurrent responses. Use batch() to save round
+        trips. '''
+        with self._rpc_lock:
+            return self.rpc.call_func(name, *args, **kwargs)
+
+    def batch(self):
+        ' Returns new Batch - see its documentation. '
+        return Batch(self)
+
+    def call_async(self, name, *args, **kwargs):
+        ''' Sends RPC call in background, so caller doesn't wait for it.
+        Calls are sent in order by a batch that sends itself - calls made
+        while the previous batch is in flight go together in the next one,
+        so they cost one round trip. Returns AsyncCallResult. '''
+        with self._async_lock:
+            if not self._call_pool:
+                self._call_pool = multiprocessing.pool.ThreadPool(1)
+            if self._async_batch is None:
+                self._async_batch = Batch(self)
+                self._async_batch.result_class = AsyncCallResult
+                self._call_pool.apply_async(self._send_async_batch)
+            return self._async_batch.call(name, *args, **kwargs)
+
+    def _send_async_batch(self):
+        with self._async_lock:
+            batch, self._async_batch = self._async_batch, None
+        results = batch.results
+        try:
+            batch.send()
+        except Exception as err:
+            logging.exception('sending batch of async calls failed')
+            for result in results:
+                result._set(error='%s: %s' % (type(err).__name__, err))
 
     def authenticate(self, login, password):
-        auth_data = self.rpc.call.get_auth_tokens(login)
+        auth_data = self.call('get_auth_tokens', login)
         auth_token, salt = auth_data['token'], auth_data['salt']
         password_token = sha256(auth_token + '\0' + sha256(password + '\0' + salt))
-        return self.rpc.call.authenticate(login, password_token)
+        return self.call('authenticate', login, password_token)
 
     use_session = rpc_wrapper('use_session')
     create_game = rpc_wrapper('create_game')
@@ -104,56 +221,116 @@ class Client:
         if not idents:
             return
         logging.debug('fetching %s', [ id.encode('hex') for id in idents ])
-        deps = list(set(self.get_dependencies(idents) + idents))
-        for sha1, data in self.get_resources(deps):
-            assert sha1 in deps, '%r not in %s' % (sha1, deps)
+        # objects themselves are requested together with their dependencies
+        with self.batch() as batch:
+            deps = batch.call('get_dependencies', [ i.encode('hex') for i in idents ])
+            channel_id = batch.call('get_resources', [ i.encode('hex') for i in idents ])
+        resources = list(self._read_resources(channel_id.get(), len(idents)))
+        deps = list(set( i.decode('hex') for i in deps.get() ) - set(idents))
+        if deps:
+            resources += self.get_resources(deps)
+
+        wanted = set(idents + deps)
+        for sha1, data in resources:
+            assert sha1 in wanted, '%r not in %s' % (sha1, wanted)
             logging.debug('adding %s', sha1.encode('hex'))
             self.unserializer.add(sha1, data)
         logging.debug('done')
 
     def get_terrain(self, game_name):
-        ident = self.rpc.call.get_terrain(game_name).decode('hex')
+        return self._load_terrain(self.call('get_terrain', game_name))
+
+    def _load_terrain(self, ident):
+        ident = ident.decode('hex')
         self.fetch_objects([ident])
         return self.unserializer.load(ident)
 
     def get_resources(self, idents):
-        channel_id = self.rpc.call.get_resources([ i.encode('hex') for i in idents ])
-        channel = self.socket.get_channel(channel_id)
+        channel_id = self.call('get_resources', [ i.encode('hex') for i in idents ])
+        return self._read_resources(channel_id, len(idents))
 
-        for i in xrange(len(idents)):
+    def _read_resources(self, channel_id, count):
+        channel = self.socket.get_channel(channel_id)
+        for i in xrange(count):
             packet = channel.recv()
             yield packet[ :SHA1_LENGTH], packet[SHA1_LENGTH: ]
 
     def get_dependencies(self, idents):
         return [ i.decode('hex')
-                 for i in self.rpc.call.get_dependencies([ i.encode('hex')
-                                                           for i in idents ]) ]
+                 for i in self.call('get_dependencies', [ i.encode('hex') for i in idents ]) ]
 
     def open_update_channel(self, name):
-        return self.socket.get_channel(self.rpc.call.open_update_channel(name))
+        return self.socket.get_channel(self.call('open_update_channel', name))
+
+    def open_input_channel(self, name):
+        return InputSender(self.socket.get_channel(self.call('open_input_channel', name)))
+
+    def open_game(self, name):
+        ''' Opens update and input channels of game and loads its terrain,
+        with one batch. Returns (update channel, InputSender, terrain). '''
+        with self.batch() as batch:
+            updates = batch.call('open_update_channel', name)
+            input = batch.call('open_input_channel', name)
+            terrain = batch.call('get_terrain', name)
+        return (self.socket.get_channel(updates.get()),
+                InputSender(self.socket.get_channel(input.get())),
+                self._load_terrain(terrain.get()))
+
+class InputSender(object):
+    '''
+    Sends control messages to game without waiting for server. The last
+    message applied by server is reported in updates (set acked to it).
+    '''
+    def __init__(self, channel):
+        self.channel = channel
+        self.seq = 0
+        self.acked = 0
+
+    def send(self, kind, *args):
+        self.seq += 1
+        self.channel.send_async(colobot.control.pack(self.seq, kind, *args))
+        return self.seq
+
+    def motor(self, ident, motor):
+        return self.send(colobot.control.MOTOR, ident, *motor)
+
+    def select(self, ident):
+        return self.send(colobot.control.SELECT, ident or '')
+
+    def view(self, x, y, radius):
+        ' Tells server to send only objects within `radius` from (x, y). '
+        return self.send(colobot.control.VIEW, x, y, radius)
+
+    @property
+    def pending(self):
+        ' Number of sent messages that were not applied yet. '
+        return self.seq - self.acked
 
 
 class UpdateReader:
-    def __init__(self, client, channel):
+    ''' Receives updates in background thread. If `start` is false, the
+    thread is not started and blobs have to be passed to handle. '''
+    def __init__(self, client, channel, start=True):
         self.channel = channel
         self.client = client
 
-        self.unserialized = multisock.Operation()
-        multisock.async(self.loop)
+        self._lock = threading.Lock()
+        self._pending = None
+        if start:
+            multisock.async(self.loop)
 
     def loop(self):
         multisock.set_thread_name('update recv')
-        try:
-            while True:
-                self.tick()
-        finally:
-            self.unserialized.close()
+        while True:
+            self.tick()
 
     def tick(self):
-        blob = self.channel.recv()
+        self.handle(self.channel.recv())
+
+    def handle(self, blob):
         data = self.client.unserializer.load_from(StringIO.StringIO(blob))
 
-        update_time, new, deleted, updates = data
+        update_time, new, deleted, updates, input_ack, loading_progress = data
 
         self.client.fetch_objects([ model for ident, model in new ])
 
@@ -161,20 +338,37 @@ class UpdateReader:
                 time, # TODO: synchronize time with server
                 [ (ident, self.client.unserializer.load(model)) for ident, model in new ],
                 deleted,
-                updates
+                updates,
+                input_ack,
+                loading_progress,
         )
 
-        if self.unserialized._queue.qsize() > 3:
-            # FIXME: use of private varibles
-            # TODO: use UDP and avoid this
-            # skip update if client is not fast enough
-            return
-        self.unserialized.dispatch(val)
-
+        with self._lock:
+            if self._pending:
+                # client is not fast enough - merge with update that wasn't read yet
+                val = merge_updates(self._pending, val)
+            self._pending = val
 
     def get_new_updates(self):
         ''' Retruns None if new updates haven\'t arrived yet. Never blocks. '''
-        try:
-            return self.unserialized.noblock()
-        except multisock.Operation.WouldBlock:
-            return None
+        with self._lock:
+            val, self._pending = self._pending, None
+        return val
+
+def merge_updates(old, new):
+    ''' Merges two consecutive updates into one. Positions are taken from
+    the newer one, but no new or deleted objects are lost. Objects in
+    `deleted` have to be removed before objects in `new` are added - an
+    object deleted in `old` may come back with the same ident in `new`. '''
+    old_time, old_new, old_deleted, old_updates, old_ack, old_progress = old
+    new_time, new_new, new_deleted, new_updates, new_ack, new_progress = new
+    deleted = set(new_deleted)
+    created = set( ident for ident, model in old_new )
+    return (
+        new_time,
+        [ item for item in old_new if item[0] not in deleted ] + new_new,
+        old_deleted + [ ident for ident in new_deleted if ident not in created ],
+        new_updates,
+        new_ack,
+        new_progress,
+    )
@@ -0,0 +1,238 @@
+# Copyright (C) 2012, Michal Zielinski <michal@zielinscy.org.pl>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Headless load generator - simulates many players connected to one server.
+Each player authenticates, joins (or creates) a game, reads updates and
+sends motor commands. Results are collected in Report.
+'''
+
+import multisock
+import multisock.jsonrpc
+
+import colobot.client
+
+import threading
+import random
+import time
+import logging
+import collections
+
+class Samples(object):
+    ' Collects values and computes exact percentiles. '
+    def __init__(self):
+        self._values = []
+        self._lock = threading.Lock()
+
+    def add(self, value):
+        with self._lock:
+            self._values.append(value)
+
+    def __len__(self):
+        return len(self._values)
+
+    def percentile(self, q):
+        ' Returns q-th percentile (0 < q <= 100) or None if there are no values. '
+        with self._lock:
+            values = sorted(self._values)
+        if not values:
+            return None
+        index = int(round(q / 100. * len(values))) - 1
+        return values[max(0, min(index, len(values) - 1))]
+
+    def summary(self, scale=1000., unit='ms'):
+        if not self._values:
+            return 'no samples'
+        return 'n=%d %s' % (len(self), ' '.join(
+            '%s=%.1f%s' % (name, self.percentile(q) * scale, unit)
+            for name, q in [('p50', 50), ('p90', 90), ('p99', 99), ('max', 100)] ))
+
+class Report(object):
+    def __init__(self):
+        self.join_latency = Samples()
+        self.update_interval = Samples()
+        self.jitter = Samples()
+        self.update_rate = Samples()
+        self.updates = 0
+        self.bytes = 0
+        self.motors = 0
+        self.errors = collections.Counter()
+        self.start = time.time()
+        self.end = None
+        self._lock = threading.Lock()
+
+    def add_update(self, size):
+        with self._lock:
+            self.updates += 1
+            self.bytes += size
+
+    def add_motor(self):
+        with self._lock:
+            self.motors += 1
+
+    def add_error(self, err):
+        logging.debug('simulated player failed', exc_info=True)
+        with self._lock:
+            self.errors['%s: %s' % (type(err).__name__, err)] += 1
+
+    def format(self):
+        duration = (self.end or time.time()) - self.start
+        lines = [
+            'duration: %.1fs' % duration,
+            'join latency: %s' % self.join_latency.summary(),
+            'update interval: %s' % self.update_interval.summary(),
+            'update jitter: %s' % self.jitter.summary(),
+            'updates/s per player: %s' % self.update_rate.summary(scale=1, unit=''),
+            'throughput: %.1f updates/s, %.1f KB/s, %.1f motor commands/s' % (
+                self.updates / duration, self.bytes / duration / 1024.,
+                self.motors / duration),
+            'errors: %d' % sum(self.errors.values()),
+        ]
+        for message, count in self.errors.most_common():
+            lines.append('  %5d %s' % (count, message))
+        return '\n'.join(lines)
+
+class MeasuringUpdateReader(colobot.client.UpdateReader):
+    ' UpdateReader that reports arrival time and size of every blob to player. '
+    def __init__(self, client, channel, player):
+        self.player = player
+        colobot.client.UpdateReader.__init__(self, client, channel)
+
+    def loop(self):
+        try:
+            colobot.client.UpdateReader.loop(self)
+        except Exception as err:
+            if not self.player.stopped:
+                self.player.report.add_error(err)
+
+    def handle(self, blob):
+        self.player.on_update(len(blob))
+        colobot.client.UpdateReader.handle(self, blob)
+
+class SimulatedPlayer(object):
+    '''
+    One simulated client. `run` blocks until `deadline` (time.time() value)
+    and never raises - errors are counted in report.
+    '''
+    def __init__(self, address, login, password, game_name, report,
+                 scene=None, motor_interval=0.5, update_interval=0.1,
+                 join_timeout=30):
+        self.address = address
+        self.login = login
+        self.password = password
+        self.game_name = game_name
+        self.report = report
+        self.scene = scene
+        self.motor_interval = motor_interval
+        self.update_interval = update_interval
+        self.join_timeout = join_timeout
+
+        self.client = None
+        self.stopped = False
+        self._joined = threading.Event()
+        self._last_update = None
+        self._update_count = 0
+
+    def run(self, deadline):
+        start = time.time()
+        try:
+            self.client = colobot.client.Client(self.address)
+            self.client.authenticate(self.login, self.password)
+            self.join()
+
+            channel = self.client.open_update_channel(self.game_name)
+            self.reader = MeasuringUpdateReader(self.client, channel, self)
+            self._joined.wait(self.join_timeout)
+            if not self._joined.is_set():
+                raise RuntimeError('no update received in %d seconds' % self.join_timeout)
+            joined = time.time()
+            self.report.join_latency.add(joined - start)
+
+            input = self.client.open_input_channel(self.game_name)
+            objects = self.client.get_user_objects(self.game_name)
+            while time.time() < deadline:
+                if objects:
+                    motor = (random.uniform(-1, 1), random.uniform(-1, 1))
+                    input.motor(random.choice(objects), motor)
+                    self.report.add_motor()
+                time.sleep(self.motor_interval)
+
+            self.report.update_rate.add(self._update_count / (time.time() - joined))
+        except Exception as err:
+            self.report.add_error(err)
+        finally:
+            self.stop()
+
+    def join(self):
+        if self.game_name in self.client.list_games():
+            return
+        try:
+            self.client.create_game(self.game_name)
+        except multisock.jsonrpc.RemoteError:
+            # game was created by other player in the meantime
+            return
+        if self.scene:
+            self.client.load_scene(self.game_name, self.scene)
+
+    def on_update(self, size):
+        now = time.time()
+        if self._last_update is not None:
+            interval = now - self._last_update
+            self.report.update_interval.add(interval)
+            self.report.jitter.add(abs(interval - self.update_interval))
+        self._last_update = now
+        self._update_count += 1
+        self.report.add_update(size)
+        self._joined.set()
+
+    def stop(self):
+        self.stopped = True
+        if self.client:
+            try:
+                self.client.socket.close()
+            except Exception:
+                pass
+
+class LoadGenerator(object):
+    '''
+    Runs `players` simulated players spread over `games` games (named
+    `game_prefix`0, `game_prefix`1, ...). Players are started `ramp_up`
+    seconds apart, so joins don't all hit server at once.
+    '''
+    def __init__(self, address, players, login, password, games=1,
+                 game_prefix='loadgen', ramp_up=0.05, **player_options):
+        self.report = Report()
+        self.players = [
+            SimulatedPlayer(address, login, password,
+                            '%s%d' % (game_prefix, i % games),
+                            self.report, **player_options)
+            for i in xrange(players) ]
+        self.ramp_up = ramp_up
+
+    def run(self, duration):
+        ' Runs simulation for `duration` seconds and returns Report. '
+        self.report.start = time.time()
+        deadline = self.report.start + self.ramp_up * len(self.players) + duration
+        threads = []
+        for player in self.players:
+            thread = threading.Thread(target=player.run, args=(deadline, ))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+            time.sleep(self.ramp_up)
+        for thread in threads:
+            thread.join()
+        self.report.end = time.time()
+        return self.report
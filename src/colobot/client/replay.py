@@ -0,0 +1,113 @@
+# Copyright (C) 2012, Michal Zielinski <michal@zielinscy.org.pl>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Replays recorded update streams (see colobot.recording) - either into
+UpdateReader and UIWindow in place of live server, or through decoding
+and encoding benchmarks.
+'''
+
+import g3d.serialize
+
+import colobot.client
+import colobot.recording
+from colobot.client.loadgen import Samples
+
+import threading
+import time
+import StringIO
+
+class ReplayChannel(object):
+    '''
+    Returns recorded blobs from recv. Blobs are paced to recorded times
+    divided by `speed` (0 means as fast as possible). When recording ends,
+    recv blocks forever (like channel of an idle server).
+    '''
+    def __init__(self, blobs, speed=1.0):
+        self._blobs = iter(blobs)
+        self.speed = speed
+        self._start = None
+
+    def recv(self):
+        try:
+            timestamp, blob = next(self._blobs)
+        except StopIteration:
+            threading.Event().wait()
+        if self.speed:
+            if self._start is None:
+                self._start = (time.time(), timestamp)
+            start, first = self._start
+            delay = start + (timestamp - first) / self.speed - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        return blob
+
+class NullChannel(object):
+    ' Channel that drops everything sent to it. '
+    def send_async(self, data):
+        pass
+
+class ReplayClient(object):
+    ' Stands in for colobot.client.Client - data comes from Recording. '
+    def __init__(self, recording, speed=1.0):
+        self.recording = recording
+        self.speed = speed
+        self.unserializer = g3d.serialize.Unserializer(lazy=True)
+        for sha1, data in recording.resources.iteritems():
+            self.unserializer.add(sha1, data)
+
+    def fetch_objects(self, idents):
+        # all resources were already added
+        pass
+
+    def get_terrain(self, game_name):
+        return self.unserializer.load(self.recording.terrain)
+
+    def open_update_channel(self, game_name):
+        return ReplayChannel(self.recording.blobs, self.speed)
+
+    def open_input_channel(self, game_name):
+        return colobot.client.InputSender(NullChannel())
+
+    def open_game(self, game_name):
+        return (self.open_update_channel(game_name), self.open_input_channel(game_name),
+                self.get_terrain(game_name))
+
+def benchmark_decode(recording):
+    ''' Passes all blobs through UpdateReader (as fast as possible).
+    Returns Samples of decoding times. '''
+    reader = colobot.client.UpdateReader(ReplayClient(recording, speed=0), None, start=False)
+    samples = Samples()
+    for timestamp, blob in recording.blobs:
+        start = time.time()
+        reader.handle(blob)
+        reader.get_new_updates()
+        samples.add(time.time() - start)
+    return samples
+
+def benchmark_encode(recording):
+    ''' Decodes each blob and encodes it again with current Serializer.
+    Returns (Samples of encoding times, total size of encoded blobs) - to
+    compare wire format changes against recorded traffic. '''
+    serializer = g3d.serialize.Serializer(canonical=True)
+    unserializer = g3d.serialize.Unserializer()
+    samples = Samples()
+    size = 0
+    for timestamp, blob in recording.blobs:
+        data = unserializer.load_from(StringIO.StringIO(blob))
+        start = time.time()
+        size += len(serializer.serialize(data))
+        samples.add(time.time() - start)
+    return samples, size
@@ -22,6 +22,8 @@ import g3d.camera_drivers
 
 import colobot.client
 
+import logging
+
 from g3d.gl import Keys
 from g3d.math import Vector2, Vector3, Quaternion
 
@@ -30,14 +32,16 @@ class UIWindow(object):
         self.client = client
         self.terrain = g3d.terrain.Terrain()
         self.game_name = game_name
-        self.update_reader = colobot.client.UpdateReader(
-            client, client.open_update_channel(game_name))
+        self.update_reader = None
+        self.input = None
 
         self.root = g3d.Container()
         self.objects_by_id = {}
+        self.loading_progress = None # (loaded objects, total) or None
 
     def setup(self):
-        self.terrain = self.client.get_terrain(self.game_name)
+        channel, self.input, self.terrain = self.client.open_game(self.game_name)
+        self.update_reader = colobot.client.UpdateReader(self.client, channel)
 
     def loop(self):
         win = g3d.gl.Window()
@@ -59,17 +63,21 @@ class UIWindow(object):
         if not data:
             return
 
-        server_time, new, deleted, updates = data
-        for ident, model in new:
-            model = self.objects_by_id[ident] = model.clone()
-            model.ident = ident # TODO: do something else
-            self.root.add(model.root)
-
+        server_time, new, deleted, updates, input_ack, loading_progress = data
+        self.input.acked = input_ack
+        if loading_progress != self.loading_progress and loading_progress:
+            logging.info('loading scene: %d/%d objects', *loading_progress)
+        self.loading_progress = loading_progress
+        # deleted first - merged updates may delete and re-add the same ident
         for ident in deleted:
             model = self.objects_by_id[ident]
             del self.objects_by_id[ident]
             self.root.remove(model.root)
 
+        for ident, model in new:
+            model = self.objects_by_id[ident] = model.clone()
+            self.root.add(model.root)
+
         for ident, position, velocity, rotation, angular_velocity in updates:
             obj = self.objects_by_id[ident]
             obj.root.pos = position
@@ -80,8 +88,8 @@ class CameraDriver(g3d.camera_drivers.CameraDriver):
         super(CameraDriver, self).__init__()
         self.window = window
         self.client = client
-        self._object = None
-        self._ordered_objects = []
+        self._ident = None # of controlled object
+        self._ordered_idents = []
 
         self.dist_behind = 36
         self.dist_above = 18
@@ -91,6 +99,14 @@ class CameraDriver(g3d.camera_drivers.CameraDriver):
         self.fly = 0
         self._last_motor = Ellipsis
 
+        # server sends only objects this far from camera center
+        self.view_radius = 400
+        self._last_view = None
+
+    @property
+    def _object(self):
+        return self.window.objects_by_id.get(self._ident) if self._ident else None
+
     def install(self, window):
         super(CameraDriver, self).install(window)
         window.timer.add_ticker(self.tick)
@@ -101,6 +117,14 @@ class CameraDriver(g3d.camera_drivers.CameraDriver):
         else:
             self._handle_keys()
             self._position_camera()
+        self._report_view()
+
+    def _report_view(self):
+        center = self.camera.center
+        if self._last_view is not None and abs(self._last_view - center) < self.view_radius * 0.1:
+            return
+        self._last_view = Vector3(*center)
+        self.window.input.view(center.x, center.y, self.view_radius)
 
     def _handle_top_keys(self):
         speed = Vector3(self.direction, -self.turn, self.fly * 5)
@@ -123,7 +147,7 @@ class CameraDriver(g3d.camera_drivers.CameraDriver):
             return
         motor = self._get_motor()
         if motor != self._last_motor:
-            self.window.remote_call('motor', self._object.ident, motor) # TODO: async
+            self.window.input.motor(self._ident, motor)
             self._last_motor = motor
 
     def _get_motor(self):
@@ -152,7 +176,8 @@ class CameraDriver(g3d.camera_drivers.CameraDriver):
         elif key in (Keys.K_LSHIFT, Keys.K_LCTRL):
             self.fly = -1 if key == Keys.K_LSHIFT else 1
         elif key == Keys.K_ESCAPE:
-            self._object = None
+            self._ident = None
+            self.window.input.select(None)
 
     def key_up(self, key):
         if key in (Keys.K_LEFT, Keys.K_RIGHT):
@@ -164,20 +189,22 @@ class CameraDriver(g3d.camera_drivers.CameraDriver):
 
 
     def _get_next_object(self):
-        current = set(self.window.objects_by_id.get(ident)
-                      for ident in self.window.remote_call('get_user_objects') ) # TODO: async, FIXME: race condition
-        current_index = (self._ordered_objects.index(self._object)
-                         if self._object in self._ordered_objects else -1)
-        self._ordered_objects = [ o for o in self._ordered_objects if o in current ]
-        if len(self._ordered_objects) != len(current):
-            old = set(self._ordered_objects)
-            for o in current:
-                if o not in old:
-                    self._ordered_objects.append(o)
-
-        if not self._ordered_objects:
-            self._object = None
+        current = set(ident
+                      for ident in self.window.remote_call('get_user_objects') # TODO: async, FIXME: race condition
+                      if ident in self.window.objects_by_id ) # outside of view
+        current_index = (self._ordered_idents.index(self._ident)
+                         if self._ident in self._ordered_idents else -1)
+        self._ordered_idents = [ i for i in self._ordered_idents if i in current ]
+        if len(self._ordered_idents) != len(current):
+            old = set(self._ordered_idents)
+            for i in current:
+                if i not in old:
+                    self._ordered_idents.append(i)
+
+        if not self._ordered_idents:
+            self._ident = None
         else:
-            index = (current_index + 1) % len(self._ordered_objects)
+            index = (current_index + 1) % len(self._ordered_idents)
             self._last_motor = Ellipsis
-            self._object = self._ordered_objects[index]
+            self._ident = self._ordered_idents[index]
+            self.window.input.select(self._ident)
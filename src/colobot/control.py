@@ -0,0 +1,55 @@
+# Copyright (C) 2012, Michal Zielinski <michal@zielinscy.org.pl>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+Compact control messages sent by client over input channel. Messages are
+not acknowledged directly - instead the server puts sequence number of
+the last applied message in each update (see Game.input_acks).
+
+Each message starts with HEADER (sequence number, kind) followed by
+body specific to its kind.
+'''
+
+import struct
+
+HEADER = struct.Struct('!IB')
+
+MOTOR = 1
+SELECT = 2
+VIEW = 3 # area of interest - (x, y, radius)
+
+IDENT_LENGTH = 9
+
+BODIES = {
+    MOTOR: struct.Struct('!%dsff' % IDENT_LENGTH),
+    SELECT: struct.Struct('!%ds' % IDENT_LENGTH),
+    VIEW: struct.Struct('!fff'),
+}
+
+class ControlError(Exception):
+    ' Raised when control message is malformed. '
+
+def pack(seq, kind, *args):
+    return HEADER.pack(seq, kind) + BODIES[kind].pack(*args)
+
+def unpack(data):
+    ' Returns (seq, kind, args). '
+    try:
+        seq, kind = HEADER.unpack_from(data)
+        body = BODIES[kind]
+    except (struct.error, KeyError):
+        raise ControlError('malformed control message %r' % data)
+    if len(data) != HEADER.size + body.size:
+        raise ControlError('bad length of control message %r' % data)
+    return seq, kind, body.unpack_from(data, HEADER.size)
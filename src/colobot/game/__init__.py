@@ -21,19 +21,36 @@ import g3d.terrain
 from g3d.math import Vector2, Vector3, Quaternion, atan, safe_asin, pi
 import g3d.serialize
 
+import colobot.control
+
 import threading
+import collections
 import logging
 import os
 
 MODULE_SERIAL_ID = 101
 
 class Game(object):
+    '''
+    Simulation of one game. It is modified only by tick - requests from other
+    threads are posted as commands (see post) and applied at the start of
+    the next tick. After each tick state of objects is published, so readers
+    (get_objects, Object.snapshot) don't have to take global_lock.
+    '''
+    # number of objects added in one tick when loading scene
+    spawn_batch_size = 50
+
     def __init__(self, loader):
         self.terrain = Terrain()
         self.loader = loader
         self.objects_by_id = {}
         self.global_lock = threading.RLock()
         self.players = {}
+        self._commands = collections.deque()
+        self._published = []
+        self.input_acks = {}
+        self.views = {} # source -> (x, y, radius), see UpdateChannelHandler
+        self.loading_progress = None # (added objects, total) when loading scene
 
         self.gravity = Vector3(0, 0, -12)
         self._static_num = 0
@@ -47,56 +64,172 @@ class Game(object):
             self.players[name] = Player(self)
         return self.players[name]
 
+    def post(self, func, *args):
+        ''' Calls func(*args) at the start of the next tick. Returns Command,
+        which can be used to wait for the result. Thread-safe. '''
+        command = Command(func, args)
+        self._commands.append(command)
+        return command
+
     def load_terrain(self, name):
-        file = self.loader.index[name]()
-        self.terrain.load_from_relief(file)
+        # relief is read in calling thread, tick only replaces the terrain
+        terrain = Terrain()
+        terrain.load_from_relief(self.loader.index[name]())
+        self.post(self._set_terrain, terrain).wait()
 
     def load_scene(self, name):
-        import colobot.game.scene_file # TODO
-        with self.global_lock:
-            file = self.loader.index[name]()
-            colobot.game.scene_file.load(file, self)
+        '''
+        Loads scene incrementally - terrain and objects are prepared in
+        calling thread (models are prefetched by loader threads meanwhile),
+        then the terrain is replaced and objects are added
+        in batches of spawn_batch_size (one batch per tick). Returns when
+        the whole scene is loaded.
+        '''
+        import colobot.game.scene_file as scene_file # TODO
+        scene = scene_file.get_compiled(self.loader.read_file(name))
+        # meshes are loaded in background while terrain is prepared
+        self.loader.prefetch(scene_file.get_model_files(scene, self.loader))
+        terrain = Terrain()
+        scene_file.apply_commands(scene, self, terrain)
+        self.post(self._set_terrain, terrain).wait()
+
+        order = scene_file.spawn_order(scene)
+        try:
+            for start in xrange(0, len(order), self.spawn_batch_size):
+                self.loading_progress = (start, len(order))
+                batch = [ scene_file.make_object(self, **scene.get_object(i))
+                          for i in order[start:start + self.spawn_batch_size] ]
+                self.add_objects(batch).wait()
+        finally:
+            self.loading_progress = None
+
+    def _set_terrain(self, terrain):
+        self.terrain = terrain
 
     def tick(self, time):
         with self.global_lock:
+            self._apply_commands()
             for obj in self.objects:
                 obj.tick(time)
+            self._publish()
+
+    def _apply_commands(self):
+        # commands posted during this tick wait for the next one
+        for i in xrange(len(self._commands)):
+            self._commands.popleft().apply()
+
+    def _publish(self):
+        objects = list(self.objects)
+        for obj in objects:
+            obj.publish()
+        self._published = objects
 
     def get_objects(self):
-        with self.global_lock:
-            return list(self.objects)
+        ''' Returns objects existing after the last tick. '''
+        return self._published
 
     def create_static_object(self, player_name, name, pos=None):
         # for debugging
-        player = self.get_player(player_name)
-        model = g3d.model.read(loader=self.loader, name=name).clone()
+        # model is read in calling thread, tick only adds the object
+        model = g3d.model.read(loader=self.loader, name=name)
         obj = Object(self, model)
-        obj.owner = player
-        obj.position = pos or Vector3(120, 135 + self._static_num * 30, 210)
         obj.rotation = Quaternion.new_rotate_axis(0, Vector3(0, 0, 1))
         model.root.scale = 10
+        self.post(self._add_static_object, player_name, obj, pos).wait()
+
+    def _add_static_object(self, player_name, obj, pos):
+        obj.owner = self.get_player(player_name)
+        obj.position = pos or Vector3(120, 135 + self._static_num * 30, 210)
         self._static_num += 1
         self.add_object(obj)
 
     def add_object(self, obj):
         self.objects_by_id[obj.ident] = obj
 
+    def add_objects(self, objects):
+        ''' Adds objects at the start of the next tick (all in one command).
+        Returns Command. '''
+        return self.post(self._add_objects, list(objects))
+
+    def _add_objects(self, objects):
+        for obj in objects:
+            self.add_object(obj)
+
     def get_player_objects(self, player_name):
-        return [ object for object in self.objects
+        return [ object for object in self.get_objects()
                  if object.owner == self.get_player(player_name) ]
 
+    def get_player_object_ids(self, player_name):
+        return [ object.ident for object in self.get_player_objects(player_name) ]
+
     def motor(self, player_name, bot_id, motor):
+        self.post(self._motor, player_name, bot_id, motor)
+
+    def _motor(self, player_name, bot_id, motor):
         object = self.objects_by_id[bot_id]
         #if self.get_player(player_name) != object.owner:
         #    raise NotAuthorizedError()
         object.motor = motor
 
+    def handle_input(self, source, player_name, message):
+        ''' Applies control message (see colobot.control) at the start of
+        the next tick. Sequence number of the last applied message from each
+        source is kept in input_acks. '''
+        seq, kind, args = colobot.control.unpack(message)
+        self.post(self._handle_input, source, player_name, seq, kind, args)
+
+    def _handle_input(self, source, player_name, seq, kind, args):
+        if seq <= self.input_acks.get(source, 0):
+            return # duplicated or reordered message
+        self.input_acks[source] = seq
+        if kind == colobot.control.MOTOR:
+            bot_id, f0, f1 = args
+            self._motor(player_name, bot_id, (f0, f1))
+        elif kind == colobot.control.SELECT:
+            self._select(player_name, args[0].rstrip('\0') or None)
+        elif kind == colobot.control.VIEW:
+            self.views[source] = args
+
+    def _select(self, player_name, bot_id):
+        player = self.get_player(player_name)
+        previous = self.objects_by_id.get(player.selected)
+        if previous and player.selected != bot_id:
+            # don't leave previously controlled bot driving
+            previous.motor = (0, 0)
+        player.selected = bot_id
+
 class NotAuthorizedError(Exception):
     ''' Raised when player tries to access robot of other player. '''
 
+class Command(object):
+    ' Call posted to Game with Game.post. '
+    def __init__(self, func, args):
+        self.func = func
+        self.args = args
+        self.result = None
+        self.error = None
+        self._done = threading.Event()
+
+    def apply(self):
+        try:
+            self.result = self.func(*self.args)
+        except Exception as err:
+            logging.exception('command %s failed', self.func.__name__)
+            self.error = err
+        finally:
+            self._done.set()
+
+    def wait(self):
+        ' Waits until command is applied and returns its result (or raises its exception). '
+        self._done.wait()
+        if self.error:
+            raise self.error
+        return self.result
+
 class Player(object):
     def __init__(self, game):
         self.game = game
+        self.selected = None
 
 class Object(object):
     model_scale = 0.2
@@ -118,6 +251,11 @@ class Object(object):
         self.angular_velocity = Vector3()
 
         self.motor = (0, 0)
+        self.snapshot = None
+
+    def publish(self):
+        ' Saves copy of state, that can be read without locking the game. '
+        self.snapshot = (Vector3(*self.position), Vector3(*self.velocity), self.rotation)
 
     def tick(self, time):
         if abs(self.angular_velocity) > 0.001:
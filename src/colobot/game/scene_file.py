@@ -17,31 +17,169 @@ from __future__ import division
 import colobot.game.objects
 from g3d.math import Vector2, Vector3, Quaternion, pi
 import g3d.model
+import g3d.model.reader
+
+import array
+import cPickle
+import hashlib
+import os
+import threading
+import logging
+
+CACHE_PATH = os.path.expanduser('~/.cache/colobot/scenes')
 
 def load(lines, game):
+    load_compiled(compile(lines), game)
+
+def load_compiled(scene, game):
+    ' Loads whole scene into game at once - see Game.load_scene for incremental loading. '
+    apply_commands(scene, game, game.terrain)
+    for obj in make_objects(scene, game):
+        game.add_object(obj)
+
+def apply_commands(scene, game, terrain):
+    ' Applies commands other than CreateObject - they modify terrain. '
+    for title, args in scene.commands:
+        globals()['handle' + title](game, terrain, **args)
+
+def make_objects(scene, game):
+    ' Yields objects of scene (without adding them to game) in order of spawn_order. '
+    for i in spawn_order(scene):
+        yield make_object(game, **scene.get_object(i))
+
+def get_model_files(scene, loader):
+    ' Returns names of files needed by models of objects in scene. '
+    names = set()
+    for type in scene.types:
+        try:
+            clazz = colobot.game.objects.get(type)
+        except KeyError:
+            continue
+        names |= g3d.model.reader.get_dependencies(loader, clazz.model)
+    return names
+
+def spawn_order(scene):
+    ''' Returns indexes of objects of known types - selectable ones first,
+    others ordered by distance from the first selectable. '''
+    known = []
+    for i, type_index in enumerate(scene.object_types):
+        clazz = colobot.game.objects.objects.get(scene.types[type_index])
+        if clazz:
+            known.append((i, clazz))
+
+    positions = scene.positions
+    selectable = [ i for i, clazz in known if clazz.selectable ]
+    center = positions[selectable[0] * 3: selectable[0] * 3 + 2] if selectable else (0, 0)
+
+    def priority((i, clazz)):
+        dist = (positions[i * 3] - center[0]) ** 2 + (positions[i * 3 + 1] - center[1]) ** 2
+        return (not clazz.selectable, dist)
+
+    return [ i for i, clazz in sorted(known, key=priority) ]
+
+class CompiledScene(object):
+    '''
+    Scene file reduced to commands that have handlers. CreateObject
+    commands (the most common ones) are stored in arrays - only arguments
+    used by create_object are kept.
+    '''
+    version = 1
+
+    def __init__(self):
+        self.commands = [] # (title, args) of other commands
+        self.types = [] # names of object types
+        self.object_types = array.array('H') # indexes to types
+        self.positions = array.array('f') # x, y, z for each object
+        self.dirs = array.array('f')
+
+    def add_object(self, type, pos, dir):
+        if type not in self.types:
+            self.types.append(type)
+        self.object_types.append(self.types.index(type))
+        self.positions.extend(tuple(pos) + (0, ) * (3 - len(tuple(pos))))
+        self.dirs.append(dir)
+
+    def get_object(self, i):
+        return {'type': self.types[self.object_types[i]],
+                'pos': Vector3(*self.positions[i * 3: i * 3 + 3]),
+                'dir': self.dirs[i]}
+
+def compile(lines):
+    scene = CompiledScene()
     for title, args in parse(lines):
-        method = globals().get('handle' + title)
-        if method:
-            method(game, **args)
+        if title == 'CreateObject':
+            try:
+                scene.add_object(args['type'], args['pos'], args.get('dir', 0.0))
+            except KeyError as err:
+                raise SyntaxError('CreateObject without %s' % err)
+        elif 'handle' + title in globals():
+            scene.commands.append((title, args))
+    return scene
+
+_compiled = {}
+_compiled_lock = threading.Lock()
+
+def get_compiled(data, cache_path=CACHE_PATH):
+    '''
+    Returns CompiledScene for content of scene file. Compiled scenes are
+    cached in memory and in `cache_path` directory (by SHA1 of content).
+    '''
+    key = hashlib.sha1(data).hexdigest() + '-%d' % CompiledScene.version
+    with _compiled_lock:
+        if key in _compiled:
+            return _compiled[key]
 
-def handleTerrainRelief(game, image, factor):
+    path = os.path.join(cache_path, key) if cache_path else None
+    scene = None
+    if path and os.path.exists(path):
+        try:
+            with open(path, 'rb') as f:
+                scene = cPickle.load(f)
+        except Exception as err:
+            logging.warning('failed to read compiled scene %s: %s', path, err)
+
+    if scene is None:
+        scene = compile(data.splitlines())
+        if path:
+            _save(path, scene)
+
+    with _compiled_lock:
+        _compiled[key] = scene
+    return scene
+
+def _save(path, scene):
+    try:
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        tmp = '%s.tmp%d' % (path, os.getpid())
+        with open(tmp, 'wb') as f:
+            cPickle.dump(scene, f, cPickle.HIGHEST_PROTOCOL)
+        os.rename(tmp, path)
+    except (IOError, OSError) as err:
+        logging.warning('failed to save compiled scene %s: %s', path, err)
+
+def handleTerrainRelief(game, terrain, image, factor):
     HEIGHT_CONST = 80
     image = image.split('\\')[-1]
     texture = game.loader.get_texture(image)
-    #game.terrain.texture = game.loader.get_texture('desert6.bmp')
-    game.terrain.base_size = 368. * 2 / texture.size[0] # TODO: how Colobot/C++ handles this?
-    game.terrain.load_from_relief(texture,
-                                  height=factor * HEIGHT_CONST)
-
-def handleCreateObject(game, pos, dir, type, cmdline=None, script1=None,
-                       trainer=0, run=None, power=None, selectable=1,
-                       clip=0, option=None, proxyActivate=0, proxyDistance=50):
+    #terrain.texture = game.loader.get_texture('desert6.bmp')
+    terrain.base_size = 368. * 2 / texture.size[0] # TODO: how Colobot/C++ handles this?
+    terrain.load_from_relief(texture,
+                             height=factor * HEIGHT_CONST)
+
+def create_object(game, type, pos, dir):
+    obj = make_object(game, type, pos, dir)
+    if obj:
+        game.add_object(obj)
+
+def make_object(game, type, pos, dir):
+    ' Returns new object of scene type `type` or None if the type is not known. '
     try:
         clazz = colobot.game.objects.get(type)
     except KeyError:
-        return
+        return None
 
-    model = g3d.model.read(loader=game.loader, name=clazz.model).clone()
+    model = g3d.model.read(loader=game.loader, name=clazz.model)
     obj = clazz(game, model)
     if clazz.selectable: #and selectable:
         obj.owner = game.get_player('root') # TODO
@@ -49,7 +187,7 @@ def handleCreateObject(game, pos, dir, type, cmdline=None, script1=None,
         obj.owner = None
     obj.position = Vector3(*pos)
     obj.rotation = get_rotation_quaternion(dir)
-    game.add_object(obj)
+    return obj
 
 def get_rotation_quaternion(dir):
     angle = (dir - 0.5) / 2 * pi
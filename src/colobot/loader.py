@@ -16,19 +16,38 @@
 #
 # Translation of modfile.(h|cpp) from C++ to Python
 
+import os
 import struct
 import collections
+import functools
 import pygame
 import g3d
 import g3d.loader
+import colobot.metafile
 from g3d.math import Vector3, Vector2, pi, Quaternion
 
 # ;;;;;;;;;;;;;;;; PUBLIC API ;;;;;;;;;;;;;;;;;
 
+PIXEL_CACHE_PATH = os.path.expanduser('~/.cache/colobot/textures')
+
 class Loader(g3d.loader.Loader):
     '''
     Manages loading textures and Colobot .mod files.
     '''
+    model_extensions = ('.mod', )
+
+    def __init__(self, enable_textures=True, pixel_cache_path=PIXEL_CACHE_PATH, **kwargs):
+        g3d.loader.Loader.__init__(self, enable_textures, pixel_cache_path, **kwargs)
+
+    def add_metafile(self, path, key=colobot.metafile.cipher_keys['full']):
+        ''' Add entries of original Colobot archive (colobot*.dat) to index.
+        Entries are decrypted when they are opened - the archive does not
+        have to be unpacked. '''
+        metafile = colobot.metafile.MetaFile.open_path(path, key)
+        for name in metafile.entries:
+            self.index[name] = functools.partial(metafile.open, name)
+            self.paths[name] = path
+
     def _find_texture(self, name):
         if name in self.index:
             return name
@@ -117,7 +136,7 @@ def _read_unpack(f, code):
 if __name__ == '__main__':
     import metafile
 
-    f = metafile.MetaFile(metafile.cipher_keys['full'], open('colobot.data/colobot2.dat'))
+    f = metafile.MetaFile.open_path('colobot.data/colobot2.dat')
 
     print list(sorted(f.entries))
 
@@ -17,8 +17,9 @@
 # Translation of metafile.(h|cpp) from C++ to Python
 
 import sys
+import os
+import mmap
 import struct
-import StringIO
 
 # from metafile.cpp
 cipher_keys = {
@@ -27,53 +28,118 @@ cipher_keys = {
               0x96, 0x90, 0x07, 0xcd, 0x11, 0x88, 0x21, ]
 }
 
+class Cipher(object):
+    '''
+    XOR cipher with repeating key. Byte at offset `i` of the file is
+    XORed with key[i % len(key)].
+
+    Instead of looping over bytes, data is decrypted in len(key) strided
+    slices - all bytes in one slice are XORed with the same key byte,
+    so it is a single str.translate call.
+    '''
+    def __init__(self, key):
+        self.key = key
+        self.tables = [ ''.join( chr(k ^ i) for i in xrange(256) ) for k in key ]
+
+    def decrypt(self, data, offset):
+        ' Decrypts `data` which starts at `offset` of the file. '
+        length = len(self.key)
+        out = bytearray(data)
+        for i, table in enumerate(self.tables):
+            start = (i - offset) % length
+            out[start::length] = data[start::length].translate(table)
+        return str(out)
+
 class CryptingFile:
     def __init__(self, key, file):
         self.file = file
-        self.key = key
+        self.cipher = Cipher(key)
         self.i = 0
 
     def seek(self, n):
-        self.i = n % len(self.key)
+        self.i = n
         self.file.seek(n)
-        
+
     def read(self, n=2**30, noenc=False):
         block = self.file.read(n)
+        offset = self.i
+        self.i += len(block)
         if noenc:
-            self.i += len(block)
             return block
-        ret = []
-        length = len(self.key)
-        for ch in block:
-            ret.append(chr(self.key[self.i] ^ ord(ch)))
-            self.i = (self.i + 1) % length
-        return ''.join(ret)
+        return self.cipher.decrypt(block, offset)
 
     def read_unpack(self, code, noenc=False):
         size = struct.calcsize(code)
         return struct.unpack(code, self.read(size, noenc=noenc))
 
 class MetaFile:
+    '''
+    Colobot archive (colobot*.dat). If `file` is a real file, it is
+    memory mapped - only entries that are read are paged in and decrypted.
+    '''
     def __init__(self, key, file):
-        self.file = CryptingFile(key, file)
-        size, = self.file.read_unpack('i', noenc=True)
+        self.cipher = Cipher(key)
+        header = CryptingFile(key, file)
+        size, = header.read_unpack('i', noenc=True)
         self.entries = {}
-        
-        for name, start, length in [ self.file.read_unpack('14sii') for i in xrange(size) ]:
+
+        for name, start, length in [ header.read_unpack('14sii') for i in xrange(size) ]:
             self.entries[name.rstrip('\0')] = (start, length)
 
+        try:
+            self.data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (AttributeError, EnvironmentError, ValueError):
+            # not a real file (or empty one)
+            file.seek(0)
+            self.data = file.read()
+
+    @classmethod
+    def open_path(cls, path, key=cipher_keys['full']):
+        with open(path, 'rb') as f:
+            return cls(key, f)
+
     def read(self, name):
         start, length = self.entries[name]
-        self.file.seek(start)
-        return self.file.read(length)
+        return self.cipher.decrypt(self.data[start:start + length], start)
 
     def open(self, name):
-        return StringIO.StringIO(self.read(name))
+        ' Returns read-only file-like object with content of entry `name`. '
+        start, length = self.entries[name]
+        return EntryFile(self, start, length)
+
+class EntryFile(object):
+    ' File-like view of MetaFile entry - decrypts only the parts that are read. '
+    def __init__(self, metafile, start, length):
+        self.metafile = metafile
+        self.start = start
+        self.length = length
+        self.pos = 0
+
+    def read(self, n=-1):
+        if n < 0:
+            n = self.length - self.pos
+        n = max(0, min(n, self.length - self.pos))
+        offset = self.start + self.pos
+        self.pos += n
+        return self.metafile.cipher.decrypt(self.metafile.data[offset:offset + n], offset)
+
+    def seek(self, pos, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            pos += self.pos
+        elif whence == os.SEEK_END:
+            pos += self.length
+        self.pos = max(0, pos)
+
+    def tell(self):
+        return self.pos
+
+    def close(self):
+        pass
 
 if __name__ == '__main__':
     import sys
     name = 'colobot.data/colobot2.dat' if not sys.argv[1:] else sys.argv[1]
-    f = MetaFile(cipher_keys['full'], open(name))
+    f = MetaFile.open_path(name)
 
     for key in f.entries.keys():
         print key
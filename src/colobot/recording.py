@@ -0,0 +1,135 @@
+# Copyright (C) 2012, Michal Zielinski <michal@zielinscy.org.pl>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Recordings of update channel output, used to replay real traffic in
+benchmarks and UI (see tools/replay.py).
+
+File starts with MAGIC followed by records. Each record is RECORD header
+(kind, time, payload size) followed by payload:
+ - RESOURCE - SHA1 + serialized object (written before the first blob
+   that references it),
+ - TERRAIN - SHA1 of the terrain (its resources are written before),
+ - BLOB - update blob exactly as sent to client.
+'''
+
+import struct
+import threading
+import time
+
+MAGIC = 'colobot-recording 1\n'
+RECORD = struct.Struct('!BdI')
+
+RESOURCE = 1
+TERRAIN = 2
+BLOB = 3
+
+SHA1_LENGTH = 20
+
+class RecordingError(Exception):
+    ' Raised when recording file is malformed. '
+
+class Recorder(object):
+    '''
+    Writes blobs and resources they reference to file. Resources are
+    fetched using `get_resource(sha1)` and `get_dependencies(sha1)`.
+    '''
+    def __init__(self, path, get_resource, get_dependencies):
+        self.get_resource = get_resource
+        self.get_dependencies = get_dependencies
+        self.written = set()
+        self._lock = threading.Lock()
+        self._file = open(path, 'wb')
+        self._file.write(MAGIC)
+
+    def add_terrain(self, sha1):
+        with self._lock:
+            self._write_resources([sha1])
+            self._write(TERRAIN, sha1)
+
+    def add_blob(self, blob, resources):
+        ' Writes blob - `resources` are SHA1s of models of new objects in it. '
+        with self._lock:
+            self._write_resources(resources)
+            self._write(BLOB, blob)
+
+    def _write_resources(self, idents):
+        idents = [ ident for ident in idents if ident not in self.written ]
+        if not idents:
+            return
+        deps = set(idents)
+        for ident in idents:
+            deps.update(self.get_dependencies(ident))
+        for ident in deps - self.written:
+            self._write(RESOURCE, ident + self.get_resource(ident))
+            self.written.add(ident)
+
+    def _write(self, kind, payload):
+        self._file.write(RECORD.pack(kind, time.time(), len(payload)))
+        self._file.write(payload)
+        self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+def read(path):
+    ' Yields (kind, time, payload) from recording file. '
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise RecordingError('%s is not a recording' % path)
+        while True:
+            header = f.read(RECORD.size)
+            if not header:
+                return
+            if len(header) != RECORD.size:
+                raise RecordingError('truncated record header in %s' % path)
+            kind, timestamp, size = RECORD.unpack(header)
+            payload = f.read(size)
+            if len(payload) != size:
+                raise RecordingError('truncated record in %s' % path)
+            yield kind, timestamp, payload
+
+class Recording(object):
+    ' Recording loaded into memory. '
+    def __init__(self):
+        self.resources = {}
+        self.terrain = None
+        self.blobs = [] # (time, blob)
+
+    @classmethod
+    def load(cls, path):
+        self = cls()
+        for kind, timestamp, payload in read(path):
+            if kind == RESOURCE:
+                self.resources[payload[:SHA1_LENGTH]] = payload[SHA1_LENGTH:]
+            elif kind == TERRAIN:
+                self.terrain = payload
+            elif kind == BLOB:
+                self.blobs.append((timestamp, payload))
+            else:
+                raise RecordingError('unknown record kind %d in %s' % (kind, path))
+        return self
+
+    @property
+    def duration(self):
+        if not self.blobs:
+            return 0
+        return self.blobs[-1][0] - self.blobs[0][0]
+
+    @property
+    def size(self):
+        ' Total size of blobs in bytes. '
+        return sum( len(blob) for timestamp, blob in self.blobs )
@@ -18,6 +18,10 @@ import json
 import string
 import threading
 import hashlib
+import collections
+import functools
+import logging
+import time
 
 class NotFoundError(Exception): pass
 
@@ -47,10 +51,10 @@ class List(ProfileEntry):
     default = []
     entry_cls = lambda self, x, y: y
     def get_by(self, attrib, value):
-        for entry in self.file.data:
-            if entry[attrib] == value:
-                return self.entry_cls(self.profile, entry)
-        raise NotFoundError('%s.get_by(%r, %r)' % (self.__class__.__name__, attrib, value))
+        entry = self.file.find(attrib, value)
+        if entry is None:
+            raise NotFoundError('%s.get_by(%r, %r)' % (self.__class__.__name__, attrib, value))
+        return self.entry_cls(self.profile, entry)
 
 # ;;;;;;;;;;;;;;;;;;;;;;;;;;;;; low level ;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;
     
@@ -68,6 +72,167 @@ class File(object):
     def write(self):
         _overwrite(self.path, json.dumps(self.data))
 
+    def find(self, attrib, value):
+        ' Returns first entry (of list) having `attrib` equal to `value` or None. '
+        for entry in self.data:
+            if entry[attrib] == value:
+                return entry
+        return None
+
+class Journal(object):
+    '''
+    List of entries (dicts) stored as snapshot (in the same format as File)
+    and append-only journal of changes, so a change doesn't need to rewrite
+    the whole file. Entries are identified by `key` attribute.
+    Entries are indexed by `key` and by attributes given in `indexes`.
+
+    Journal is flushed and fsynced by background thread at most every
+    `sync_interval` seconds and compacted into snapshot when it grows much
+    larger than the data. On compaction entries for which `is_expired`
+    returns True are dropped.
+
+    Disk writes (fsync and writing snapshot) are done without holding
+    `lock`, so find and put don't wait for them.
+    '''
+    sync_interval = 0.2
+    compact_ratio = 2
+    compact_min = 100
+
+    def __init__(self, path, key, indexes=(), is_expired=None):
+        self.path = path
+        self.journal_path = path + '.journal'
+        # journal being compacted - replayed if snapshot wasn't written
+        self.old_journal_path = path + '.journal.old'
+        self.key = key
+        self.is_expired = is_expired
+        self.lock = threading.RLock()
+        # serializes sync and compact
+        self._sync_lock = threading.RLock()
+        self._entries = collections.OrderedDict()
+        self._indexes = dict( (name, {}) for name in set((key, ) + tuple(indexes)) )
+        self._journal_length = 0
+
+        for entry in File(path, default=[]).data:
+            self._put(entry)
+        self._replay(self.old_journal_path)
+        self._replay(self.journal_path)
+        if os.path.exists(self.old_journal_path):
+            # finish interrupted compaction, the next one would overwrite it
+            _overwrite(self.path, json.dumps(self._entries.values()))
+            os.remove(self.old_journal_path)
+
+        self._journal = open(self.journal_path, 'a')
+        self._dirty = threading.Condition(self.lock)
+        self._need_sync = False
+        thread = threading.Thread(target=self._sync_loop, name='journal sync')
+        thread.daemon = True
+        thread.start()
+
+    @property
+    def data(self):
+        with self.lock:
+            return self._entries.values()
+
+    def find(self, attrib, value):
+        with self.lock:
+            if attrib in self._indexes:
+                return self._indexes[attrib].get(value)
+            for entry in self._entries.itervalues():
+                if entry[attrib] == value:
+                    return entry
+            return None
+
+    def put(self, entry):
+        ' Adds entry or replaces entry with the same key. '
+        with self.lock:
+            self._put(entry)
+            self._append({'put': entry})
+
+    def delete(self, key_value):
+        with self.lock:
+            self._delete(key_value)
+            self._append({'delete': key_value})
+
+    def _put(self, entry):
+        self._delete(entry[self.key])
+        self._entries[entry[self.key]] = entry
+        for name, index in self._indexes.items():
+            if name in entry:
+                index[entry[name]] = entry
+
+    def _delete(self, key_value):
+        entry = self._entries.pop(key_value, None)
+        if entry is None:
+            return
+        for name, index in self._indexes.items():
+            if name in entry and index.get(entry[name]) is entry:
+                del index[entry[name]]
+
+    def _replay(self, path):
+        try:
+            f = open(path)
+        except IOError:
+            return
+        with f:
+            for line in f:
+                try:
+                    change = json.loads(line)
+                except ValueError:
+                    # last line may be incomplete after crash
+                    logging.warn('ignoring corrupted line in %s', path)
+                    continue
+                if 'put' in change:
+                    self._put(change['put'])
+                else:
+                    self._delete(change['delete'])
+                self._journal_length += 1
+
+    def _append(self, change):
+        self._journal.write(json.dumps(change) + '\n')
+        self._journal_length += 1
+        self._need_sync = True
+        self._dirty.notify()
+
+    def _sync_loop(self):
+        while True:
+            with self.lock:
+                while not self._need_sync:
+                    self._dirty.wait()
+            # let more changes come before paying for fsync
+            time.sleep(self.sync_interval)
+            self.sync()
+
+    def sync(self):
+        ' Writes journal to disk and compacts it if needed. '
+        with self._sync_lock:
+            with self.lock:
+                self._journal.flush()
+                self._need_sync = False
+                journal = self._journal
+                need_compact = self._journal_length > max(
+                    self.compact_min, self.compact_ratio * len(self._entries))
+            # journal isn't closed meanwhile - compact holds _sync_lock too
+            os.fsync(journal.fileno())
+            if need_compact:
+                self.compact()
+
+    def compact(self):
+        ' Writes all entries to snapshot and clears journal. '
+        with self._sync_lock:
+            with self.lock:
+                if self.is_expired:
+                    for key_value, entry in self._entries.items():
+                        if self.is_expired(entry):
+                            self._delete(key_value)
+                entries = [ dict(entry) for entry in self._entries.values() ]
+                # changes from now on go to the new journal
+                self._journal.close()
+                os.rename(self.journal_path, self.old_journal_path)
+                self._journal = open(self.journal_path, 'w')
+                self._journal_length = 0
+            _overwrite(self.path, json.dumps(entries))
+            os.remove(self.old_journal_path)
+
 def join(*args):
     if not args:
         return ''
@@ -84,6 +249,8 @@ def _overwrite(path, content):
     new = path + '.tmp' + random_string()
     with open(new, 'w') as f:
         f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
     os.rename(new, path)
 
     
@@ -0,0 +1,215 @@
+# Copyright (C) 2012, Michal Zielinski <michal@zielinscy.org.pl>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Event loop running server work (RPC calls, game ticks, sending updates)
+in one thread. CPU heavy work is explicitly passed to a pool of workers
+with EventLoop.run_in_executor.
+'''
+
+import threading
+import heapq
+import itertools
+import time
+import logging
+import multiprocessing.pool
+
+_local = threading.local()
+
+class Handle(object):
+    ' Returned by EventLoop.call_* - allows cancelling the call. '
+    def __init__(self, func, interval):
+        self.func = func
+        self.interval = interval
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+class EventLoop(object):
+    '''
+    `workers` threads run CPU heavy work (run_in_executor). Sends to
+    clients (send_async) have `senders` threads of their own - a stalled
+    client blocks its sender, so it must not hold back RPC calls.
+    '''
+    def __init__(self, workers=4, senders=16):
+        self._heap = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+        self.executor = multiprocessing.pool.ThreadPool(workers)
+        self.sender = multiprocessing.pool.ThreadPool(senders)
+
+    def call_soon(self, func, *args):
+        ' Calls func(*args) in loop thread as soon as possible. Thread-safe. '
+        return self.call_later(0, func, *args)
+
+    def call_later(self, delay, func, *args):
+        ' Calls func(*args) in loop thread after `delay` seconds. Thread-safe. '
+        handle = Handle(lambda: func(*args), None)
+        self._schedule(time.time() + delay, handle)
+        return handle
+
+    def call_every(self, interval, func):
+        '''
+        Calls func in loop thread every `interval` seconds with one
+        argument - time elapsed from the previous call. Thread-safe.
+        '''
+        state = {'last': time.time()}
+        def call():
+            now = time.time()
+            func(now - state['last'])
+            state['last'] = now
+
+        handle = Handle(call, interval)
+        self._schedule(time.time() + interval, handle)
+        return handle
+
+    def run_in_executor(self, func, *args, **kwargs):
+        '''
+        Runs func(*args) in worker pool. If `callback` is given it will be
+        called in loop thread with the result. Returns AsyncResult.
+        '''
+        callback = kwargs.pop('callback', None)
+        if kwargs:
+            raise TypeError('unexpected arguments %s' % kwargs.keys())
+        def call():
+            _local.in_executor = True
+            return func(*args)
+        return self._apply(self.executor, call, callback)
+
+    def _apply(self, pool, func, callback):
+        def done(result):
+            self.call_soon(callback, result)
+        return pool.apply_async(func, callback=done if callback else None)
+
+    def send_async(self, channel, data, callback=None):
+        '''
+        Sends data to channel from sender pool (send blocks while the
+        client is slow). If `callback` is given it will be called in loop
+        thread with None or with the exception raised by send.
+        '''
+        def send():
+            try:
+                channel.send(data)
+            except Exception as err:
+                logging.debug('sending to %r failed', channel, exc_info=True)
+                return err
+        return self._apply(self.sender, send, callback)
+
+    def queue_size(self):
+        ' Returns number of scheduled calls (including periodic ones). '
+        return len(self._heap)
+
+    def in_executor(self):
+        ' Returns True if called from worker thread of executor. '
+        return getattr(_local, 'in_executor', False)
+
+    def call_and_wait(self, func, *args):
+        '''
+        Calls func(*args) in loop thread and waits for the result.
+        Exceptions are reraised in calling thread.
+        '''
+        if threading.current_thread() is self._thread:
+            return func(*args)
+
+        done = threading.Event()
+        result = []
+        def call():
+            try:
+                result.append((True, func(*args)))
+            except Exception as err:
+                result.append((False, err))
+            finally:
+                done.set()
+
+        self.call_soon(call)
+        done.wait()
+        ok, value = result[0]
+        if not ok:
+            raise value
+        return value
+
+    def _schedule(self, when, handle):
+        with self._cond:
+            heapq.heappush(self._heap, (when, next(self._counter), handle))
+            self._cond.notify()
+
+    def loop(self):
+        self._thread = threading.current_thread()
+        while True:
+            self.tick()
+
+    def start(self):
+        thread = threading.Thread(target=self.loop, name='event loop')
+        thread.daemon = True
+        thread.start()
+
+    def tick(self):
+        ' Waits for the first scheduled call and runs it. '
+        with self._cond:
+            while True:
+                now = time.time()
+                if self._heap and self._heap[0][0] <= now:
+                    when, _, handle = heapq.heappop(self._heap)
+                    break
+                self._cond.wait(self._heap[0][0] - now if self._heap else None)
+
+        if handle.cancelled:
+            return
+
+        if handle.interval is not None:
+            # schedule next call before running, so an exception doesn't stop it
+            self._schedule(max(when + handle.interval, now), handle)
+
+        try:
+            handle.func()
+        except Exception:
+            logging.exception('exception in event loop callback')
+
+class LoopDispatcher(object):
+    '''
+    Object passed to JSON-RPC channel instead of ConnectionHandler - it
+    runs rpc_* methods in event loop thread (or in executor if they are
+    marked with @blocking).
+
+    The thread that received the call still waits for the result, so each
+    connection keeps its JSON-RPC thread - only update channels are run
+    by the loop without threads of their own.
+    '''
+    def __init__(self, handler, loop):
+        self._handler = handler
+        self._loop = loop
+
+    def __getattr__(self, name):
+        method = getattr(self._handler, name)
+        if not name.startswith('rpc_'):
+            return method
+
+        def call(*args, **kwargs):
+            if getattr(method, 'blocking', False):
+                if self._loop.in_executor():
+                    # e.g. batched call - don't wait for another worker
+                    return method(*args, **kwargs)
+                return self._loop.run_in_executor(lambda: method(*args, **kwargs)).get()
+            else:
+                return self._loop.call_and_wait(lambda: method(*args, **kwargs))
+        call.__name__ = name
+        return call
+
+def blocking(method):
+    ' Marks rpc_* method that is too slow to be run in event loop thread. '
+    method.blocking = True
+    return method
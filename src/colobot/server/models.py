@@ -16,9 +16,10 @@
 import threading
 import os
 import logging
+import time
 
 from colobot.server.db import ProfileEntry, sha256, List, Dict, \
-    join, File, NotFoundError, random_string
+    join, File, Journal, NotFoundError, random_string
 
 class Profile:
     def __init__(self, path):
@@ -38,11 +39,16 @@ class Profile:
         path = os.path.join(self.path, join(*args))
         return File(path, **kwargs)
 
+    def get_journal(self, name, **kwargs):
+        path = os.path.join(self.path, join(name))
+        return Journal(path, **kwargs)
+
 class AuthenticationError(Exception):
     pass
 
 class User:
     def __init__(self, profile, entry):
+        self.profile = profile
         self.entry = entry
 
     def check_permission(self, name):
@@ -56,9 +62,8 @@ class User:
         return False # TODO: ACL
 
     def change_password(self, password, salt):
-        self[salt] = salt
-        self[password] = password
-        self.profile.users.write()
+        self.entry = dict(self.entry, password=password, salt=salt)
+        self.profile.users.file.put(self.entry)
 
     @property
     def login(self):
@@ -71,7 +76,7 @@ class Users(List):
     entry_cls = User
 
     def __init__(self, profile):
-        self.file = profile.get('users')
+        self.file = profile.get_journal('users', key='login')
         self.profile = profile
         try:
             self.get_by('login', 'root')
@@ -83,8 +88,7 @@ class Users(List):
         self.create_user(login='root', mail='', password=sha256('\0'), salt='')
 
     def create_user(self, login, mail, password, salt):
-        self.file.data.append({'login': login, 'mail': mail, 'password': password, 'salt': salt})
-        self.file.write()
+        self.file.put({'login': login, 'mail': mail, 'password': password, 'salt': salt})
 
     def authenticate(self, auth_token, login, password_token):
         user = self.get_by('login', login)
@@ -96,15 +100,26 @@ class Users(List):
             raise AuthenticationError()
 
 class Sessions(List):
+    lifetime = 30 * 24 * 3600
+
     def __init__(self, profile):
         self.profile = profile
-        self.file = profile.get('sessions')
+        self.file = profile.get_journal('sessions', key='uid',
+                                        is_expired=self._is_expired)
 
     def create_session(self, login):
         uid = random_string(12)
-        self.file.data.append({'login': login, 'uid': uid})
-        self.file.write()
+        self.file.put({'login': login, 'uid': uid, 'expires': time.time() + self.lifetime})
         return uid
 
     def get_session(self, uid):
-        return self.get_by('uid', uid)['login']
+        entry = self.get_by('uid', uid)
+        if self._is_expired(entry):
+            self.file.delete(uid)
+            raise NotFoundError('session expired')
+        return entry['login']
+
+    @staticmethod
+    def _is_expired(entry):
+        # sessions created by older versions don't expire
+        return entry.get('expires', float('inf')) < time.time()
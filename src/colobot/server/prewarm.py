@@ -0,0 +1,90 @@
+# Copyright (C) 2012, Michal Zielinski <michal@zielinscy.org.pl>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+Loads models used by the game before the server starts accepting
+connections, so the first load_scene doesn't stall running games.
+'''
+
+import resource
+import logging
+import time
+
+import g3d.model
+import g3d.model.reader
+
+import colobot.game
+import colobot.game.objects
+import colobot.game.scene_file
+
+def find_scene_textures(loader):
+    ' Returns names of relief images used by scenes in loader index. '
+    names = set()
+    for name in loader.index:
+        if not (name.startswith('scene') and name.endswith('.txt')):
+            continue
+        try:
+            # also fills cache of compiled scenes
+            scene = colobot.game.scene_file.get_compiled(loader.read_file(name))
+            for title, args in scene.commands:
+                if title == 'TerrainRelief':
+                    names.add(args['image'].split('\\')[-1])
+        except SyntaxError as err:
+            logging.warning('prewarm: failed to parse %s: %s', name, err)
+    return names & set(loader.index)
+
+def prewarm(loader, serializer):
+    '''
+    Loads all object models (and their parts and textures) into loader
+    caches and adds them to serializer. Meshes are loaded by loader
+    prefetch threads, building and hashing models is done in the calling
+    thread. Returns manifest - dict mapping model name to SHA1 (as hex)
+    of the model as spawned by game.
+    '''
+    start = time.time()
+    models = sorted(set( clazz.model for clazz in colobot.game.objects.objects.values() ))
+
+    files = set()
+    for name in models:
+        files |= g3d.model.reader.get_dependencies(loader, name)
+    textures = find_scene_textures(loader)
+    files |= textures
+
+    names = sorted(files)
+    try:
+        for name, result in zip(names, loader.prefetch(names)):
+            try:
+                result.get()
+            except Exception as err:
+                # the game will fail to load it too, but other models are fine
+                logging.warning('prewarm: failed to load %s: %s', name, err)
+    finally:
+        # workers are forked after prewarm - they must not inherit the threads
+        loader.close()
+    prefetch_time = time.time() - start
+
+    manifest = {}
+    for name in models:
+        try:
+            model = g3d.model.read(loader=loader, name=name)
+        except Exception as err:
+            logging.warning('prewarm: failed to read model %s: %s', name, err)
+            continue
+        model.root.scale = colobot.game.Object.model_scale
+        manifest[name] = serializer.add(model).encode('hex')
+
+    logging.info('prewarm: %d models (%d files) in %.2f s (prefetch %.2f s), max RSS %d KB',
+                 len(models), len(files), time.time() - start, prefetch_time,
+                 resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+    return manifest
@@ -21,28 +21,77 @@ import time
 import logging
 import os
 import json
+import re
+import Queue
 
 import colobot.server.db
 import colobot.game
+import colobot.control
+import colobot.recording
 
 from colobot.server.models import Profile
 from colobot.server.db import random_string
+from colobot.server.loop import EventLoop, LoopDispatcher, blocking
+from colobot.server.shard import WorkerPool, RemoteUpdateChannelHandler
+from colobot.server.stats import Metrics, MeteredChannel, MeteredDispatcher
+from colobot.server import stats
+from colobot.server.prewarm import prewarm
 
 import g3d.serialize
 
 SHA1_LENGTH = 20 # TODO: move to colobot.common
 
 class Server:
-    def __init__(self, profile, loader):
+    '''
+    Colobot server. If `event_loop` is true, game ticks, sending updates
+    and RPC calls are run in one event loop thread instead of thread
+    per game ticker and update channel.
+    If `workers` is greater than zero, games are run in that many worker
+    processes (see colobot.server.shard) - this server only routes
+    requests to them.
+    If `stats_interval` is given, metrics are written to log every
+    `stats_interval` seconds.
+    If `prewarm` is true, all object models are loaded on startup (see
+    colobot.server.prewarm) and their SHA1s are saved in manifest.json
+    in profile directory.
+    If `record_path` is given, output of every update channel is recorded
+    to a file in that directory (see colobot.recording).
+    '''
+    tick_interval = 0.05
+    update_interval = 0.1
+    # serialized models kept for clients to fetch
+    serializer_budget = 128 * 1024 * 1024
+
+    def __init__(self, profile, loader, event_loop=False, workers=0, stats_interval=None,
+                 prewarm=False, record_path=None):
         self.profile = profile
         self.loader = loader
-        self.serializer = g3d.serialize.Serializer()
+        self.record_path = record_path
+        self.serializer = g3d.serialize.Serializer(canonical=True, budget=self.serializer_budget)
         self.lock = threading.RLock()
-        self.game_ticker = g3d.Timer(min_interval=0.05)
         self.games = {}
-
-        multisock.async(lambda: (multisock.set_thread_name('games'),
-                                 self.game_ticker.loop()))
+        self.manifest = {}
+        if prewarm:
+            # before starting workers - they will inherit loaded models
+            self.prewarm()
+        # start workers before any threads, so they are not forked
+        self.shards = WorkerPool(loader, workers) if workers else None
+
+        self.game_ticker = g3d.Scheduler(step=self.tick_interval)
+        self.metrics = Metrics()
+        self._setup_metrics()
+        if stats_interval:
+            self.game_ticker.add_interval(stats_interval, self.metrics.log, name='stats')
+
+        if event_loop:
+            self.event_loop = EventLoop()
+            self.metrics.gauge('loop.queue', self.event_loop.queue_size)
+            self.event_loop.call_every(self.tick_interval, lambda time: self.game_ticker.tick())
+            self.event_loop.start()
+        else:
+            self.event_loop = None
+            multisock.async(lambda: (multisock.set_thread_name('games'),
+                                     self.game_ticker.loop()))
 
     def _init(self, address):
         thread = multisock.SocketThread()
@@ -56,7 +105,20 @@ class Server:
     def start(self, address):
         self._init(address).start()
 
+    def prewarm(self):
+        self.manifest = prewarm(self.loader, self.serializer)
+        with open(os.path.join(self.profile.path, 'manifest.json'), 'w') as f:
+            json.dump(self.manifest, f, indent=4, sort_keys=True)
+
+    def _setup_metrics(self):
+        stats.watch_serializer(self.metrics, self.serializer)
+        stats.watch_loader(self.metrics, self.loader)
+        stats.watch_scheduler(self.metrics, 'ticker', self.game_ticker)
+        if self.shards:
+            self.metrics.gauge('workers', self.shards.get_stats)
+
     def accept(self, socket):
+        self.metrics.counter('connections').add()
         ConnectionHandler(server=self, profile=self.profile, socket=socket)
 
     # -----------------------------
@@ -65,8 +127,64 @@ class Server:
         if name in self.games:
             raise KeyError(name)
 
+        if self.shards:
+            self.games[name] = self.shards.create_game(name)
+            return
+
         game = self.games[name] = colobot.game.Game(self.loader)
-        self.game_ticker.add_ticker(game.tick)
+        self.game_ticker.add_ticker(self.metrics.timed('tick.%s' % name, game.tick),
+                                    name='game %s' % name)
+        stats.watch_game(self.metrics, name, game)
+
+    def get_terrain_id(self, game_name):
+        game = self.games[game_name]
+        if self.shards:
+            return game.get_terrain_id()
+        return self.serializer.add(game.terrain)
+
+    def make_recorder(self, game_name, input_source):
+        ' Returns Recorder for new update channel or None if recording is disabled. '
+        if not self.record_path:
+            return None
+        if not os.path.exists(self.record_path):
+            os.makedirs(self.record_path)
+        name = '%s-%s-%s.rec' % (re.sub(r'[^\w.-]', '_', game_name),
+                                 time.strftime('%Y%m%d-%H%M%S'), input_source)
+        path = os.path.join(self.record_path, name)
+        logging.info('recording updates of game %r to %s', game_name, path)
+        recorder = colobot.recording.Recorder(path, self.get_by_sha1,
+                                              self.get_dependencies_by_sha1)
+        recorder.add_terrain(self.get_terrain_id(game_name))
+        return recorder
+
+    def get_by_sha1(self, sha1):
+        if self.shards:
+            return self.shards.get_by_sha1(sha1)
+        return self.serializer.get_by_sha1(sha1)
+
+    def get_dependencies_by_sha1(self, sha1):
+        if self.shards:
+            return self.shards.get_dependencies_by_sha1(sha1)
+        return self.serializer.get_dependencies_by_sha1(sha1)
+
+    def open_update_channel(self, channel, game, input_source=None, recorder=None):
+        channel = MeteredChannel(channel, self.metrics, 'updates')
+        channel = BlobSender(channel, self.metrics, self.event_loop)
+        if self.shards:
+            handler = RemoteUpdateChannelHandler(channel, game, input_source, recorder)
+            if self.event_loop:
+                handler.handle = self.event_loop.call_every(
+                    self.update_interval,
+                    lambda time: handler.tick_async(self.event_loop))
+            else:
+                multisock.async(handler.loop)
+            return
+
+        handler = UpdateChannelHandler(channel, self, game, input_source, recorder)
+        if self.event_loop:
+            handler.handle = self.event_loop.call_every(self.update_interval, handler.tick)
+        else:
+            multisock.async(handler.loop)
 
 class ConnectionHandler:
     def __init__(self, server, profile, socket):
@@ -74,6 +192,8 @@ class ConnectionHandler:
         self.socket = socket
         self.profile = profile
         self.user = None
+        # identifies messages from input channels of this connection
+        self.input_source = random_string()
 
         self.reset_auth_token()
         self.setup_connection()
@@ -84,7 +204,11 @@ class ConnectionHandler:
     def setup_connection(self):
         main = self.socket.get_main_channel()
         self.rpc = multisock.jsonrpc.JsonRpcChannel(main, async=True)
-        self.rpc.server = self
+        if self.server.event_loop:
+            server = LoopDispatcher(self, self.server.event_loop)
+        else:
+            server = self
+        self.rpc.server = MeteredDispatcher(server, self.server.metrics)
 
     def rpc__getAttributeNames(self):
         # for iPython
@@ -94,6 +218,23 @@ class ConnectionHandler:
         # for iPython
         return []
 
+    @blocking
+    def rpc_batch(self, calls):
+        '''
+        Executes list of calls (each is [name, args, kwargs]) in order and
+        returns list of results - {"result": value} or {"error": message}
+        for each call.
+        '''
+        results = []
+        for name, args, kwargs in calls:
+            try:
+                method = getattr(self.rpc.server, 'rpc_' + name)
+                results.append({'result': method(*args, **kwargs)})
+            except Exception as err:
+                logging.debug('batched call %s failed', name, exc_info=True)
+                results.append({'error': '%s: %s' % (type(err).__name__, err)})
+        return results
+
     # --------------------------
 
     def rpc_eval(self, code):
@@ -108,6 +249,7 @@ class ConnectionHandler:
         return {'token': self.auth_token,
                 'salt': self.profile.users.get_by('login', login)['salt'] if login else None}
 
+    @blocking
     def rpc_authenticate(self, login, password_token):
         self.user = self.profile.users.authenticate(self.auth_token, login, password_token)
         self.reset_auth_token()
@@ -122,6 +264,17 @@ class ConnectionHandler:
             self.user.check_permission('manage-users')
         self.profile.users.get_by('name', login).change_password(password=password_token, salt=salt)
 
+    def rpc_stats(self):
+        ' Returns snapshot of server metrics (see colobot.server.stats). '
+        # check_permission only reports the result
+        if self.user is None or not self.user.check_permission('view-stats'):
+            raise RuntimeError('view-stats permission required')
+        return self.server.metrics.snapshot()
+
+    def rpc_get_manifest(self):
+        ' Returns SHA1s of prewarmed models (by model name). '
+        return self.server.manifest
+
     def rpc_list_games(self):
         return self.server.games.keys()
 
@@ -132,67 +285,231 @@ class ConnectionHandler:
     def rpc_get_dependencies(self, objects_sha1):
         l = []
         for object_sha1 in objects_sha1:
-            l += self.server.serializer.get_dependencies_by_sha1(object_sha1.decode('hex'))
+            l += self.server.get_dependencies_by_sha1(object_sha1.decode('hex'))
         return [ ident.encode('hex') for ident in l ]
 
     def rpc_get_resources(self, identifiers):
-        channel = self.socket.new_channel()
+        channel = MeteredChannel(self.socket.new_channel(), self.server.metrics, 'resources')
         for ident in identifiers:
             ident = ident.decode('hex')
             assert type(ident) == str and len(ident) == SHA1_LENGTH, repr(ident)
-            data = self.server.serializer.get_by_sha1(ident)
+            data = self.server.get_by_sha1(ident)
             channel.send_async(ident + data)
         return channel.id
 
     # ---- GAME -----
 
+    @blocking
     def rpc_load_terrain(self, game_name, name):
         self.user.check_game_permission(game_name, 'manage')
         self.server.games[game_name].load_terrain(name)
 
+    @blocking
     def rpc_get_terrain(self, game_name):
-        terrain = self.server.games[game_name].terrain
-        return self.server.serializer.add(terrain).encode('hex')
+        return self.server.get_terrain_id(game_name).encode('hex')
 
     def rpc_open_update_channel(self, game_name):
         channel = self.socket.new_channel()
-        handler = UpdateChannelHandler(channel, self.server, self.server.games[game_name])
+        self.server.open_update_channel(channel, self.server.games[game_name],
+                                        input_source=self.input_source,
+                                        recorder=self.server.make_recorder(
+                                            game_name, self.input_source))
+        return channel.id
+
+    def rpc_open_input_channel(self, game_name):
+        channel = self.socket.new_channel()
+        handler = InputChannelHandler(channel, self.server.games[game_name],
+                                      self.user.login, self.input_source,
+                                      self.server.metrics)
         multisock.async(handler.loop)
         return channel.id
 
+    @blocking
     def rpc_create_static_object(self, game_name, model_name):
         self.user.check_game_permission(game_name, 'manage')
         self.server.games[game_name].create_static_object(self.user.login, model_name)
 
     def rpc_get_user_objects(self, game_name):
-        return [ object.ident for object in
-                 self.server.games[game_name].get_player_objects(self.user.login) ]
+        return self.server.games[game_name].get_player_object_ids(self.user.login)
 
     def rpc_motor(self, game_name, bot_id, motor):
         self.server.games[game_name].motor(self.user.login, bot_id, motor)
 
+    @blocking
     def rpc_load_scene(self, game_name, scene_name):
         self.user.check_game_permission(game_name, 'manage')
         self.server.games[game_name].load_scene(scene_name)
 
 
+class InputChannelHandler(object):
+    ''' Receives control messages (see colobot.control) and passes them to
+    game. Nothing is sent back - applied messages are acknowledged in
+    updates. '''
+    def __init__(self, channel, game, player_name, source, metrics):
+        self.metrics = metrics
+        self.channel = channel
+        self.game = game
+        self.player_name = player_name
+        self.source = source
+
+    def loop(self):
+        multisock.set_thread_name('input recv')
+        while True:
+            message = self.channel.recv()
+            self.metrics.counter('input.messages').add()
+            try:
+                self.game.handle_input(self.source, self.player_name, message)
+            except colobot.control.ControlError as err:
+                logging.warning('%s: %s', self.player_name, err)
+
+class BlobSender(object):
+    '''
+    Sends blobs to channel in background and keeps track of bytes that
+    were not sent yet. Producers should check busy() and skip the blob if
+    it returns True - it would only wait in queue and get stale.
+
+    Without event loop blobs are sent by a dedicated thread. With it, they
+    are passed one at a time to EventLoop.send_async, so idle channels
+    don't need threads of their own.
+    '''
+    max_outstanding = 64 * 1024
+    max_pending = 2
+
+    def __init__(self, channel, metrics, event_loop=None):
+        self.channel = channel
+        self.metrics = metrics
+        self.event_loop = event_loop
+        self.outstanding = 0 # bytes
+        self.pending = 0 # blobs
+        self.closed = False
+        self._lock = threading.Lock()
+        self._queue = Queue.Queue()
+        self._sending = False # used only with event loop
+        self._send_time = metrics.histogram('updates.send')
+        if not event_loop:
+            multisock.async(self._loop)
+
+    def busy(self):
+        with self._lock:
+            return (self.closed or self.pending >= self.max_pending
+                    or self.outstanding >= self.max_outstanding)
+
+    def send(self, blob):
+        with self._lock:
+            self.outstanding += len(blob)
+            self.pending += 1
+        self.metrics.counter('updates.outstanding_bytes').add(len(blob))
+        self._queue.put(blob)
+        if self.event_loop:
+            self._send_next()
+
+    def close(self):
+        ' Stops sending - blobs still in queue are dropped. '
+        self.closed = True
+        self._queue.put(None) # wakes up sender thread
+
+    def _sent(self, blob, start):
+        self._send_time.add(time.time() - start)
+        with self._lock:
+            self.outstanding -= len(blob)
+            self.pending -= 1
+        self.metrics.counter('updates.outstanding_bytes').add(-len(blob))
+
+    def _send_next(self):
+        with self._lock:
+            if self._sending or self.closed or self._queue.empty():
+                return
+            self._sending = True
+        blob = self._queue.get()
+        start = time.time()
+
+        def done(error):
+            self._sent(blob, start)
+            with self._lock:
+                self._sending = False
+            if error:
+                self.closed = True
+            else:
+                self._send_next()
+
+        self.event_loop.send_async(self.channel, blob, callback=done)
+
+    def _loop(self):
+        multisock.set_thread_name('blob sender')
+        try:
+            while not self.closed:
+                blob = self._queue.get()
+                if blob is None:
+                    break
+                start = time.time()
+                try:
+                    self.channel.send(blob)
+                finally:
+                    self._sent(blob, start)
+        except Exception:
+            logging.debug('sending blobs failed', exc_info=True)
+            self.closed = True
+
 class UpdateChannelHandler(object):
-    def __init__(self, channel, server, game):
+    '''
+    Sends game state to client. New and deleted objects are computed
+    against the state from the last sent blob - if the channel is busy,
+    tick is skipped and the next blob carries all changes since then.
+
+    If client reported its view (see colobot.control.VIEW), only objects
+    inside it are sent - objects leaving the area are sent as deleted and
+    objects entering it as new. Objects already sent are kept until they
+    are `interest_hysteresis` (fraction of radius) outside the area.
+    '''
+    interest_hysteresis = 0.2
+
+    def __init__(self, channel, server, game, input_source=None, recorder=None):
         self.channel = channel
         self.game = game
         self.server = server
+        self.input_source = input_source
+        self.recorder = recorder # colobot.recording.Recorder
 
         self.last_objects = set()
+        self.send = channel.send
+
+        self.handle = None # set when run by event loop
+        self.timer = None
+        self.stopped = False
 
     def loop(self):
         multisock.set_thread_name('update sender')
-        timer = g3d.Timer(min_interval=0.1)
-        timer.add_ticker(self.tick)
-        timer.loop()
+        self.timer = g3d.Scheduler(step=0.1, max_steps=1)
+        self.timer.add_ticker(self.tick)
+        if not self.stopped:
+            self.timer.loop()
+
+    def stop(self):
+        ' Stops sending updates and closes channel. '
+        if self.stopped:
+            return
+        self.stopped = True
+        if self.handle:
+            self.handle.cancel()
+        if self.timer:
+            self.timer.stop()
+        self.channel.close()
+        if self.recorder is not None:
+            self.recorder.close()
+        # view is reported by input channel of the same connection
+        self.game.views.pop(self.input_source, None)
 
     def tick(self, _):
+        if self.channel.closed:
+            self.stop()
+            return
+
+        if self.channel.busy():
+            self.server.metrics.counter('updates.coalesced').add()
+            return
+
         # TODO: use denser format
-        objects = set(self.game.get_objects())
+        objects = self.get_interesting(self.game.get_objects())
 
         new_objects = objects - self.last_objects
         deleted_objects = self.last_objects - objects
@@ -200,16 +517,38 @@ class UpdateChannelHandler(object):
 
         updates_time = time.time()
         for obj in objects:
-            updates.append((obj.ident, obj.position, obj.velocity, obj.rotation, None))
+            position, velocity, rotation = obj.snapshot
+            updates.append((obj.ident, position, velocity, rotation, None))
 
+        new = [ (obj.ident, self.server.serializer.add(obj.model)) for obj in new_objects ]
         data = (
                 updates_time,
-                [ (obj.ident, self.server.serializer.add(obj.model)) for obj in new_objects ],
+                new,
                 [ obj.ident for obj in deleted_objects ],
                 updates,
+                self.game.input_acks.get(self.input_source, 0),
+                self.game.loading_progress,
         )
 
         blob = self.server.serializer.serialize(data)
-        self.channel.send(blob)
+        self.send(blob)
+        if self.recorder is not None:
+            self.recorder.add_blob(blob, [ model for ident, model in new ])
 
         self.last_objects = objects
+
+    def get_interesting(self, objects):
+        view = self.game.views.get(self.input_source)
+        if not view:
+            return set(objects)
+
+        x, y, radius = view
+        inner = radius ** 2
+        outer = (radius * (1 + self.interest_hysteresis)) ** 2
+        result = set()
+        for obj in objects:
+            position = obj.snapshot[0]
+            dist = (position.x - x) ** 2 + (position.y - y) ** 2
+            if dist <= (outer if obj in self.last_objects else inner):
+                result.add(obj)
+        return result
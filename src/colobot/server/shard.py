@@ -0,0 +1,402 @@
+# Copyright (C) 2012, Michal Zielinski <michal@zielinscy.org.pl>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Running games in worker processes. Each worker has its own copy of loader
+and its own serializer, ticks its games in its own ticker thread and
+answers requests sent by the front-end Server through a pipe.
+
+Requests carry ids, so several of them may be in flight at once. Game
+calls (which may take long, e.g. load_scene) are run by a thread of their
+game, other requests (update polls, resources) are answered meanwhile.
+'''
+
+import multiprocessing
+import multisock
+import threading
+import itertools
+import logging
+import traceback
+import Queue
+
+import colobot.game
+import colobot.control
+import g3d
+import g3d.cache
+import g3d.serialize
+
+from colobot.server.stats import Metrics
+from colobot.server import stats
+
+class WorkerError(Exception):
+    ' Raised when worker failed with exception that could not be sent back. '
+
+# ;;;;;;;;;;;;;;;;;;;;;;;;;; worker process ;;;;;;;;;;;;;;;;;;;;;;;;;;;;
+
+class Worker(object):
+    ''' State of worker process. Methods named cmd_* can be called by
+    front-end with WorkerClient.call. '''
+    tick_interval = 0.05
+    serializer_budget = 128 * 1024 * 1024
+
+    def __init__(self, loader):
+        self.loader = loader
+        self.serializer = g3d.serialize.Serializer(canonical=True, budget=self.serializer_budget)
+        self.games = {}
+        self.update_handlers = {}
+        self._next_handler_id = 0
+        self._game_calls = {} # game name -> Queue of (call id, method, args)
+        self._send_lock = threading.Lock()
+        self._conn = None
+        self.game_ticker = g3d.Scheduler(step=self.tick_interval)
+        self.metrics = Metrics()
+        stats.watch_serializer(self.metrics, self.serializer)
+        stats.watch_loader(self.metrics, self.loader)
+        stats.watch_scheduler(self.metrics, 'ticker', self.game_ticker)
+
+        ticker = threading.Thread(target=self.game_ticker.loop, name='games')
+        ticker.daemon = True
+        ticker.start()
+
+    def serve(self, conn):
+        self._conn = conn
+        while True:
+            try:
+                call_id, name, args = conn.recv()
+            except EOFError:
+                return
+            if name == 'game_call' and args[0] in self._game_calls:
+                self._game_calls[args[0]].put((call_id, args[1], args[2]))
+            else:
+                self._run(call_id, name, getattr(self, 'cmd_' + name, None), args)
+
+    def _run(self, call_id, name, func, args):
+        try:
+            if func is None:
+                raise AttributeError('no command %s' % name)
+            result = (call_id, 'ok', func(*args))
+        except Exception as err:
+            logging.debug('worker command %s failed: %s', name, traceback.format_exc())
+            result = (call_id, 'error', err)
+        with self._send_lock:
+            try:
+                self._conn.send(result)
+            except Exception as err:
+                # result or exception was not picklable
+                self._conn.send((call_id, 'error',
+                                 WorkerError('%s: %s' % (type(err).__name__, err))))
+
+    def _serve_game_calls(self, game, calls):
+        multisock.set_thread_name('game calls')
+        while True:
+            call_id, method, args = calls.get()
+            self._run(call_id, method, getattr(game, method, None), args)
+
+    def cmd_create_game(self, name):
+        if name in self.games:
+            raise KeyError(name)
+        game = self.games[name] = colobot.game.Game(self.loader)
+        self.game_ticker.add_ticker(self.metrics.timed('tick.%s' % name, game.tick), name=name)
+        stats.watch_game(self.metrics, name, game)
+        # calls of one game are applied in order, but don't block other requests
+        calls = self._game_calls[name] = Queue.Queue()
+        multisock.async(self._serve_game_calls, game, calls)
+
+    def cmd_game_call(self, game_name, method, args):
+        # only for games that don't exist - see serve
+        return getattr(self.games[game_name], method)(*args)
+
+    def cmd_get_player_object_ids(self, game_name, player_name):
+        return [ obj.ident for obj in self.games[game_name].get_player_objects(player_name) ]
+
+    def cmd_get_terrain_id(self, game_name):
+        return self.serializer.add(self.games[game_name].terrain)
+
+    def cmd_open_updates(self, game_name, input_source=None):
+        import colobot.server.server # circular import
+        blobs = _BlobList()
+        handler = colobot.server.server.UpdateChannelHandler(blobs, self, self.games[game_name],
+                                                             input_source, recorder=blobs)
+        self._next_handler_id += 1
+        self.update_handlers[self._next_handler_id] = handler, blobs
+        return self._next_handler_id
+
+    def cmd_poll_updates(self, handler_id):
+        handler, blobs = self.update_handlers[handler_id]
+        handler.tick(None)
+        return blobs.pop()
+
+    def cmd_close_updates(self, handler_id):
+        handler, blobs = self.update_handlers.pop(handler_id)
+        handler.stop()
+
+    def cmd_get_by_sha1(self, sha1):
+        return self.serializer.get_by_sha1(sha1)
+
+    def cmd_get_dependencies_by_sha1(self, sha1):
+        return self.serializer.get_dependencies_by_sha1(sha1)
+
+    def cmd_get_stats(self):
+        return self.metrics.snapshot()
+
+    def cmd_get_load(self):
+        stats = self.game_ticker.stats
+        return len(self.games), sum( stats[name].average_time for name in self.games
+                                     if name in stats )
+
+class _BlobList(list):
+    '''
+    Collects blobs sent by UpdateChannelHandler (instead of channel) with
+    SHA1s of resources they reference - it is passed as both channel and
+    recorder, so front-end can record blobs without decoding them.
+    '''
+    closed = False # front-end notices closed channel and calls close_updates
+
+    def busy(self):
+        # front-end checks it before polling
+        return False
+
+    def send(self, blob):
+        pass # collected by add_blob
+
+    def add_blob(self, blob, resources):
+        self.append((blob, resources))
+
+    def close(self):
+        pass
+
+def _worker_main(conn, loader):
+    multiprocessing.current_process().name = 'colobot-worker'
+    Worker(loader).serve(conn)
+
+# ;;;;;;;;;;;;;;;;;;;;;;;;;; front-end ;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;
+
+class WorkerClient(object):
+    ' Front-end side of worker process. '
+    def __init__(self, loader):
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=_worker_main,
+                                               args=(child_conn, loader))
+        self.process.daemon = True
+        self.process.start()
+        self.lock = threading.Lock()
+        self._calls = {} # call id -> _PendingCall
+        self._ids = itertools.count()
+        multisock.async(self._read_results)
+
+    def call(self, name, *args):
+        return self.call_async(name, *args).get()
+
+    def call_async(self, name, *args):
+        ' Sends request without waiting for the result. Returns _PendingCall. '
+        pending = _PendingCall()
+        with self.lock:
+            call_id = next(self._ids)
+            self._calls[call_id] = pending
+            self.conn.send((call_id, name, args))
+        return pending
+
+    def _read_results(self):
+        multisock.set_thread_name('worker results')
+        while True:
+            try:
+                call_id, status, value = self.conn.recv()
+            except (EOFError, IOError):
+                break
+            with self.lock:
+                pending = self._calls.pop(call_id)
+            pending.set(status, value)
+
+        with self.lock:
+            calls, self._calls = self._calls, {}
+        for pending in calls.values():
+            pending.set('error', WorkerError('worker exited'))
+
+class _PendingCall(object):
+    ' Result of WorkerClient.call_async. '
+    def __init__(self):
+        self._done = threading.Event()
+        self._result = None
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def set(self, status, value):
+        with self._lock:
+            self._result = status, value
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+    def add_done_callback(self, callback):
+        ''' Calls callback(self) when the result arrives (in the thread
+        reading results - it must not block). '''
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def get(self):
+        ' Waits for the result and returns it (or raises the error). '
+        self._done.wait()
+        status, value = self._result
+        if status == 'error':
+            raise value
+        return value
+
+class WorkerPool(object):
+    ' Starts `count` workers and places games on them. '
+    def __init__(self, loader, count, resource_cache_budget=32 * 1024 * 1024):
+        self.workers = [ WorkerClient(loader) for i in xrange(count) ]
+        # serialized resources fetched from workers
+        self._resource_cache = g3d.cache.LRUCache(resource_cache_budget, len)
+
+    def place(self):
+        ' Returns the least loaded worker. '
+        return min(self.workers, key=lambda worker: worker.call('get_load'))
+
+    def create_game(self, name):
+        worker = self.place()
+        worker.call('create_game', name)
+        return RemoteGame(worker, name)
+
+    def get_by_sha1(self, sha1):
+        data = self._resource_cache.get(sha1)
+        if data is None:
+            data = self._resource_cache[sha1] = self._find(sha1, 'get_by_sha1')
+        return data
+
+    def get_dependencies_by_sha1(self, sha1):
+        return self._find(sha1, 'get_dependencies_by_sha1')
+
+    def get_stats(self):
+        return [ worker.call('get_stats') for worker in self.workers ]
+
+    def _find(self, sha1, method):
+        # ask all workers at once - only one of them usually has it
+        calls = [ worker.call_async(method, sha1) for worker in self.workers ]
+        for call in calls:
+            try:
+                return call.get()
+            except KeyError:
+                pass
+        raise KeyError(sha1)
+
+class RemoteGame(object):
+    ' Proxy for colobot.game.Game running in worker process. '
+    def __init__(self, worker, name):
+        self.worker = worker
+        self.name = name
+
+    def _call(self, method, *args):
+        return self.worker.call('game_call', self.name, method, args)
+
+    def load_terrain(self, name):
+        self._call('load_terrain', name)
+
+    def load_scene(self, name):
+        self._call('load_scene', name)
+
+    def create_static_object(self, player_name, name):
+        self._call('create_static_object', player_name, name)
+
+    def motor(self, player_name, bot_id, motor):
+        self._call('motor', player_name, bot_id, motor)
+
+    def handle_input(self, source, player_name, message):
+        colobot.control.unpack(message) # don't pass malformed messages to worker
+        self._call('handle_input', source, player_name, message)
+
+    def get_player_object_ids(self, player_name):
+        return self.worker.call('get_player_object_ids', self.name, player_name)
+
+    def get_terrain_id(self):
+        return self.worker.call('get_terrain_id', self.name)
+
+class RemoteUpdateChannelHandler(object):
+    ' Sends updates generated by worker to channel. '
+    def __init__(self, channel, game, input_source=None, recorder=None):
+        self.channel = channel
+        self.game = game
+        self.recorder = recorder # colobot.recording.Recorder
+        self.send = channel.send
+        self.handler_id = game.worker.call('open_updates', game.name, input_source)
+
+        self.handle = None # set when run by event loop
+        self.timer = None
+        self.stopped = False
+        self.polling = False # poll sent by tick_async wasn't answered yet
+
+    def loop(self):
+        multisock.set_thread_name('update sender')
+        self.timer = g3d.Scheduler(step=0.1, max_steps=1)
+        self.timer.add_ticker(self.tick)
+        if not self.stopped:
+            self.timer.loop()
+
+    def stop(self):
+        ' Stops polling, closes channel and the handler in worker. '
+        if self.stopped:
+            return
+        self.stopped = True
+        if self.handle:
+            self.handle.cancel()
+        if self.timer:
+            self.timer.stop()
+        self.channel.close()
+        if self.recorder:
+            self.recorder.close()
+        # may be called from event loop - don't wait for the worker
+        self.game.worker.call_async('close_updates', self.handler_id)
+
+    def tick(self, _):
+        if self.channel.closed:
+            self.stop()
+            return
+
+        # when skipped, worker will include changes in the next blob
+        if not self.channel.busy():
+            blob, resources = self.game.worker.call('poll_updates', self.handler_id)
+            self._send(blob, resources)
+
+    def tick_async(self, event_loop):
+        '''
+        Like tick, but called in event loop thread - doesn't wait for the
+        worker, the blob is sent from event loop when it arrives. Skipped
+        while the previous poll is pending, so polls don't pile up when
+        the worker is slow.
+        '''
+        if self.channel.closed:
+            self.stop()
+            return
+
+        if self.polling or self.channel.busy():
+            return
+        self.polling = True
+        pending = self.game.worker.call_async('poll_updates', self.handler_id)
+        pending.add_done_callback(lambda pending: event_loop.call_soon(self._polled, pending))
+
+    def _polled(self, pending):
+        self.polling = False
+        if self.stopped:
+            return
+        blob, resources = pending.get()
+        self._send(blob, resources)
+
+    def _send(self, blob, resources):
+        self.send(blob)
+        if self.recorder:
+            self.recorder.add_blob(blob, resources)
@@ -0,0 +1,194 @@
+# Copyright (C) 2012, Michal Zielinski <michal@zielinscy.org.pl>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+Registry of server metrics - histograms of durations, counters and gauges
+(functions evaluated when snapshot is taken). Snapshot is a plain dict,
+so it can be returned by RPC or written to log.
+'''
+
+import threading
+import bisect
+import time
+import logging
+import json
+
+class Histogram(object):
+    ' Counts values in exponential buckets (in seconds, from 0.1 ms to ~100 s). '
+    bounds = [ 0.0001 * 2 ** i for i in xrange(21) ]
+
+    def __init__(self):
+        self.buckets = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, value):
+        with self._lock:
+            self.buckets[bisect.bisect_left(self.bounds, value)] += 1
+            self.count += 1
+            self.total += value
+            self.max = max(self.max, value)
+
+    def percentile(self, q):
+        ''' Returns upper bound of bucket containing q-th percentile
+        (0 < q <= 100) or None if there are no values. '''
+        if not self.count:
+            return None
+        rank = self.count * q / 100.
+        seen = 0
+        for bound, count in zip(self.bounds + [self.max], self.buckets):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def snapshot(self):
+        with self._lock:
+            return {'count': self.count,
+                    'avg': self.total / self.count if self.count else None,
+                    'p50': self.percentile(50),
+                    'p99': self.percentile(99),
+                    'max': self.max}
+
+class Counter(object):
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def add(self, n=1):
+        with self._lock:
+            self.value += n
+
+    def snapshot(self):
+        return self.value
+
+class Gauge(object):
+    def __init__(self, func):
+        self.func = func
+
+    def snapshot(self):
+        try:
+            return self.func()
+        except Exception as err:
+            return 'error: %s' % err
+
+class Metrics(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def _get(self, name, factory):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = factory()
+            return self._metrics[name]
+
+    def histogram(self, name):
+        return self._get(name, Histogram)
+
+    def counter(self, name):
+        return self._get(name, Counter)
+
+    def gauge(self, name, func):
+        ' Registers (or replaces) gauge - func is called on each snapshot. '
+        with self._lock:
+            self._metrics[name] = Gauge(func)
+
+    def remove(self, name):
+        with self._lock:
+            self._metrics.pop(name, None)
+
+    def timed(self, name, func):
+        ' Returns function calling func and adding its duration to histogram `name`. '
+        histogram = self.histogram(name)
+        def wrapper(*args, **kwargs):
+            start = time.time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                histogram.add(time.time() - start)
+        wrapper.__name__ = getattr(func, '__name__', name)
+        return wrapper
+
+    def snapshot(self):
+        with self._lock:
+            items = self._metrics.items()
+        return dict( (name, metric.snapshot()) for name, metric in items )
+
+    def log(self, level=logging.INFO):
+        logging.log(level, 'stats: %s', json.dumps(self.snapshot(), sort_keys=True))
+
+class MeteredChannel(object):
+    ' Wraps channel and counts messages and bytes sent through it. '
+    def __init__(self, channel, metrics, kind):
+        self.channel = channel
+        self.id = channel.id
+        self._messages = metrics.counter('channel.%s.messages' % kind)
+        self._bytes = metrics.counter('channel.%s.bytes' % kind)
+
+    def _count(self, data):
+        self._messages.add()
+        self._bytes.add(len(data))
+
+    def send(self, data):
+        self._count(data)
+        self.channel.send(data)
+
+    def send_async(self, data):
+        self._count(data)
+        self.channel.send_async(data)
+
+    def recv(self):
+        return self.channel.recv()
+
+class MeteredDispatcher(object):
+    ''' Object passed to JSON-RPC channel as server - counts calls, errors
+    and latency of rpc_* methods of `target`. '''
+    def __init__(self, target, metrics):
+        self._target = target
+        self._metrics = metrics
+
+    def __getattr__(self, name):
+        method = getattr(self._target, name)
+        if not name.startswith('rpc_'):
+            return method
+
+        errors = self._metrics.counter('rpc.%s.errors' % name[4:])
+        timed = self._metrics.timed('rpc.%s' % name[4:], method)
+        def call(*args, **kwargs):
+            try:
+                return timed(*args, **kwargs)
+            except Exception:
+                errors.add()
+                raise
+        call.__name__ = name
+        return call
+
+def watch_game(metrics, name, game):
+    metrics.gauge('game.%s.objects' % name, lambda: len(game.get_objects()))
+    metrics.gauge('game.%s.commands' % name, lambda: len(game._commands))
+
+def watch_serializer(metrics, serializer):
+    metrics.gauge('serializer.blobs', serializer.blobs.stats)
+    metrics.gauge('serializer.hits', lambda: serializer.hits)
+    metrics.gauge('serializer.misses', lambda: serializer.misses)
+
+def watch_loader(metrics, loader):
+    metrics.gauge('loader.models', loader.model_cache.stats)
+    metrics.gauge('loader.textures', loader.texture_cache.stats)
+
+def watch_scheduler(metrics, name, scheduler):
+    metrics.gauge('%s.dropped_time' % name, lambda: scheduler.dropped_time)
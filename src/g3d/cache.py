@@ -0,0 +1,170 @@
+# Copyright (c) 2012, Michal Zielinski <michal@zielinscy.org.pl>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     * Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+#
+#     * Redistributions in binary form must reproduce the above
+#     copyright notice, this list of conditions and the following
+#     disclaimer in the documentation and/or other materials provided
+#     with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+'''
+Caches that keep track of memory used by the data they hold.
+'''
+
+import collections
+import threading
+import weakref
+
+class ReleaseCache(object):
+    '''
+    Keeps track of objects holding decoded data, which can be released and
+    decoded again later (e.g. lazily unserialized meshes).
+    When size of decoded data exceeds `budget` bytes, least recently
+    touched objects are asked to free it by calling their release() method.
+    '''
+    def __init__(self, budget):
+        self.budget = budget
+        self.size = 0
+        self._sizes = collections.OrderedDict()
+        self._holders = {}
+        self._lock = threading.Lock()
+
+    def touch(self, holder, size):
+        ' Marks holder as recently used and holding `size` bytes of decoded data. '
+        with self._lock:
+            key = id(holder)
+            self.size -= self._sizes.pop(key, 0)
+            self._sizes[key] = size
+            self._holders[key] = holder
+            self.size += size
+
+            to_release = []
+            while self.size > self.budget and len(self._sizes) > 1:
+                old_key, old_size = self._sizes.popitem(last=False)
+                self.size -= old_size
+                to_release.append(self._holders.pop(old_key))
+
+        for old in to_release:
+            old.release()
+
+    def discard(self, holder):
+        ' Forgets about holder (after it released its data on its own). '
+        with self._lock:
+            key = id(holder)
+            self.size -= self._sizes.pop(key, 0)
+            self._holders.pop(key, None)
+
+    def __len__(self):
+        return len(self._sizes)
+
+class LRUCache(object):
+    '''
+    Mapping which keeps values up to `budget` bytes (as estimated by
+    `sizeof(value)`), evicting least recently used ones.
+
+    Evicted values are still reachable through weak references - if
+    they are used elsewhere, looking them up again returns the same
+    object (and counts as `revived`) instead of loading a copy.
+    '''
+    def __init__(self, budget, sizeof):
+        self.budget = budget
+        self.sizeof = sizeof
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.revived = 0
+        self._entries = collections.OrderedDict() # key -> (value, size)
+        self._evicted = weakref.WeakValueDictionary()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._entries[key] = entry
+                self.hits += 1
+                return entry[0]
+            value = self._evicted.pop(key, None)
+            if value is None:
+                self.misses += 1
+                return default
+            self.revived += 1
+            self._add(key, value)
+        return value
+
+    def __getitem__(self, key):
+        value = self.get(key, _missing)
+        if value is _missing:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._add(key, value)
+
+    def _add(self, key, value):
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.size -= old[1]
+        self._evicted.pop(key, None)
+        size = self.sizeof(value)
+        self._entries[key] = (value, size)
+        self.size += size
+
+        while self.size > self.budget and len(self._entries) > 1:
+            old_key, (old_value, old_size) = self._entries.popitem(last=False)
+            self.size -= old_size
+            self.evictions += 1
+            try:
+                self._evicted[old_key] = old_value
+            except TypeError:
+                # can't be weakly referenced
+                pass
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries or key in self._evicted
+
+    def __len__(self):
+        return len(self._entries)
+
+    def items(self):
+        ' Returns (key, value) pairs of cached values (including evicted, but alive ones). '
+        with self._lock:
+            return ([ (key, value) for key, (value, size) in self._entries.items() ]
+                    + self._evicted.items())
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._evicted.clear()
+            self.size = 0
+
+    def stats(self):
+        with self._lock:
+            return {'count': len(self._entries), 'size': self.size, 'budget': self.budget,
+                    'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions, 'revived': self.revived}
+
+_missing = object()
+
+# decoded data of lazily unserialized objects
+decoded = ReleaseCache(budget=64 * 1024 * 1024)
@@ -27,9 +27,13 @@
 from __future__ import division
 from g3d.math import Quaternion, Vector2, Vector3
 import g3d.serialize
+import g3d.cache
 import collections
+import heapq
+import itertools
 import time
 import struct
+import logging
 
 Triangle = collections.namedtuple('Triangle',
                                   'a b c na nb nc a_uv b_uv c_uv texture')
@@ -40,35 +44,67 @@ class options(object):
     enable_textures = True
 
 class Object(object):
+    '''
+    Base of scene objects. `pos` and `rotation` are shared between clones
+    (and with templates of instances, see ContainerInstance) - they must
+    be treated as immutable and replaced by assignment, never modified in
+    place (`obj.pos = obj.pos + delta`, not `obj.pos.x += 1`).
+    '''
+    # subclasses without __slots__ still get __dict__ - only Container
+    # and its instances are numerous enough to need slots
+    __slots__ = ('pos', 'rotation', 'scale', '__weakref__')
+
     def __init__(self):
         self.pos = Vector3()
         self.rotation = Quaternion()
         self.scale = 1
 
     def clone(self, clone_dict=None):
-        if clone_dict:
-            clone_dict[self] = new
-
         obj = type(self)()
         obj.pos = self.pos
         obj.rotation = self.rotation
         obj.scale = self.scale
+        if clone_dict is not None:
+            clone_dict[self] = obj
         return obj
 
 @g3d.serialize.serializable
 class TriangleObject(Object):
+    # rough size of one decoded Triangle (with its vectors) in bytes
+    decoded_triangle_size = 3000
+
     def __init__(self, triangles):
         super(TriangleObject, self).__init__()
 
         self._triangles = triangles
+        self._packed = None
 
     @property
     def triangles(self):
-        return self._triangles
+        triangles = self._triangles
+        if triangles is None:
+            triangles = self._triangles = self._unpack_groups(self._packed)
+        if self._packed is not None:
+            g3d.cache.decoded.touch(self, len(triangles) * self.decoded_triangle_size)
+        return triangles
+
+    @property
+    def estimated_size(self):
+        ' Rough number of bytes used by triangles (decoded or packed). '
+        if self._triangles is not None:
+            return len(self._triangles) * self.decoded_triangle_size
+        return sum( len(packed) for texture, packed in self._packed )
+
+    def release(self):
+        ''' Frees decoded triangles of unserialized object - they will be
+        decoded again from packed data when needed. '''
+        if self._packed is not None:
+            self._triangles = None
 
     def clone(self, clone_dict=None):
-        if clone_dict:
-            clone_dict[self] = new
+        # immutable - can be shared
+        if clone_dict is not None:
+            clone_dict[self] = self
 
         return self
 
@@ -84,7 +120,7 @@ class TriangleObject(Object):
         curr_group = None
 
         last_tex = Ellipsis
-        for t in sorted(self._triangles, key=lambda t: t.texture):
+        for t in sorted(self.triangles, key=lambda t: t.texture):
             if t.texture != last_tex:
                 curr_group = []
                 grouped_by_texture.append((t.texture, curr_group))
@@ -93,32 +129,68 @@ class TriangleObject(Object):
 
         return (self.pos, self.rotation, self.scale, [ (tex, self._serialize_triangles(triangles)) for tex, triangles in grouped_by_texture ], )
 
+    def _serialize_canonical(self):
+        ''' Like _serialize, but output doesn't depend on order of triangles
+        or on identity of textures - groups and triangles inside them are
+        sorted by their packed representation. '''
+        grouped_by_texture = {}
+        textures = {}
+        for t in self.triangles:
+            grouped_by_texture.setdefault(id(t.texture), []).append(
+                self._pack_triangle(t, normalize=True))
+            textures[id(t.texture)] = t.texture
+
+        groups = sorted( ((sorted(packed), textures[key])
+                          for key, packed in grouped_by_texture.items()),
+                         key=lambda group: group[0] )
+        return (self.pos, self.rotation, self.scale, [ (tex, ''.join(packed)) for packed, tex in groups ], )
+
     def _serialize_triangles(self, list):
-        return ''.join( struct.pack(self._triangle_struct,
-                             t.a.x, t.a.y, t.a.z, t.b.x, t.b.y, t.b.z, t.c.x, t.c.y, t.c.z,
-                             t.na.x, t.na.y, t.na.z, t.nb.x, t.nb.y, t.nb.z, t.nc.x, t.nc.y, t.nc.z,
-                             t.a_uv.x, t.a_uv.y, t.b_uv.x, t.b_uv.y, t.c_uv.x, t.c_uv.y) for t in list )
+        return ''.join( self._pack_triangle(t) for t in list )
+
+    def _pack_triangle(self, t, normalize=False):
+        values = (t.a.x, t.a.y, t.a.z, t.b.x, t.b.y, t.b.z, t.c.x, t.c.y, t.c.z,
+                  t.na.x, t.na.y, t.na.z, t.nb.x, t.nb.y, t.nb.z, t.nc.x, t.nc.y, t.nc.z,
+                  t.a_uv.x, t.a_uv.y, t.b_uv.x, t.b_uv.y, t.c_uv.x, t.c_uv.y)
+        if normalize:
+            values = map(g3d.serialize.normalize_float, values)
+        return struct.pack(self._triangle_struct, *values)
+
+    @classmethod
+    def from_packed(cls, groups):
+        ''' Creates object from list of (texture, packed triangles) - triangles
+        are decoded on first use. '''
+        obj = cls(None)
+        obj._packed = groups
+        return obj
 
     @classmethod
     def _unserialize(cls, pos, rotation, scale, groups):
-        obj = cls([])
-        for texture, triangles in groups:
-            struct_size = struct.calcsize(cls._triangle_struct)
-            obj._triangles += [
+        obj = cls.from_packed(groups)
+        obj.pos = pos
+        obj.rotation = rotation
+        obj.scale = scale
+        return obj
+
+    @classmethod
+    def _unpack_groups(cls, groups):
+        struct_size = struct.calcsize(cls._triangle_struct)
+        triangles = []
+        for texture, packed in groups:
+            triangles += [
                 Triangle(Vector3(ax, ay, az), Vector3(bx, by, bz), Vector3(cx, cy, cz),
                          Vector3(nax, nay, naz), Vector3(nbx, nby, nbz), Vector3(ncx, ncy, ncz),
                          Vector2(a_uvx, a_uvy), Vector2(b_uvx, b_uvy), Vector2(c_uvx, c_uvy),
                          texture)
                 for ax, ay, az, bx, by, bz, cx, cy, cz, nax, nay, naz, nbx, nby, nbz, ncx, ncy, ncz, a_uvx, a_uvy, b_uvx, b_uvy, c_uvx, c_uvy in [
-                    struct.unpack(cls._triangle_struct, triangles[i: i+struct_size])
-                    for i in xrange(0, len(triangles), struct_size) ] ]
-        obj.pos = pos
-        obj.rotation = rotation
-        obj.scale = scale
-        return obj
+                    struct.unpack(cls._triangle_struct, packed[i: i+struct_size])
+                    for i in xrange(0, len(packed), struct_size) ] ]
+        return triangles
 
 @g3d.serialize.serializable
 class Container(Object):
+    __slots__ = ('objects', )
+
     def __init__(self):
         super(Container, self).__init__()
         self.objects = []
@@ -150,6 +222,71 @@ class Container(Object):
         c.scale = scale
         return c
 
+def _instance_property(name):
+    slot = '_' + name
+    def get(self):
+        value = getattr(self, slot)
+        if value is None:
+            return getattr(self._template, name)
+        return value
+
+    def set(self, value):
+        setattr(self, slot, value)
+
+    return property(get, set)
+
+@g3d.serialize.serialize_as(Container)
+class ContainerInstance(Container):
+    '''
+    Copy-on-write instance of Container. Transform is read from template
+    until it is assigned - it has to be assigned, not modified in place
+    (in-place changes would be written through to the template).
+    Children are shared with template until the list is modified or
+    an instance of one of them is needed (see child_instance).
+    '''
+    # slots of the whole hierarchy - no __dict__ is allocated
+    __slots__ = ('_template', '_children', '_pos', '_rotation', '_scale')
+
+    def __init__(self, template):
+        # not calling Container.__init__ - everything is read from template
+        self._template = template
+        self._children = None
+        self._pos = self._rotation = self._scale = None # None - not overriden
+
+    pos = _instance_property('pos')
+    rotation = _instance_property('rotation')
+    scale = _instance_property('scale')
+
+    @property
+    def objects(self):
+        if self._children is None:
+            return self._template.objects
+        return self._children
+
+    @objects.setter
+    def objects(self, objects):
+        self._children = objects
+
+    def _own_children(self):
+        if self._children is None:
+            self._children = list(self._template.objects)
+        return self._children
+
+    def add(self, obj):
+        self._own_children().append(obj)
+
+    def remove(self, obj):
+        self._own_children().remove(obj)
+
+    def child_instance(self, index):
+        ' Returns child at `index`, replacing it with its instance if needed. '
+        children = self._own_children()
+        child = children[index]
+        shared = any( child is obj for obj in self._template.objects )
+        if shared and isinstance(child, Container):
+            child = children[index] = ContainerInstance(child)
+        return child
+
 
 # ;;;;;;;;;;;;;;;; TEXTURES ;;;;;;;;;;;;;;;;;;
 
@@ -158,9 +295,53 @@ def create_rgbx_texture(data, size):
 
 @g3d.serialize.serializable
 class TextureWrapper(object):
+    # source file and its SHA1 (hex) - set by g3d.loader.Loader
+    name = None
+    sha1 = None
+
     def __init__(self, data, size):
-        self.size = size
-        self.data = data
+        self._size = size
+        self._data = data
+        self._decode = None
+
+    @classmethod
+    def lazy(cls, decode, size=None):
+        ''' Creates texture which pixels are loaded by calling `decode`
+        (returning TextureWrapper) when they are first needed. If `size`
+        is not given, it is also decoded on first use. '''
+        texture = cls(None, size)
+        texture._decode = decode
+        return texture
+
+    @property
+    def size(self):
+        if self._size is None:
+            self._load()
+        return self._size
+
+    @property
+    def data(self):
+        data = self._data
+        if data is None:
+            data = self._load()
+        if self._decode:
+            g3d.cache.decoded.touch(self, len(data))
+        return data
+
+    @property
+    def estimated_size(self):
+        ' Number of bytes used by pixels (zero if lazy texture is not loaded). '
+        return len(self._data) if self._data is not None else 0
+
+    def _load(self):
+        decoded = self._decode()
+        self._size = decoded.size
+        self._data = decoded.data
+        return self._data
+
+    def release(self):
+        if self._decode:
+            self._data = None
 
     # -------------------------------------
 
@@ -176,8 +357,13 @@ class TextureWrapper(object):
             raise RuntimeError('invalid size')
         return cls(data, size)
 
+    @classmethod
+    def _unserialize_lazy(cls, decode):
+        return cls.lazy(decode)
+
 
 class Timer:
+    ''' Simple timer with variable step - see also Scheduler. '''
     def __init__(self, min_interval=0):
         self._intervals = []
         self._tickers = []
@@ -213,6 +399,127 @@ class Timer:
         while True:
             self.tick()
 
+class CallbackStats(object):
+    ' Time spent in one Scheduler callback. '
+    def __init__(self):
+        self.calls = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def add(self, duration):
+        self.calls += 1
+        self.total_time += duration
+        self.max_time = max(self.max_time, duration)
+
+    @property
+    def average_time(self):
+        return self.total_time / self.calls if self.calls else 0.0
+
+class Scheduler(object):
+    '''
+    Timer with fixed time step. Tickers are always called with `step` as
+    argument - as many times as needed to catch up with real time, but at
+    most `max_steps` times per tick (if the work takes longer than real
+    time, the simulation slows down instead of falling more and more behind).
+    Interval functions are kept in a heap ordered by time of the next call.
+    Time spent in each callback is accounted in `stats` (by callback name).
+    Exceptions raised by callbacks are logged and don't stop the others.
+    '''
+    def __init__(self, step=0.05, max_steps=5, clock=time.time, sleep=time.sleep):
+        self.step = step
+        self.max_steps = max_steps
+        self.clock = clock
+        self.sleep = sleep
+        self.stats = {}
+        self.dropped_time = 0.0 # time skipped because of max_steps
+
+        self._tickers = []
+        self._intervals = []
+        self._counter = itertools.count()
+        self._accumulator = 0.0
+        self._last_tick = None
+        self.running = False
+
+    def add_ticker(self, function, name=None):
+        ''' Adds a function that will be called each step with one argument - the step in seconds. '''
+        self._tickers.append((function, name or _callback_name(function)))
+
+    def remove_ticker(self, function):
+        self._tickers = [ (func, name) for func, name in self._tickers if func != function ]
+
+    def add_interval(self, interval, function, name=None):
+        ''' Adds a function that will be called in regular intervals (in seconds). '''
+        self._push(self.clock() + interval, interval, function, name)
+
+    def call_later(self, delay, function, name=None):
+        ' Calls function once after `delay` seconds. '
+        self._push(self.clock() + delay, None, function, name)
+
+    def _push(self, when, interval, function, name):
+        heapq.heappush(self._intervals, (when, next(self._counter), interval, function,
+                                         name or _callback_name(function)))
+
+    def tick(self):
+        ' Runs all steps and interval functions that are due. '
+        current = self.clock()
+        if self._last_tick is None:
+            self._last_tick = current
+        self._accumulator += current - self._last_tick
+        self._last_tick = current
+
+        steps = 0
+        while self._accumulator >= self.step and steps < self.max_steps:
+            for function, name in list(self._tickers):
+                self._run(name, function, self.step)
+            self._accumulator -= self.step
+            steps += 1
+
+        if self._accumulator >= self.step:
+            self.dropped_time += self._accumulator
+            self._accumulator = 0.0
+
+        while self._intervals and self._intervals[0][0] <= current:
+            when, _, interval, function, name = heapq.heappop(self._intervals)
+            self._run(name, function)
+            if interval is not None:
+                # don't call it several times in a row if we are late
+                self._push(max(when + interval, current), interval, function, name)
+
+    def _run(self, name, function, *args):
+        start = self.clock()
+        try:
+            function(*args)
+        except Exception:
+            logging.exception('scheduler callback %s failed', name)
+        finally:
+            if name not in self.stats:
+                self.stats[name] = CallbackStats()
+            self.stats[name].add(self.clock() - start)
+
+    def time_to_next(self):
+        ' Returns time (in seconds) until the next step or interval function. '
+        if self._last_tick is None:
+            return 0
+        until = self._last_tick + self.step - self._accumulator
+        if self._intervals:
+            until = min(until, self._intervals[0][0])
+        return max(0, until - self.clock())
+
+    def loop(self):
+        ' Runs tick() until stop() is called. '
+        self.running = True
+        while self.running:
+            self.tick()
+            if self.running:
+                self.sleep(self.time_to_next())
+
+    def stop(self):
+        ' Makes loop() return after the current tick. '
+        self.running = False
+
+def _callback_name(function):
+    return getattr(function, '__name__', None) or repr(function)
+
 def wrap(obj):
     ' Wraps object with a container, so its position can be changed without modifing it. '
     c = Container()
@@ -43,6 +43,7 @@ class Window:
         self.root = g3d.Container()
         self.camera = Camera()
         self.event_handler = EventHandler()
+        # variable step - frames are drawn as often as possible
         self.timer = g3d.Timer() # UI timer
 
     def loop(self):
@@ -27,57 +27,201 @@
 import os
 import gzip
 import functools
+import hashlib
+import logging
+import struct
+import threading
+import multiprocessing.pool
 import pygame
 
 import g3d
+import g3d.cache
+import g3d.pack
 
 class Loader(object):
-    def __init__(self, enable_textures=True):
+    # names of files that are cooked by g3d.pack.cook
+    model_extensions = ()
+    texture_extensions = ('.png', '.jpg', '.tga', '.bmp')
+
+    # header of files in pixel cache - width, height
+    pixel_header = struct.Struct('!II')
+
+    def __init__(self, enable_textures=True, pixel_cache_path=None,
+                 model_cache_budget=128 * 1024 * 1024,
+                 texture_cache_budget=128 * 1024 * 1024, threads=4):
+        '''
+        Textures are loaded lazily - get_texture only reads file to get its
+        size and SHA1, pixels are decoded when they are first used.
+        If `pixel_cache_path` is given, decoded pixels are stored there
+        (by SHA1 of the source file), so the next run doesn't decode them.
+
+        Loaded models and textures are kept in LRU caches limited to
+        `model_cache_budget` and `texture_cache_budget` bytes (see
+        g3d.cache.LRUCache). Pixels of lazy textures are accounted in
+        g3d.cache.decoded instead.
+
+        get_model and get_texture can be called from many threads - if the
+        same object is requested while it is being loaded, the caller waits
+        for that load. prefetch loads objects in pool of `threads` threads.
+        Adding files to index is not thread-safe.
+        '''
         self.enable_textures = enable_textures
+        self.pixel_cache_path = pixel_cache_path
         self.index = {}
-        self.texture_cache = {}
-        self.model_cache = {}
+        self.paths = {}
+        self.packs = {} # name -> g3d.pack.Pack containing it
+        self._sha1s = {} # name -> (mtime, SHA1)
+        self.texture_cache = g3d.cache.LRUCache(texture_cache_budget, estimate_size)
+        self.model_cache = g3d.cache.LRUCache(model_cache_budget, estimate_size)
+        self.template_cache = {} # see g3d.model.reader.get_template
+        self.threads = threads
+        self._pool = None
+        self._lock = threading.Lock()
+        self._loading = {} # (cache id, name) -> _Flight
 
     def add_directory(self, path):
         ' Add content of directory to index. '
         for name in os.listdir(path):
+            file_path = os.path.join(path, name)
             if name.endswith('.gz'):
-                func = functools.partial(gzip.open,
-                                         os.path.join(path, name),
-                                         'rb')
+                func = functools.partial(gzip.open, file_path, 'rb')
                 name = name[:-3]
             else:
-                func = functools.partial(open,
-                                         os.path.join(path, name),
-                                         'rb')
+                func = functools.partial(open, file_path, 'rb')
             self.index[name] = func
+            self.paths[name] = file_path
+
+    def add_pack(self, path):
+        ' Add content of pack (see g3d.pack) to index. '
+        pack = g3d.pack.Pack(path)
+        for name in pack.entries:
+            self.index[name] = functools.partial(pack.open, name)
+            self.paths[name] = path
+            self.packs[name] = pack
 
     def read_file(self, name):
         return self.index[name]().read()
 
+    def get_sha1(self, name, data=None):
+        ''' Returns SHA1 (hex) of file `name` - precomputed for files from packs
+        and remembered until modification time of file changes. If `data`
+        (content of the file) is given, the file isn't read again. '''
+        if name in self.packs:
+            return self.packs[name].get_sha1(name)
+        mtime = self.get_mtime(name)
+        if mtime is not None and self._sha1s.get(name, (None, ))[0] == mtime:
+            return self._sha1s[name][1]
+        if data is None:
+            data = self.read_file(name)
+        sha1 = hashlib.sha1(data).hexdigest()
+        if mtime is not None:
+            self._sha1s[name] = (mtime, sha1)
+        return sha1
+
+    def get_mtime(self, name):
+        ''' Returns modification time of file `name` or None if it is not
+        stored in a file. '''
+        path = self.paths.get(name)
+        return os.path.getmtime(path) if path else None
+
     def get_model(self, name):
         '''
         Loads model named `name` from index using self._load_model.
         '''
-        if name not in self.model_cache:
-            self.model_cache[name] = self._load_model(self.index[name]())
+        return self._get_cached(self.model_cache, name, self._load_model_named)
 
-        return self.model_cache[name]
+    def _load_model_named(self, name):
+        model = None
+        if name in self.packs:
+            model = self.packs[name].get_model(name, self.get_texture)
+        if model is None:
+            model = self._load_model(self.index[name]())
+        return model
 
     def get_texture(self, name):
         '''
-        Loads texture named `name` from index using self._load_texture.
+        Returns lazy texture named `name` - its pixels are loaded from pixel
+        cache or decoded using self._load_texture when they are first used.
         If texture was loaded yet, returns it from cache.
         Returns None if texture loading is disabled.
         '''
         if not self.enable_textures:
             return None
 
-        if name not in self.texture_cache:
-            input = self.index[self._find_texture(name)]()
-            self.texture_cache[name] = self._load_texture(input)
+        return self._get_cached(self.texture_cache, name, self._load_texture_named)
+
+    def _load_texture_named(self, name):
+        path = self._find_texture(name)
+        texture = None
+        if path in self.packs:
+            texture = self.packs[path].get_texture(path)
+        if texture is None:
+            texture = self._get_texture_ref(path)
+        return texture
+
+    def _get_cached(self, cache, name, load):
+        ''' Returns cache[name], calling load(name) if it is missing. Only
+        one thread loads the object - others wait for its result. '''
+        key = (id(cache), name)
+        with self._lock:
+            value = cache.get(name)
+            if value is not None:
+                return value
+            flight = self._loading.get(key)
+            owner = flight is None
+            if owner:
+                flight = self._loading[key] = _Flight()
+
+        if not owner:
+            return flight.wait()
+
+        try:
+            value = load(name)
+        except BaseException as err:
+            # also KeyboardInterrupt etc. - waiting threads must not hang
+            with self._lock:
+                del self._loading[key]
+            flight.finish(error=err)
+            raise
+
+        with self._lock:
+            cache[name] = value
+            del self._loading[key]
+        flight.finish(value)
+        return value
 
-        return self.texture_cache[name]
+    def prefetch(self, names, pixels=False):
+        '''
+        Starts loading files `names` in background threads - models (with
+        their textures) and textures go to caches, other files are only
+        read. If `pixels` is true, pixels of textures are also decoded.
+        Returns list of AsyncResults - their get() returns loaded object.
+        '''
+        with self._lock:
+            if self._pool is None:
+                self._pool = multiprocessing.pool.ThreadPool(self.threads)
+            pool = self._pool
+        return [ pool.apply_async(self._prefetch_file, (name, pixels)) for name in names ]
+
+    def _prefetch_file(self, name, pixels):
+        if name.endswith(self.model_extensions):
+            return self.get_model(name)
+        elif name.endswith(self.texture_extensions):
+            texture = self.get_texture(name)
+            if pixels and texture:
+                texture.data
+            return texture
+        else:
+            return self.read_file(name)
+
+    def close(self):
+        ''' Stops prefetch threads (they are started again by the next
+        prefetch) - call it before forking. '''
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool:
+            pool.close()
+            pool.join()
 
     def _find_texture(self, name):
         if name in self.index:
@@ -85,6 +229,49 @@ class Loader(object):
 
         raise KeyError(name)
 
+    def _get_texture_ref(self, name):
+        data = self.read_file(name)
+        sha1 = self.get_sha1(name, data)
+        texture = g3d.TextureWrapper.lazy(
+            functools.partial(self._decode_texture, name, sha1),
+            size=image_size(data))
+        texture.name = name
+        texture.sha1 = sha1
+        return texture
+
+    def _decode_texture(self, name, sha1):
+        path = os.path.join(self.pixel_cache_path, sha1) if self.pixel_cache_path else None
+        if path and os.path.exists(path):
+            try:
+                return self._read_pixels(path)
+            except (IOError, ValueError) as err:
+                logging.warning('failed to read cached pixels %s: %s', path, err)
+
+        texture = self._load_texture(self.index[name]())
+        if path:
+            self._save_pixels(path, texture)
+        return texture
+
+    def _read_pixels(self, path):
+        with open(path, 'rb') as f:
+            data = f.read()
+        size = self.pixel_header.unpack_from(data)
+        if len(data) != self.pixel_header.size + size[0] * size[1] * 4:
+            raise ValueError('bad length')
+        return g3d.create_rgbx_texture(data[self.pixel_header.size:], size)
+
+    def _save_pixels(self, path, texture):
+        try:
+            if not os.path.exists(self.pixel_cache_path):
+                os.makedirs(self.pixel_cache_path)
+            tmp = '%s.tmp%d-%d' % (path, os.getpid(), threading.current_thread().ident)
+            with open(tmp, 'wb') as f:
+                f.write(self.pixel_header.pack(*texture.size))
+                f.write(texture.data)
+            os.rename(tmp, path)
+        except (IOError, OSError) as err:
+            logging.warning('failed to save decoded pixels %s: %s', path, err)
+
     def _load_texture(self, input):
         '''
         Creates GL texture from image supported by Pygame and
@@ -98,3 +285,40 @@ class Loader(object):
         ''' Loads model from input and returns g3d.TriangleObject
         - should be overriden by subclasses. '''
         raise NotImplementedError('should be overriden by subclass')
+
+class _Flight(object):
+    ' Load in progress - threads requesting the same object wait for it. '
+    def __init__(self):
+        self.value = None
+        self.error = None
+        self._done = threading.Event()
+
+    def finish(self, value=None, error=None):
+        self.value = value
+        self.error = error
+        self._done.set()
+
+    def wait(self):
+        self._done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+def estimate_size(obj):
+    ' Rough number of bytes used by loaded model or texture. '
+    # constant for the object itself and cache entry
+    return getattr(obj, 'estimated_size', 0) + 512
+
+def image_size(data):
+    ''' Returns (width, height) read from header of PNG, BMP or TGA image
+    or None if format is not recognized. '''
+    if data.startswith('\x89PNG\r\n\x1a\n') and len(data) >= 24:
+        return struct.unpack('!II', data[16:24])
+    if data.startswith('BM') and len(data) >= 26:
+        width, height = struct.unpack('<ii', data[18:26])
+        return width, abs(height)
+    if len(data) >= 18 and ord(data[2]) in (1, 2, 3, 9, 10, 11):
+        # TGA has no magic number - check image type and bits per pixel
+        if ord(data[16]) in (8, 15, 16, 24, 32):
+            return struct.unpack('<HH', data[12:16])
+    return None
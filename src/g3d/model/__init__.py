@@ -31,17 +31,20 @@ from g3d.model.reader import read
 import g3d.serialize
 
 import abc
+import collections
 
 MODULE_SERIAL_ID = 4
 
 @g3d.serialize.serializable
-class Model:
+class Model(object):
     '''
     Model represents an object - it consists of:
     - parts (immutable g3d.TriangleObjects),
     - animations (g3d.model.Animation - describes transformations of parts).
     Parts are grouped (using g3d.Container) to make applying transformations easier.
     '''
+    __slots__ = ('root', 'animations', 'objects', '_paths', '__weakref__')
+
     def __init__(self):
         self.root = g3d.Container()
         self.animations = {}
@@ -51,14 +54,25 @@ class Model:
         animator.play(self.animations[name])
 
     def clone(self):
-        new = Model()
-        cloned = {}
-
-        new.root = self.root.clone(clone_dict=cloned)
-        new.objects = {} # FIXME: dict( (k, cloned[v]) for k, v in self.objects.items() )
-        new.animations = {} # FIXME: dict( (k, v.clone()) for k, v in self.animations.items() )
-
-        return new
+        ' Returns copy-on-write instance of this model - see ModelInstance. '
+        return ModelInstance(self)
+
+    def _object_paths(self):
+        ''' Returns dict mapping names of objects to list of child indexes
+        leading to them from root. Model shouldn't be modified after the
+        first call. '''
+        if getattr(self, '_paths', None) is None:
+            paths_by_id = {}
+            def walk(obj, path):
+                paths_by_id[id(obj)] = path
+                if isinstance(obj, g3d.Container):
+                    for i, child in enumerate(obj.objects):
+                        walk(child, path + [i])
+
+            walk(self.root, [])
+            self._paths = dict( (name, paths_by_id[id(obj)])
+                                for name, obj in self.objects.items() )
+        return self._paths
 
     # --------------------
 
@@ -75,6 +89,82 @@ class Model:
         model.objects = objects
         return model
 
+@g3d.serialize.serialize_as(Model)
+class ModelInstance(Model):
+    '''
+    Instance of model sharing parts, transforms and animation definitions
+    with template. Only transforms that are assigned are stored in
+    instance (see g3d.ContainerInstance). Named objects and animations
+    are instantiated on first access.
+    '''
+    __slots__ = ('template', '_objects', '_animations')
+
+    def __init__(self, template):
+        if isinstance(template, ModelInstance):
+            template = template.template
+        self.template = template
+        self.root = g3d.ContainerInstance(template.root)
+        self._objects = None
+        self._animations = None
+
+    @property
+    def objects(self):
+        if self._objects is None:
+            self._objects = _InstanceObjects(self)
+        return self._objects
+
+    @property
+    def animations(self):
+        if self._animations is None:
+            self._animations = _InstanceAnimations(self)
+        return self._animations
+
+class _InstanceObjects(collections.Mapping):
+    def __init__(self, instance):
+        self._instance = instance
+        self._objects = {}
+
+    def __getitem__(self, name):
+        if name not in self._objects:
+            obj = self._instance.root
+            for index in self._instance.template._object_paths()[name]:
+                obj = obj.child_instance(index)
+            self._objects[name] = obj
+        return self._objects[name]
+
+    def __iter__(self):
+        return iter(self._instance.template.objects)
+
+    def __len__(self):
+        return len(self._instance.template.objects)
+
+class _InstanceAnimations(collections.Mapping):
+    def __init__(self, instance):
+        self._instance = instance
+        self._animations = {}
+
+    def __getitem__(self, name):
+        if name not in self._animations:
+            template = self._instance.template
+            # maps objects of template to objects of instance
+            names = dict( (id(obj), name) for name, obj in template.objects.items() )
+            clone_dict = _ObjectMap(lambda obj: self._instance.objects[names[id(obj)]])
+            self._animations[name] = template.animations[name].clone(clone_dict)
+        return self._animations[name]
+
+    def __iter__(self):
+        return iter(self._instance.template.animations)
+
+    def __len__(self):
+        return len(self._instance.template.animations)
+
+class _ObjectMap(object):
+    def __init__(self, func):
+        self._func = func
+
+    def __getitem__(self, obj):
+        return self._func(obj)
+
 class Animator:
     '''
     Manages playing and stopping animations. Needs to be attached to timer with .install(timer)
@@ -152,9 +242,10 @@ class AnimationGroup(Animation):
         else:
             return True
 
-    def clone(self):
-        new = Animator()
-        new.anims = [ (start, anim.clone()) for start, anim in self.animations ]
+    def clone(self, clone_dict=None):
+        ' Returns copy of animation - objects are mapped with clone_dict, if given. '
+        new = AnimationGroup()
+        new.anims = [ (start, anim.clone(clone_dict)) for start, anim in self.anims ]
         return new
 
     # --------------------
@@ -205,8 +296,9 @@ class InterpolateRotation(Animation):
         self.object.rotation = current_rotation
         return fraction != 1 # continue animation iff it is not completed
 
-    def clone(self):
-        return InterpolateRotation(self.object, self.dest_rotation, self.req_speed, self.req_time)
+    def clone(self, clone_dict=None):
+        object = clone_dict[self.object] if clone_dict is not None else self.object
+        return InterpolateRotation(object, self.dest_rotation, self.req_speed, self.req_time)
 
     # --------------------
 
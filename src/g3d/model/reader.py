@@ -26,52 +26,94 @@
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 import math
+import weakref
 import g3d
 import g3d.model
 
 from g3d import Vector2, Vector3, Quaternion
 
 def read(loader, name):
-    model = g3d.model.Model()
-    read_into(loader, name, model, model.root)
-    return model
+    ''' Returns new instance (g3d.model.ModelInstance) of (cached) template
+    of model file `name`. '''
+    template = get_template(loader, name)
+    prototype = template.prototype and template.prototype()
+    if prototype is None:
+        prototype = instantiate(loader, template)
+        template.prototype = weakref.ref(prototype)
+    return prototype.clone()
 
 def read_into(loader, name, model, group):
-    data = loader.read_file(name)
-    _load_group(loader, _parse(data), model, group)
+    template = get_template(loader, name)
+    _instantiate_nodes(loader, template.nodes, model, group)
+    _instantiate_animations(template, model)
 
-def _load_group(loader, tree, model, group):
-    if not tree:
-        return
+def get_template(loader, name):
+    '''
+    Returns compiled template of model file `name`. Templates are cached
+    in loader and compiled again if any of their files was modified.
+    '''
+    template = loader.template_cache.get(name)
+    if template is None or not template.is_fresh(loader):
+        template = loader.template_cache[name] = compile(loader, name)
+    return template
 
-    def handle_part():
-        model_name, name, translate, rotate, scale = \
-            _get_options(options, 'model', 'name', 'translate', 'rotate', 'scale')
-        obj = g3d.wrap(loader.get_model(model_name))
-        group.add(obj)
-        _bind_trans(obj, translate, rotate, scale)
-        if name:
-            model.objects[name] = obj
+class Template(object):
+    '''
+    Compiled model file (with includes resolved). Nodes are tuples:
+    - ('part', name, transform, mesh_name)
+    - ('group', name, transform, children)
+    where transform is (pos, rotation, scale). Animations are tuples
+    (name, [ (start, object_name, rotation, speed, time) ]).
 
-    def handle_include():
-        name, = _get_options(options, 'name')
-        read_into(loader, name, model, group)
+    Meshes are referenced only by name and resolved through
+    loader.model_cache, so templates don't keep evicted meshes alive.
+    The prototype is kept only as long as some instance uses it.
+    '''
+    def __init__(self, name):
+        self.name = name
+        self.nodes = []
+        self.animations = []
+        self.files = {} # name -> mtime at compilation
+        self.prototype = None # weakref to Model shared by instances returned by read
 
-    def handle_group():
-        name, translate, rotate, scale = \
-            _get_options(options, 'name', 'translate', 'rotate', 'scale')
-        obj = g3d.Container()
-        _bind_trans(obj, translate, rotate, scale)
-        _load_group(loader, children, model, obj)
-        group.add(obj)
-        if name:
-            model.objects[name] = obj
+    def is_fresh(self, loader):
+        return all( loader.get_mtime(name) == mtime
+                    for name, mtime in self.files.iteritems() )
 
-    def handle_animation():
-        name, = _get_options(options, 'name')
-        animation = g3d.model.AnimationGroup()
-        model.animations[name] = animation
-        _load_anim(loader, children, model, animation)
+def compile(loader, name):
+    template = Template(name)
+    _compile_file(loader, name, template, template.nodes)
+    return template
+
+def instantiate(loader, template):
+    model = g3d.model.Model()
+    _instantiate_nodes(loader, template.nodes, model, model.root)
+    _instantiate_animations(template, model)
+    return model
+
+def get_dependencies(loader, name):
+    ' Returns set of names of files needed to read model `name` (including itself). '
+    template = get_template(loader, name)
+    names = set(template.files)
+
+    def walk(nodes):
+        for kind, _, _, payload in nodes:
+            if kind == 'part':
+                names.add(payload)
+            else:
+                walk(payload)
+
+    walk(template.nodes)
+    names.discard(None)
+    return names
+
+def _compile_file(loader, name, template, nodes):
+    template.files[name] = loader.get_mtime(name)
+    _compile_group(loader, _parse(loader.read_file(name)), template, nodes)
+
+def _compile_group(loader, tree, template, nodes):
+    if not tree:
+        return
 
     def assert_no_children():
         if children:
@@ -82,54 +124,88 @@ def _load_group(loader, tree, model, group):
 
         if command == 'include':
             assert_no_children()
-            handle_include()
+            name, = _get_options(options, 'name')
+            _compile_file(loader, name, template, nodes)
         elif command == 'part':
             assert_no_children()
-            handle_part()
+            model_name, name, translate, rotate, scale = \
+                _get_options(options, 'model', 'name', 'translate', 'rotate', 'scale')
+            nodes.append(('part', name, _compile_trans(translate, rotate, scale), model_name))
         elif command == 'group':
-            handle_group()
+            name, translate, rotate, scale = \
+                _get_options(options, 'name', 'translate', 'rotate', 'scale')
+            group_nodes = []
+            _compile_group(loader, children, template, group_nodes)
+            nodes.append(('group', name, _compile_trans(translate, rotate, scale), group_nodes))
         elif command == 'animation':
-            handle_animation()
+            name, = _get_options(options, 'name')
+            template.animations.append((name, _compile_anim(children)))
         else:
             raise SyntaxError('invalid command %s' % command)
 
-def _load_anim(loader, tree, model, animation):
+def _compile_anim(tree):
     def assert_no_children():
         if children:
             raise SyntaxError('command %s shouldn\'t have any children' % command)
 
-    for item, children in tree:
+    anims = []
+    for item, children in tree or []:
         command, options = _parse_line(item)
 
         if command == 'interpolate_to':
             assert_no_children()
             name, rotate, start, speed, time = _get_options(options, 'name', 'rotate',
                                                             'start', 'speed', 'time')
-            speed = float(speed) if speed else None
-            speed = speed * math.pi / 180
+            speed = float(speed) * math.pi / 180 if speed else None
             time = float(time) if time else None
             start = float(start or 0.0)
-            rotate = _parse_rotate(rotate)
-            anim = g3d.model.InterpolateRotation(model.objects[name], rotate, speed=speed, time=time)
-            animation.add(start=start, animation=anim)
+            anims.append((start, name, _parse_rotate(rotate), speed, time))
         else:
             raise SyntaxError('invalid command %s' % command)
+    return anims
+
+def _compile_trans(translate, rotate, scale):
+    return (Vector3(*_float_list(translate)), _parse_rotate(rotate),
+            float(scale) if scale else 1)
+
+def _instantiate_nodes(loader, nodes, model, group):
+    for kind, name, transform, payload in nodes:
+        if kind == 'part':
+            obj = g3d.wrap(loader.get_model(payload))
+        else:
+            obj = g3d.Container()
+            _instantiate_nodes(loader, payload, model, obj)
+        _bind_trans(obj, transform)
+        group.add(obj)
+        if name:
+            model.objects[name] = obj
+
+def _instantiate_animations(template, model):
+    for name, anims in template.animations:
+        animation = g3d.model.AnimationGroup()
+        for start, object_name, rotation, speed, time in anims:
+            animation.add(start=start, animation=g3d.model.InterpolateRotation(
+                model.objects[object_name], _copy_rotation(rotation), speed=speed, time=time))
+        model.animations[name] = animation
 
 def _float_list(s):
     if not s:
         return [0., 0., 0.]
     return map(float, s.split(','))
 
-def _bind_trans(obj, translate, rotate, scale):
-    obj.pos = Vector3(*_float_list(translate))
-    obj.rotation = _parse_rotate(rotate)
-    obj.scale = float(scale) if scale else 1
+def _bind_trans(obj, (pos, rotation, scale)):
+    obj.pos = Vector3(pos.x, pos.y, pos.z)
+    obj.rotation = _copy_rotation(rotation)
+    obj.scale = scale
+
+def _copy_rotation(q):
+    return Quaternion(q.w, q.x, q.y, q.z)
 
 def _parse_rotate(s):
     rotate = _float_list(s)
     if len(rotate) == 4: # around axis
         return Quaternion.new_rotate_axis(rotate[0] / 180. * math.pi,
-                                                  Vector3(*vector[1:]))
+                                                  Vector3(*rotate[1:]))
     else:
         x, y, z = [ i / 180. * math.pi for i in rotate ]
         return Quaternion.new_rotate_euler(y, z, x)
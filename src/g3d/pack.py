@@ -0,0 +1,222 @@
+# Copyright (c) 2012, Michal Zielinski <michal@zielinscy.org.pl>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     * Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+#
+#     * Redistributions in binary form must reproduce the above
+#     copyright notice, this list of conditions and the following
+#     disclaimer in the documentation and/or other materials provided
+#     with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+'''
+Asset pack - single file with content of loader index, cooked so it
+can be used without parsing or decoding (see cook and Loader.add_pack).
+
+Layout: MAGIC, entry data (each aligned to ALIGN bytes), pickled index
+and TRAILER with offset of the index. Index maps name to Entry. Every
+entry keeps original file data and its SHA1 - models and textures also
+have cooked form:
+ - ('mesh', [(texture name, offset, length)]) - triangles grouped by
+   texture, packed like in serialized TriangleObject,
+ - ('texture', (width, height), offset, length) - decoded RGBX pixels.
+'''
+
+import g3d
+
+import collections
+import cPickle
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import StringIO
+
+MAGIC = 'g3d-pack 1\n'
+TRAILER = struct.Struct('!Q')
+ALIGN = 8
+
+Entry = collections.namedtuple('Entry', 'offset length sha1 cooked')
+
+class PackError(Exception):
+    ' Raised when pack file is malformed. '
+
+class Pack(object):
+    ' Memory mapped pack file. '
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.data[:len(MAGIC)] != MAGIC or len(self.data) < len(MAGIC) + TRAILER.size:
+            raise PackError('%s is not a pack' % path)
+        index_offset, = TRAILER.unpack_from(self.data, len(self.data) - TRAILER.size)
+        try:
+            self.entries = cPickle.loads(self.data[index_offset:-TRAILER.size])
+        except Exception as err:
+            raise PackError('%s has corrupted index: %s' % (path, err))
+
+    def read(self, name):
+        entry = self.entries[name]
+        return self.data[entry.offset:entry.offset + entry.length]
+
+    def open(self, name):
+        ' Returns read-only file-like view of file `name`. '
+        entry = self.entries[name]
+        return MappedFile(self.data, entry.offset, entry.length)
+
+    def get_sha1(self, name):
+        return self.entries[name].sha1
+
+    def get_model(self, name, get_texture):
+        ''' Returns TriangleObject for cooked mesh `name` (or None if it
+        wasn't cooked). Triangles are decoded from the mapped pack when
+        they are first used. '''
+        cooked = self.entries[name].cooked
+        if not cooked or cooked[0] != 'mesh':
+            return None
+        return g3d.TriangleObject.from_packed([
+            (get_texture(texture) if texture else None, buffer(self.data, offset, length))
+            for texture, offset, length in cooked[1] ])
+
+    def get_texture(self, name):
+        ''' Returns lazy TextureWrapper for cooked texture `name` (or None if
+        it wasn't cooked). Pixels are copied from the mapped pack when
+        they are first used. '''
+        cooked = self.entries[name].cooked
+        if not cooked or cooked[0] != 'texture':
+            return None
+        kind, size, offset, length = cooked
+        texture = g3d.TextureWrapper.lazy(
+            lambda: g3d.create_rgbx_texture(self.data[offset:offset + length], size),
+            size=size)
+        texture.name = name
+        texture.sha1 = self.get_sha1(name)
+        return texture
+
+class MappedFile(object):
+    ' File-like view of part of a mapped file. '
+    def __init__(self, data, start, length):
+        self.data = data
+        self.start = start
+        self.length = length
+        self.pos = 0
+
+    def read(self, n=-1):
+        if n < 0:
+            n = self.length - self.pos
+        n = max(0, min(n, self.length - self.pos))
+        offset = self.start + self.pos
+        self.pos += n
+        return self.data[offset:offset + n]
+
+    def seek(self, pos, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            pos += self.pos
+        elif whence == os.SEEK_END:
+            pos += self.length
+        self.pos = max(0, pos)
+
+    def tell(self):
+        return self.pos
+
+    def close(self):
+        pass
+
+class PackWriter(object):
+    ' Writes pack to `path` - it is renamed into place in close(). '
+    def __init__(self, path):
+        self.path = path
+        self._tmp = '%s.tmp%d' % (path, os.getpid())
+        self._file = open(self._tmp, 'wb')
+        self._file.write(MAGIC)
+        self.entries = {}
+
+    def _write(self, data):
+        padding = -self._file.tell() % ALIGN
+        self._file.write('\0' * padding)
+        offset = self._file.tell()
+        self._file.write(data)
+        return offset, len(data)
+
+    def add_file(self, name, data, cooked=None):
+        offset, length = self._write(data)
+        self.entries[name] = Entry(offset, length, hashlib.sha1(data).hexdigest(), cooked)
+
+    def add_mesh(self, name, data, groups):
+        ' `groups` is list of (texture name, packed triangles). '
+        cooked = ('mesh', [ (texture, ) + self._write(packed) for texture, packed in groups ])
+        self.add_file(name, data, cooked)
+
+    def add_texture(self, name, data, size, pixels):
+        cooked = ('texture', size) + self._write(pixels)
+        self.add_file(name, data, cooked)
+
+    def close(self):
+        index_offset = self._file.tell()
+        cPickle.dump(self.entries, self._file, cPickle.HIGHEST_PROTOCOL)
+        self._file.write(TRAILER.pack(index_offset))
+        self._file.close()
+        os.rename(self._tmp, self.path)
+
+def cook(loader, path):
+    '''
+    Writes everything in loader index to pack at `path`. Models (names
+    with one of loader.model_extensions) are parsed and textures (names
+    with one of loader.texture_extensions) decoded - if that fails, only
+    original data is stored.
+    '''
+    writer = PackWriter(path)
+    models = []
+    for name in sorted(loader.index):
+        data = loader.read_file(name)
+        if name.endswith(loader.texture_extensions) and loader.enable_textures:
+            try:
+                texture = loader._load_texture(StringIO.StringIO(data))
+            except Exception as err:
+                logging.warning('failed to decode texture %s: %s', name, err)
+            else:
+                writer.add_texture(name, data, texture.size, texture.data)
+                continue
+        elif name.endswith(loader.model_extensions):
+            # after textures - so they refer to cooked ones
+            models.append((name, data))
+            continue
+        writer.add_file(name, data)
+
+    for name, data in models:
+        try:
+            groups = _pack_model(loader, loader._load_model(StringIO.StringIO(data)))
+        except Exception as err:
+            logging.warning('failed to cook model %s: %s', name, err)
+            writer.add_file(name, data)
+        else:
+            writer.add_mesh(name, data, groups)
+
+    writer.close()
+    return writer.entries
+
+def _pack_model(loader, obj):
+    if not isinstance(obj, g3d.TriangleObject):
+        raise TypeError('only TriangleObjects can be cooked, not %s' % type(obj).__name__)
+    groups = collections.OrderedDict()
+    for t in obj.triangles:
+        # name of the file, not the one model asked for (e.g. .png for .bmp)
+        texture = t.texture.name if t.texture else None
+        groups.setdefault(texture, []).append(obj._pack_triangle(t))
+    return [ (texture, ''.join(packed)) for texture, packed in groups.items() ]
@@ -31,14 +31,22 @@ like models are not transmitted inline, but instead their SHA1 is embedded.
 
 Serializer doesn't work magically like pickle - all classes need to marked
 as serializable and provide _serialize and _unserialized methods.
+
+Serializer created with canonical=True produces the same bytes (and so the
+same SHA1) for logically identical objects, no matter in which order they
+were built or which process serializes them. Classes may provide
+_serialize_canonical, which is used instead of _serialize in this mode.
 '''
 
 import struct as _struct # do not use directly
 import hashlib
 import collections
+import functools
 import StringIO
 import logging
 
+import g3d.cache
+
 serializables_by_id = {}
 serializables_by_type = {}
 
@@ -62,9 +70,29 @@ def serializer_for(for_type):
 
     return method
 
+def serialize_as(clazz):
+    ''' Objects of decorated class will be serialized (and unserialized)
+    as objects of serializable class `clazz`. '''
+    def method(subclass):
+        serializables_by_type[subclass] = serializables_by_type[clazz]
+        return subclass
+
+    return method
+
 def sha1(data):
     return hashlib.sha1(data).digest()
 
+def normalize_float(value):
+    ' Returns value with one representation for zero and NaN (for canonical encoding). '
+    if isinstance(value, float):
+        if value != value:
+            return _NAN
+        elif value == 0:
+            return 0.0
+    return value
+
+_NAN = float('nan')
+
 def add_serializable_class(clazz, for_type):
     if clazz.serial_id in serializables_by_id:
         raise RuntimeError('id collision: %s and %s' % (clazz, serializables_by_id[clazz.serial_id]))
@@ -73,89 +101,207 @@ def add_serializable_class(clazz, for_type):
 
 MODULE_BUILTIN = 0
 ID_SHA1 = 1
+ID_REF = 9 # object already written to this blob
+ID_VALUE_REF = 10 # equal value already written to this blob
 
 SHA1_LENGTH = 20
 
 class Serializer(object):
-    def __init__(self):
-        self.objects = IdDict()
-        self.objects_by_sha1 = {}
-        self.deps = IdDict()
-        self.serialized_by_sha1 = {}
+    '''
+    Added objects are stored serialized (with SHA1s of their dependencies)
+    - objects themselves are not kept. If `budget` is given, stored data
+    is limited to about `budget` bytes, least recently added or used
+    entries are dropped.
+    '''
+    def __init__(self, canonical=False, budget=None):
+        self.canonical = canonical
+        # sha1 -> (data, SHA1s of dependencies)
+        self.blobs = g3d.cache.LRUCache(budget if budget is not None else float('inf'),
+                                        _blob_size)
+        # number of added objects that were (not) already stored
+        self.hits = 0
+        self.misses = 0
 
     def add(self, object):
-        data = self.serialize(object, no_separate=True)
+        return self._add(object)[0]
+
+    def _add(self, object):
+        refs = WriteRefTable()
+        data = self.serialize(object, no_separate=True, refs=refs)
         id = sha1(data)
-        self.objects[object] = id
-        self.serialized_by_sha1[id] = data
-        self.objects_by_sha1[id] = object
-        return id
+        if id in self.blobs:
+            self.hits += 1
+        else:
+            self.misses += 1
+        deps = [ item for item in refs.deps.get(object, []) if item != id ]
+        self.blobs[id] = (data, deps)
+        for dep in deps:
+            # needed as long as the object - don't evict them first
+            self.blobs.get(dep)
+        return id, deps
 
     def get_dependencies_by_sha1(self, sha1):
-        return self.get_dependencies(self.objects_by_sha1[sha1])
+        ' Returns SHA1s of dependencies of object added as `sha1`. '
+        return self.blobs[sha1][1]
 
     def get_dependencies(self, object):
+        ' Returns SHA1s of dependencies of `object` (adds it if needed). '
         if type(object) == str and len(object) == SHA1_LENGTH:
             logging.warn('get_dependencies on something that looks like sha1')
-        ' Returns SHA1 of dependencies '
-        return [ item for item in self.deps.get(object, [])
-                 if item != self.objects[object] ]
+        return self._add(object)[1]
 
     def get_by_sha1(self, sha1):
-        return self.serialized_by_sha1[sha1]
+        return self.blobs[sha1][0]
 
-    def serialize(self, object, no_separate=False):
+    def serialize(self, object, no_separate=False, refs=None):
         to = StringIO.StringIO()
-        self.serialize_to(to, object, no_separate=no_separate)
+        self.serialize_to(to, object, no_separate=no_separate, refs=refs)
         return to.getvalue()
 
-    def serialize_to(self, out, object, no_separate=False):
+    def serialize_to(self, out, object, no_separate=False, refs=None):
+        '''
+        Writes object to out. Objects already written to the same blob
+        (tracked by `refs`) are written as back-references.
+        '''
+        if refs is None:
+            refs = WriteRefTable()
+
         serializer = self._get_serializer(object)
         separate = getattr(serializer, 'serial_separate', False)
+        use_refs = getattr(serializer, 'serial_ref', True)
+        # in canonical mode output must not depend on whether equal values
+        # are the same object - they are referenced only by content
+        by_id = not (self.canonical and _is_value(serializer))
+
+        if use_refs and by_id:
+            index = refs.by_id.get(object)
+            if index is not None:
+                out.write( pack('HHI', MODULE_BUILTIN, ID_REF, index) )
+                return
 
         if not no_separate and separate:
+            refs.register(object)
             out.write( pack('HH', MODULE_BUILTIN, ID_SHA1) )
-            id = self.add(object)
+            id, deps = self._add(object)
             assert len(id) == SHA1_LENGTH
-            self.deps.setdefault(object, []).append(id)
+            refs.deps.setdefault(object, []).extend(deps + [id])
             out.write( id )
-        else:
+        elif issubclass(serializer, IterableSerializer):
+            refs.register(object, by_id=by_id)
             out.write( pack('HH', *serializer.serial_id) )
-            self._serialize_content(out, serializer, object)
-
-    def _serialize_content(self, out, serializer, object):
-        if issubclass(serializer, IterableSerializer):
-            self._serialize_iterable(out, object)
+            self._serialize_iterable(out, object, refs)
         else:
-            result = serializer._serialize(object)
+            result = self._call_serialize(serializer, object)
             struct_code = getattr(serializer, 'serial_struct', Ellipsis)
 
             if struct_code == Ellipsis:
-                self.serialize_to(out, result)
-                self.extend_dep(object, result)
-            elif struct_code:
-                out.write( pack(struct_code, *result) )
+                refs.register(object)
+                out.write( pack('HH', *serializer.serial_id) )
+                self.serialize_to(out, result, refs=refs)
+                self.extend_dep(object, result, refs)
+                return
+
+            if struct_code:
+                content = pack(struct_code, *result)
             elif struct_code == None:
-                out.write( pack('I', len(result)) )
-                out.write(result)
+                content = pack('I', len(result)) + result
+            else:
+                content = ''
+
+            if use_refs:
+                # values are compared by content - equal values are written only once
+                key = (serializer.serial_id, content)
+                index = refs.by_value.get(key)
+                refs.register(object, key, by_id=by_id)
+                if index is not None:
+                    out.write( pack('HHI', MODULE_BUILTIN, ID_VALUE_REF, index) )
+                    return
+
+            out.write( pack('HH', *serializer.serial_id) )
+            out.write(content)
+
+    def _call_serialize(self, serializer, object):
+        if self.canonical and hasattr(serializer, '_serialize_canonical'):
+            result = serializer._serialize_canonical(object)
+        else:
+            result = serializer._serialize(object)
+
+        if self.canonical and getattr(serializer, 'serial_struct', None):
+            result = map(normalize_float, result)
+        return result
 
-    def _serialize_iterable(self, out, object):
+    def _serialize_iterable(self, out, object, refs):
         l = list(object)
         out.write( pack('I', len(l)) )
         for item in l:
-            self.serialize_to(out, item)
-            self.extend_dep(object, item)
+            self.serialize_to(out, item, refs=refs)
+            self.extend_dep(object, item, refs)
 
-    def extend_dep(self, object, src_object):
-        self.deps.setdefault(object, []).extend( self.deps.get(src_object, []) )
+    def extend_dep(self, object, src_object, refs):
+        deps = refs.deps.get(src_object)
+        if deps:
+            refs.deps.setdefault(object, []).extend(deps)
 
     def _get_serializer(self, object):
         return serializables_by_type[object.__class__]
 
+def _blob_size((data, deps)):
+    return len(data) + SHA1_LENGTH * len(deps) + 200
+
+def _is_value(serializer):
+    ''' Returns True if objects serialized by `serializer` are values - equal
+    ones are interchangeable (structs, strings and tuples). '''
+    return (getattr(serializer, 'serial_struct', Ellipsis) is not Ellipsis
+            or serializer is TupleSerializer)
+
+class WriteRefTable(object):
+    '''
+    Objects written to one blob. Each object gets next index in order in
+    which writing it started - ReadRefTable assigns indexes in the same order.
+    '''
+    def __init__(self):
+        self.by_id = IdDict()
+        self.by_value = {}
+        self.count = 0
+        # object -> SHA1s of separate objects it contains
+        self.deps = IdDict()
+
+    def register(self, object, value_key=None, by_id=True):
+        ''' Assigns index to object. Unless `by_id` is false, the object
+        is registered only once and later found in self.by_id. '''
+        if by_id:
+            if self.by_id.get(object) is not None:
+                return
+            self.by_id[object] = self.count
+        if value_key is not None:
+            self.by_value.setdefault(value_key, self.count)
+        self.count += 1
+
+class ReadRefTable(object):
+    def __init__(self):
+        self.entries = []
+
+    def reserve(self):
+        self.entries.append(None)
+        return len(self.entries) - 1
+
+    def get(self, index):
+        entry = self.entries[index]
+        if entry is None:
+            raise ValueError('reference to object that is not completely read (%d)' % index)
+        return entry
+
 class Unserializer(object):
-    def __init__(self, cache=None):
+    '''
+    Loads objects serialized by Serializer.
+    If `lazy` is true, separate objects which classes provide
+    _unserialize_lazy are not decoded until they are used - their
+    _unserialize_lazy gets a function that decodes the object.
+    '''
+    def __init__(self, cache=None, lazy=False):
         self.cache = cache or {}
         self.loaded = {}
+        self.lazy = lazy
 
     def add(self, sha1, data):
         self.cache[sha1] = data
@@ -166,40 +312,71 @@ class Unserializer(object):
                 data = self.cache[sha1]
             except KeyError:
                 raise ObjectNotAddedError(sha1)
-            input = StringIO.StringIO(data)
-            obj = self.load_from(input)
+            serializer = self._get_serializer(unpack('HH', data[:4]))
+            if self.lazy and hasattr(serializer, '_unserialize_lazy'):
+                obj = serializer._unserialize_lazy(functools.partial(self._decode, sha1))
+            else:
+                obj = self._decode(sha1)
             self.loaded[sha1] = obj
 
         return self.loaded[sha1]
 
-    def load_from(self, input):
-        def safe_call(serializer, args):
-            try:
-                return serializer._unserialize(*args)
-            except TypeError as err:
-                logging.error('when calling _unserialize of %s: %s', serializer, err)
-                raise
+    def _decode(self, sha1):
+        return self.load_from(StringIO.StringIO(self.cache[sha1]))
+
+    def load_from(self, input, refs=None):
+        if refs is None:
+            refs = ReadRefTable()
 
         id = unpack('HH', input.read(4))
-        if id == (MODULE_BUILTIN, ID_SHA1):
-            return self.load(input.read(SHA1_LENGTH))
+        if id == (MODULE_BUILTIN, ID_REF):
+            index, = unpack('I', input.read(4))
+            return refs.get(index)[0]
+        elif id == (MODULE_BUILTIN, ID_VALUE_REF):
+            # equal value, but not the same object - create a copy
+            index, = unpack('I', input.read(4))
+            obj, serializer, params = refs.get(index)
+            if params is not None:
+                obj = self._call_unserialize(serializer, params)
+            refs.entries.append((obj, serializer, params))
+            return obj
+        elif id == (MODULE_BUILTIN, ID_SHA1):
+            index = refs.reserve()
+            obj = self.load(input.read(SHA1_LENGTH))
+            refs.entries[index] = (obj, None, None)
+            return obj
+
+        serializer = self._get_serializer(id)
+        use_refs = getattr(serializer, 'serial_ref', True)
+        index = refs.reserve() if use_refs else None
+        params = None
+
+        if issubclass(serializer, IterableSerializer):
+            size, = unpack('I', input.read(4))
+            l = [ self.load_from(input, refs) for i in xrange(size) ]
+            obj = serializer.iter_class(l)
         else:
-            serializer = self._get_serializer(id)
-            if issubclass(serializer, IterableSerializer):
+            struct = getattr(serializer, 'serial_struct', Ellipsis)
+            if struct == None:
                 size, = unpack('I', input.read(4))
-                l = [ self.load_from(input) for i in xrange(size) ]
-                return serializer.iter_class(l)
+                obj = serializer._unserialize(input.read(size))
+            elif struct == Ellipsis:
+                obj = self._call_unserialize(serializer, self.load_from(input, refs))
             else:
-                struct = getattr(serializer, 'serial_struct', Ellipsis)
-                if struct == None:
-                    size, = unpack('I', input.read(4))
-                    return serializer._unserialize(input.read(size))
-                elif struct == Ellipsis:
-                    return safe_call(serializer, self.load_from(input))
-                else:
-                    size = calcsize(struct)
-                    params = unpack(struct, input.read(size))
-                    return safe_call(serializer, params)
+                size = calcsize(struct)
+                params = unpack(struct, input.read(size))
+                obj = self._call_unserialize(serializer, params)
+
+        if use_refs:
+            refs.entries[index] = (obj, serializer, params)
+        return obj
+
+    def _call_unserialize(self, serializer, args):
+        try:
+            return serializer._unserialize(*args)
+        except TypeError as err:
+            logging.error('when calling _unserialize of %s: %s', serializer, err)
+            raise
 
     def _get_serializer(self, id):
         return serializables_by_id[id]
@@ -256,6 +433,8 @@ class TupleSerializer(IterableSerializer):
     iter_class = tuple
 
 class PrimitiveSerializer:
+    serial_ref = False # reference wouldn't be shorter
+
     @staticmethod
     def _serialize(self):
         return (self, )
@@ -291,6 +470,7 @@ class FloatSerializer(PrimitiveSerializer):
 class NoneSerializer:
     serial_struct = ''
     serial_id = MODULE_BUILTIN, 7
+    serial_ref = False
 
     @staticmethod
     def _serialize(self):
@@ -301,13 +481,17 @@ class NoneSerializer:
         return None
 
 @serializer_for(dict)
-class NoneSerializer:
+class DictSerializer:
     serial_id = MODULE_BUILTIN, 8
 
     @staticmethod
     def _serialize(self):
         return (self.items(), )
 
+    @staticmethod
+    def _serialize_canonical(self):
+        return (sorted(self.items()), )
+
     @staticmethod
     def _unserialize(seq):
         return dict(seq)
@@ -335,7 +519,6 @@ if __name__ == '__main__':
     data = s.get_by_sha1(sha1hash)
     import zlib
     print len(data), len(zlib.compress(data))
-    print [ i.encode('hex') for i in s.deps[model] ]
     print [ i.encode('hex') for i in s.get_dependencies(model) ]
 
     uns = g3d.serialize.Unserializer()
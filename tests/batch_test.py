@@ -0,0 +1,125 @@
+import sys
+import os
+import unittest
+import threading
+import logging
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import colobot.client
+from colobot.client import BatchCallError
+from colobot.server.server import ConnectionHandler
+
+class FakeRpc(object):
+    ' Stands in for JsonRpcChannel - dispatches to ConnectionHandler-like server. '
+    def __init__(self, server):
+        self.server = server
+        self.calls = []
+
+    def call_func(self, name, *args, **kwargs):
+        self.calls.append(name)
+        return getattr(self.server, 'rpc_' + name)(*args, **kwargs)
+
+class Handler(ConnectionHandler):
+    ' ConnectionHandler without connection. '
+    def __init__(self):
+        self.rpc = FakeRpc(self)
+        self.log = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def rpc_add(self, a, b=0):
+        self.log.append(('add', a, b))
+        return a + b
+
+    def rpc_wait(self):
+        self.release.wait()
+
+    def rpc_fail(self):
+        self.log.append(('fail', ))
+        raise KeyError('game')
+
+class FakeClient(colobot.client.Client):
+    ' Client without connection. '
+    def __init__(self, rpc):
+        self.rpc = rpc
+        self._rpc_lock = threading.Lock()
+        self._call_pool = None
+        self._async_lock = threading.Lock()
+        self._async_batch = None
+
+class TestBatch(unittest.TestCase):
+    def setUp(self):
+        self.handler = Handler()
+        self.client = FakeClient(self.handler.rpc)
+
+    def test_results(self):
+        with self.client.batch() as batch:
+            first = batch.call('add', 1, 2)
+            second = batch.call('add', 3, b=4)
+            self.assertFalse(first.ready())
+            self.assertRaises(RuntimeError, first.get)
+        self.assertEqual((first.get(), second.get()), (3, 7))
+        # one round trip
+        self.assertEqual(self.handler.rpc.calls, ['batch'])
+
+    def test_error_doesnt_stop_batch(self):
+        logging.disable(logging.DEBUG)
+        try:
+            with self.client.batch() as batch:
+                failed = batch.call('fail')
+                after = batch.call('add', 1)
+        finally:
+            logging.disable(logging.NOTSET)
+        self.assertRaises(BatchCallError, failed.get)
+        self.assertEqual(after.get(), 1)
+        self.assertEqual(self.handler.log, [('fail', ), ('add', 1, 0)])
+
+    def test_not_sent_on_exception(self):
+        try:
+            with self.client.batch() as batch:
+                result = batch.call('add', 1)
+                raise ValueError()
+        except ValueError:
+            pass
+        self.assertFalse(result.ready())
+        self.assertEqual(self.handler.rpc.calls, [])
+
+    def test_empty(self):
+        with self.client.batch():
+            pass
+        self.assertEqual(self.handler.rpc.calls, [])
+
+    def test_unknown_method(self):
+        with self.client.batch() as batch:
+            result = batch.call('no_such_method')
+        self.assertRaises(BatchCallError, result.get)
+
+    def test_call_async_in_order(self):
+        results = [ self.client.call_async('add', i) for i in xrange(10) ]
+        self.assertEqual([ result.get() for result in results ], range(10))
+        self.assertEqual(self.handler.log, [ ('add', i, 0) for i in xrange(10) ])
+
+    def test_call_async_pipelined(self):
+        self.handler.release.clear()
+        first = self.client.call_async('wait')
+        while not self.handler.rpc.calls:
+            time.sleep(0.001)
+        # sent while the first batch is in flight
+        results = [ self.client.call_async('add', i) for i in xrange(10) ]
+        self.handler.release.set()
+        self.assertEqual([ result.get() for result in results ], range(10))
+        self.assertEqual(first.get(), None)
+        self.assertEqual(self.handler.rpc.calls, ['batch', 'batch'])
+
+    def test_call_async_error(self):
+        logging.disable(logging.DEBUG)
+        try:
+            result = self.client.call_async('fail')
+            self.assertRaises(BatchCallError, result.get)
+        finally:
+            logging.disable(logging.NOTSET)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import sys
+import os
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import colobot.game
+
+from colobot.control import pack, unpack, MOTOR, SELECT, VIEW, ControlError
+
+class FakeModel(object):
+    def __init__(self):
+        self.root = FakeRoot()
+
+class FakeRoot(object):
+    pass
+
+class TestControl(unittest.TestCase):
+    def setUp(self):
+        self.game = colobot.game.Game(loader=None)
+        self.bot = colobot.game.Object(self.game, FakeModel())
+        self.game.add_object(self.bot)
+
+    def test_pack(self):
+        data = pack(7, MOTOR, self.bot.ident, 1, -0.5)
+        self.assertEqual(len(data), 5 + 9 + 8)
+        self.assertEqual(unpack(data), (7, MOTOR, (self.bot.ident, 1.0, -0.5)))
+
+    def test_malformed(self):
+        self.assertRaises(ControlError, unpack, 'x')
+        self.assertRaises(ControlError, unpack, pack(1, SELECT, '') + 'x')
+        self.assertRaises(ControlError, unpack, pack(1, SELECT, '')[:5] + '\xff')
+
+    def test_apply_in_order(self):
+        self.game.handle_input('conn', 'player', pack(1, MOTOR, self.bot.ident, 1, 1))
+        self.game.handle_input('conn', 'player', pack(2, SELECT, self.bot.ident))
+        self.assertEqual(self.bot.motor, (0, 0))
+        self.game._apply_commands()
+        self.assertEqual(self.bot.motor, (1, 1))
+        self.assertEqual(self.game.input_acks, {'conn': 2})
+        self.assertEqual(self.game.get_player('player').selected, self.bot.ident)
+
+    def test_ignore_old(self):
+        self.game.handle_input('conn', 'player', pack(2, MOTOR, self.bot.ident, 1, 1))
+        self.game.handle_input('conn', 'player', pack(1, MOTOR, self.bot.ident, 0, 1))
+        self.game._apply_commands()
+        self.assertEqual(self.bot.motor, (1, 1))
+        self.assertEqual(self.game.input_acks, {'conn': 2})
+
+    def test_deselect_stops_bot(self):
+        self.game.handle_input('conn', 'player', pack(1, SELECT, self.bot.ident))
+        self.game.handle_input('conn', 'player', pack(2, MOTOR, self.bot.ident, 1, 1))
+        self.game.handle_input('conn', 'player', pack(3, SELECT, ''))
+        self.game._apply_commands()
+        self.assertEqual(self.bot.motor, (0, 0))
+        self.assertEqual(self.game.get_player('player').selected, None)
+
+    def test_view(self):
+        self.game.handle_input('conn', 'player', pack(1, VIEW, 10, -20, 300))
+        self.game._apply_commands()
+        self.assertEqual(self.game.views, {'conn': (10, -20, 300)})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+import sys
+import os
+import unittest
+import shutil
+import tempfile
+import json
+import threading
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import colobot.server.db
+from colobot.server.db import Journal
+from colobot.server.models import Profile, Sessions
+from colobot.server.db import NotFoundError
+
+class TestJournal(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'users')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_reopen(self):
+        journal = Journal(self.path, key='login', indexes=('mail', ))
+        journal.put({'login': 'a', 'mail': 'a@x'})
+        journal.put({'login': 'b', 'mail': 'b@x'})
+        journal.put({'login': 'a', 'mail': 'a@y'})
+        journal.delete('b')
+        journal.sync()
+
+        journal = Journal(self.path, key='login', indexes=('mail', ))
+        self.assertEqual(journal.data, [{'login': 'a', 'mail': 'a@y'}])
+        self.assertEqual(journal.find('mail', 'a@y')['login'], 'a')
+        self.assertEqual(journal.find('mail', 'a@x'), None)
+        self.assertEqual(journal.find('login', 'b'), None)
+
+    def test_compact(self):
+        journal = Journal(self.path, key='login', is_expired=lambda entry: entry['old'])
+        for i in xrange(300):
+            journal.put({'login': str(i % 10), 'old': i % 10 == 9})
+        journal.sync()
+
+        self.assertEqual(journal._journal_length, 0)
+        self.assertEqual(len(json.load(open(self.path))), 9)
+        self.assertEqual(len(Journal(self.path, key='login').data), 9)
+
+    def test_compact_doesnt_block(self):
+        journal = Journal(self.path, key='login')
+        journal.put({'login': 'a'})
+        writing = threading.Event()
+        release = threading.Event()
+        overwrite = colobot.server.db._overwrite
+        def slow_overwrite(path, content):
+            writing.set()
+            release.wait()
+            overwrite(path, content)
+
+        colobot.server.db._overwrite = slow_overwrite
+        try:
+            thread = threading.Thread(target=journal.compact)
+            thread.start()
+            self.assertTrue(writing.wait(5))
+            # snapshot is being written - entries are still available
+            self.assertEqual(journal.find('login', 'a'), {'login': 'a'})
+            journal.put({'login': 'b'})
+            release.set()
+            thread.join()
+        finally:
+            colobot.server.db._overwrite = overwrite
+            release.set()
+        journal.sync()
+        self.assertEqual(sorted( entry['login'] for entry in Journal(self.path, key='login').data ),
+                         ['a', 'b'])
+
+    def test_interrupted_compact(self):
+        journal = Journal(self.path, key='login')
+        journal.put({'login': 'a'})
+        journal.sync()
+        # compaction swapped journals, but crashed before writing snapshot
+        os.rename(self.path + '.journal', self.path + '.journal.old')
+        self.assertEqual(Journal(self.path, key='login').data, [{'login': 'a'}])
+        self.assertFalse(os.path.exists(self.path + '.journal.old'))
+        self.assertEqual(json.load(open(self.path)), [{'login': 'a'}])
+
+    def test_old_format(self):
+        with open(self.path, 'w') as f:
+            json.dump([{'login': 'root', 'uid': 'x'}], f)
+        self.assertEqual(Journal(self.path, key='uid').find('uid', 'x')['login'], 'root')
+
+    def test_corrupted_journal(self):
+        journal = Journal(self.path, key='login')
+        journal.put({'login': 'a'})
+        journal.sync()
+        with open(self.path + '.journal', 'a') as f:
+            f.write('{"put": {"lo')
+        self.assertEqual(len(Journal(self.path, key='login').data), 1)
+
+class TestSessions(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.profile = Profile(self.dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_sessions(self):
+        uid = self.profile.sessions.create_session('root')
+        self.assertEqual(self.profile.sessions.get_session(uid), 'root')
+        self.assertRaises(NotFoundError, self.profile.sessions.get_session, 'nothing')
+
+    def test_expiry(self):
+        sessions = self.profile.sessions
+        uid = sessions.create_session('root')
+        sessions.file.find('uid', uid)['expires'] = 0
+        self.assertRaises(NotFoundError, sessions.get_session, uid)
+        self.assertEqual(sessions.file.find('uid', uid), None)
+
+    def test_root_created(self):
+        self.assertEqual(self.profile.users.get_by('login', 'root').login, 'root')
+        self.assertEqual(len(Profile(self.dir).users.file.data), 1)
+
+if __name__ == '__main__':
+    unittest.main()
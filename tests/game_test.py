@@ -0,0 +1,171 @@
+import sys
+import os
+import unittest
+import threading
+import logging
+import time
+import functools
+import StringIO
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import colobot.game
+import colobot.game.scene_file as scene_file
+import g3d
+import g3d.loader
+from colobot.game import Game, Command
+from g3d.math import Vector3
+
+class FakeModel(object):
+    def __init__(self):
+        self.root = FakeModel.Root()
+
+    class Root(object):
+        scale = 1
+
+def make_object(game):
+    obj = colobot.game.Object(game, FakeModel())
+    obj.position = Vector3(0, 0, 1000) # falling, far above terrain
+    return obj
+
+class TestCommand(unittest.TestCase):
+    def test_result(self):
+        command = Command(lambda a, b: a + b, (1, 2))
+        command.apply()
+        self.assertEqual(command.wait(), 3)
+
+    def test_error(self):
+        def fail():
+            raise KeyError('x')
+        command = Command(fail, ())
+        logging.disable(logging.ERROR)
+        try:
+            command.apply()
+        finally:
+            logging.disable(logging.NOTSET)
+        self.assertRaises(KeyError, command.wait)
+
+    def test_wait_blocks_until_applied(self):
+        command = Command(lambda: 'done', ())
+        result = []
+        thread = threading.Thread(target=lambda: result.append(command.wait()))
+        thread.start()
+        thread.join(0.05)
+        self.assertEqual(result, [])
+        command.apply()
+        thread.join(5)
+        self.assertEqual(result, ['done'])
+
+class TestGame(unittest.TestCase):
+    def setUp(self):
+        self.game = Game(loader=None)
+
+    def test_post_applied_in_order(self):
+        calls = []
+        for i in xrange(3):
+            self.game.post(calls.append, i)
+        self.assertEqual(calls, [])
+        self.game.tick(0.05)
+        self.assertEqual(calls, [0, 1, 2])
+
+    def test_posted_during_tick_wait_for_next(self):
+        calls = []
+        def first():
+            calls.append('first')
+            self.game.post(calls.append, 'second')
+        self.game.post(first)
+        self.game.tick(0.05)
+        self.assertEqual(calls, ['first'])
+        self.game.tick(0.05)
+        self.assertEqual(calls, ['first', 'second'])
+
+    def test_failed_command_doesnt_stop_tick(self):
+        calls = []
+        def fail():
+            raise ValueError()
+        command = self.game.post(fail)
+        self.game.post(calls.append, 'next')
+        logging.disable(logging.ERROR)
+        try:
+            self.game.tick(0.05)
+        finally:
+            logging.disable(logging.NOTSET)
+        self.assertRaises(ValueError, command.wait)
+        self.assertEqual(calls, ['next'])
+
+    def test_publish(self):
+        obj = make_object(self.game)
+        command = self.game.add_objects([obj])
+        self.assertEqual(self.game.get_objects(), [])
+        self.game.tick(0.05)
+        command.wait()
+        self.assertEqual(self.game.get_objects(), [obj])
+
+        # snapshot is a copy - later ticks don't modify it
+        position = obj.snapshot[0]
+        before = tuple(position)
+        obj.position.x += 10
+        self.assertEqual(tuple(obj.snapshot[0]), before)
+        self.game.tick(0.05)
+        self.assertIsNot(obj.snapshot[0], position)
+
+SCENE = '''
+CreateObject pos= 10; 0 type=Titanium
+CreateObject pos= 0; 0 type=WheeledGrabber
+CreateObject pos= 20; 0 type=Titanium
+CreateObject pos= 30; 0 type=PowerCell
+CreateObject pos= 40; 0 type=Titanium
+'''
+
+class SceneLoader(g3d.loader.Loader):
+    ' Serves SCENE and one-part models of its objects. '
+    model_extensions = ('.mod', )
+
+    def __init__(self):
+        g3d.loader.Loader.__init__(self, enable_textures=False)
+        self.index['test.txt'] = functools.partial(StringIO.StringIO, SCENE)
+        for name in ('titanium.model', 'wheeled-transporter.model', 'power-cell.model'):
+            self.index[name] = functools.partial(StringIO.StringIO, 'part model=part.mod\n')
+        self.index['part.mod'] = lambda: None
+
+    def _load_model(self, input):
+        return g3d.TriangleObject([])
+
+class FlatGame(Game):
+    ' The test scene has no relief. '
+    def _set_terrain(self, terrain):
+        terrain.get_height_at = lambda pos: 0
+        Game._set_terrain(self, terrain)
+
+class TestLoadScene(unittest.TestCase):
+    def test_batches(self):
+        # compiled in memory, so load_scene doesn't write to scene cache
+        scene_file.get_compiled(SCENE, cache_path=None)
+        game = FlatGame(SceneLoader())
+        game.spawn_batch_size = 2
+        thread = threading.Thread(target=game.load_scene, args=('test.txt', ))
+        thread.start()
+
+        progress = []
+        counts = []
+        types = []
+        deadline = time.time() + 5
+        while (thread.is_alive() or game._commands) and time.time() < deadline:
+            if game._commands:
+                progress.append(game.loading_progress)
+                game.tick(0.05)
+                counts.append(len(game.get_objects()))
+                types.append(set( type(obj).__name__ for obj in game.get_objects() ))
+            else:
+                time.sleep(0.001)
+        thread.join()
+
+        # terrain, then one batch per tick
+        self.assertEqual(progress, [None, (0, 5), (2, 5), (4, 5)])
+        self.assertEqual(counts, [0, 2, 4, 5])
+        self.assertEqual(game.loading_progress, None)
+        # the bot is in the first batch
+        self.assertIn('WheeledGrabber', types[1])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,192 @@
+import sys
+import os
+import unittest
+import struct
+import tempfile
+import shutil
+import threading
+import time
+import functools
+import StringIO
+import weakref
+import gc
+import hashlib
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import g3d
+import g3d.cache
+import g3d.loader
+import g3d.model
+
+PNG_HEADER = '\x89PNG\r\n\x1a\n' + struct.pack('!I4sII', 13, 'IHDR', 2, 2)
+
+class CountingLoader(g3d.loader.Loader):
+    decoded = 0
+
+    def _load_texture(self, input):
+        CountingLoader.decoded += 1
+        return g3d.create_rgbx_texture('\1' * 16, (2, 2))
+
+class TestTextures(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.dir, 'data'))
+        with open(os.path.join(self.dir, 'data', 'tex.png'), 'wb') as f:
+            f.write(PNG_HEADER)
+        CountingLoader.decoded = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def make_loader(self):
+        loader = CountingLoader(pixel_cache_path=os.path.join(self.dir, 'cache'))
+        loader.add_directory(os.path.join(self.dir, 'data'))
+        return loader
+
+    def test_image_size(self):
+        self.assertEqual(g3d.loader.image_size(PNG_HEADER), (2, 2))
+        self.assertEqual(g3d.loader.image_size('BM' + '\0' * 16 + struct.pack('<ii', 3, -4)), (3, 4))
+        self.assertEqual(g3d.loader.image_size('garbage'), None)
+
+    def test_lazy(self):
+        texture = self.make_loader().get_texture('tex.png')
+        self.assertEqual(texture.size, (2, 2))
+        self.assertEqual(texture.name, 'tex.png')
+        self.assertEqual(CountingLoader.decoded, 0)
+        self.assertEqual(texture.data, '\1' * 16)
+        self.assertEqual(CountingLoader.decoded, 1)
+
+    def test_read_once(self):
+        loader = self.make_loader()
+        opened = []
+        open_file = loader.index['tex.png']
+        loader.index['tex.png'] = lambda: opened.append(1) or open_file()
+        texture = loader.get_texture('tex.png')
+        self.assertEqual(len(opened), 1)
+        self.assertEqual(texture.sha1, hashlib.sha1(PNG_HEADER).hexdigest())
+
+    def test_pixel_cache(self):
+        self.make_loader().get_texture('tex.png').data
+        texture = self.make_loader().get_texture('tex.png')
+        self.assertEqual(texture.data, '\1' * 16)
+        self.assertEqual(CountingLoader.decoded, 1)
+
+class SlowLoader(g3d.loader.Loader):
+    model_extensions = ('.mod', )
+
+    def __init__(self):
+        g3d.loader.Loader.__init__(self)
+        self.loaded = []
+        self.index['a.mod'] = self.index['b.mod'] = lambda: None
+
+    def _load_model(self, input):
+        time.sleep(0.05)
+        self.loaded.append(input)
+        return g3d.TriangleObject([])
+
+class TestConcurrency(unittest.TestCase):
+    def test_single_flight(self):
+        loader = SlowLoader()
+        results = []
+        threads = [ threading.Thread(target=lambda: results.append(loader.get_model('a.mod')))
+                    for i in xrange(4) ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(loader.loaded), 1)
+        self.assertTrue(all( result is results[0] for result in results ))
+
+    def test_prefetch(self):
+        loader = SlowLoader()
+        try:
+            a, b = [ result.get() for result in loader.prefetch(['a.mod', 'b.mod']) ]
+            self.assertIs(loader.get_model('a.mod'), a)
+            self.assertIs(loader.get_model('b.mod'), b)
+            self.assertEqual(len(loader.loaded), 2)
+        finally:
+            loader.close()
+
+    def test_error(self):
+        loader = SlowLoader()
+        self.assertRaises(KeyError, loader.get_model, 'missing.mod')
+        self.assertEqual(loader._loading, {})
+
+    def test_interrupted(self):
+        loader = SlowLoader()
+        def interrupt(input):
+            raise KeyboardInterrupt()
+        loader._load_model = interrupt
+        self.assertRaises(KeyboardInterrupt, loader.get_model, 'a.mod')
+        self.assertEqual(loader._loading, {})
+
+class BigMesh(g3d.TriangleObject):
+    estimated_size = 10000
+    alive = weakref.WeakSet()
+
+    def __init__(self):
+        g3d.TriangleObject.__init__(self, [])
+        BigMesh.alive.add(self)
+
+class TemplateLoader(g3d.loader.Loader):
+    model_extensions = ('.mod', )
+
+    def __init__(self, count, budget):
+        g3d.loader.Loader.__init__(self, model_cache_budget=budget)
+        for i in xrange(count):
+            self.index['m%d.model' % i] = functools.partial(
+                StringIO.StringIO, 'part model=mesh%d.mod name=body\n' % i)
+            self.index['mesh%d.mod' % i] = lambda: None
+
+    def _load_model(self, input):
+        return BigMesh()
+
+class TestTemplates(unittest.TestCase):
+    def test_meshes_stay_under_budget(self):
+        budget = 5 * g3d.loader.estimate_size(BigMesh())
+        loader = TemplateLoader(20, budget)
+        for i in xrange(20):
+            g3d.model.read(loader, 'm%d.model' % i)
+        gc.collect()
+        self.assertEqual(len(loader.template_cache), 20)
+        self.assertTrue(len(BigMesh.alive) <= 5, len(BigMesh.alive))
+        self.assertTrue(loader.model_cache.size <= budget)
+
+    def test_prototype_shared_while_used(self):
+        loader = TemplateLoader(1, 1024 * 1024)
+        first = g3d.model.read(loader, 'm0.model')
+        second = g3d.model.read(loader, 'm0.model')
+        self.assertIs(first.template, second.template)
+
+class Value(object):
+    def __init__(self, size):
+        self.estimated_size = size
+
+class TestCache(unittest.TestCase):
+    def make_cache(self):
+        return g3d.cache.LRUCache(budget=100, sizeof=lambda value: value.estimated_size)
+
+    def test_eviction(self):
+        cache = self.make_cache()
+        cache['a'] = Value(50)
+        cache['b'] = Value(40)
+        cache['a']
+        cache['c'] = Value(30)
+        self.assertEqual(cache.size, 80)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.stats()['evictions'], 1)
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+    def test_revive(self):
+        cache = self.make_cache()
+        used = cache['a'] = Value(60)
+        cache['b'] = Value(60)
+        self.assertEqual(len(cache), 1)
+        self.assertIs(cache['a'], used)
+        self.assertEqual(cache.stats()['revived'], 1)
+        self.assertRaises(KeyError, lambda: cache['b'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,38 @@
+import sys
+import os
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from colobot.client.loadgen import Samples, Report, SimulatedPlayer
+
+class TestLoadgen(unittest.TestCase):
+    def test_samples(self):
+        s = Samples()
+        self.assertEqual(s.percentile(50), None)
+        for i in xrange(1, 101):
+            s.add(i)
+        self.assertEqual(s.percentile(50), 50)
+        self.assertEqual(s.percentile(99), 99)
+        self.assertEqual(s.percentile(100), 100)
+
+    def test_updates(self):
+        report = Report()
+        player = SimulatedPlayer('tcp:localhost:0', 'root', '', 'game', report,
+                                 update_interval=0.1)
+        player.on_update(100)
+        player.on_update(50)
+        self.assertEqual(report.updates, 2)
+        self.assertEqual(report.bytes, 150)
+        self.assertEqual(len(report.update_interval), 1)
+        self.assertTrue(report.jitter.percentile(100) <= 0.1)
+
+    def test_errors(self):
+        report = Report()
+        report.add_error(KeyError('x'))
+        report.add_error(KeyError('x'))
+        self.assertEqual(report.errors.values(), [2])
+        self.assertIn('errors: 2', report.format())
+
+if __name__ == '__main__':
+    unittest.main()
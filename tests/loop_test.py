@@ -0,0 +1,154 @@
+import sys
+import os
+import unittest
+import threading
+import time
+import logging
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from colobot.server.loop import EventLoop, LoopDispatcher, blocking
+
+TIMEOUT = 5
+
+class TestEventLoop(unittest.TestCase):
+    def setUp(self):
+        self.loop = EventLoop(workers=1)
+        self.loop.start()
+
+    def wait_for(self, func, *args):
+        done = threading.Event()
+        def call():
+            func(*args)
+            done.set()
+        self.loop.call_soon(call)
+        self.assertTrue(done.wait(TIMEOUT))
+
+    def test_ordering(self):
+        calls = []
+        self.loop.call_later(0.05, calls.append, 'later')
+        self.loop.call_soon(calls.append, 'first')
+        self.loop.call_soon(calls.append, 'second')
+        time.sleep(0.1)
+        self.wait_for(calls.append, 'end')
+        self.assertEqual(calls, ['first', 'second', 'later', 'end'])
+
+    def test_call_every(self):
+        calls = []
+        handle = self.loop.call_every(0.01, calls.append)
+        time.sleep(0.1)
+        handle.cancel()
+        self.wait_for(lambda: None)
+        count = len(calls)
+        self.assertTrue(count >= 3, count)
+        self.assertTrue(all(elapsed >= 0 for elapsed in calls))
+
+        time.sleep(0.05)
+        self.wait_for(lambda: None)
+        self.assertEqual(len(calls), count)
+        self.assertEqual(self.loop.queue_size(), 0)
+
+    def test_call_every_survives_exception(self):
+        calls = []
+        def fail(elapsed):
+            calls.append(elapsed)
+            raise ValueError()
+        logging.disable(logging.ERROR)
+        try:
+            handle = self.loop.call_every(0.01, fail)
+            time.sleep(0.1)
+            handle.cancel()
+        finally:
+            logging.disable(logging.NOTSET)
+        self.assertTrue(len(calls) >= 2)
+
+    def test_call_and_wait(self):
+        self.assertEqual(self.loop.call_and_wait(lambda a, b: a + b, 1, 2), 3)
+        self.assertEqual(self.loop.call_and_wait(threading.current_thread), self.loop._thread)
+
+        def fail():
+            raise KeyError('x')
+        self.assertRaises(KeyError, self.loop.call_and_wait, fail)
+
+    def test_executor_callback(self):
+        results = []
+        done = threading.Event()
+        def callback(result):
+            results.append((result, threading.current_thread()))
+            done.set()
+        self.loop.run_in_executor(lambda x: x * 2, 21, callback=callback)
+        self.assertTrue(done.wait(TIMEOUT))
+        self.assertEqual(results, [(42, self.loop._thread)])
+
+    def test_send_async(self):
+        class Channel(object):
+            def __init__(self):
+                self.sent = []
+            def send(self, data):
+                if data == 'fail':
+                    raise IOError()
+                self.sent.append(data)
+
+        channel = Channel()
+        errors = []
+        self.loop.send_async(channel, 'a', callback=errors.append).get(TIMEOUT)
+        self.loop.send_async(channel, 'fail', callback=errors.append).get(TIMEOUT)
+        self.wait_for(lambda: None)
+        self.assertEqual(channel.sent, ['a'])
+        self.assertEqual(errors[0], None)
+        self.assertTrue(isinstance(errors[1], IOError))
+
+    def test_stalled_send_doesnt_block_executor(self):
+        release = threading.Event()
+        class StalledChannel(object):
+            def send(self, data):
+                release.wait()
+
+        try:
+            # more stalled clients than executor workers
+            for i in xrange(3):
+                self.loop.send_async(StalledChannel(), 'data')
+            self.assertEqual(self.loop.run_in_executor(lambda: 'ok').get(TIMEOUT), 'ok')
+        finally:
+            release.set()
+
+class Handler(object):
+    def __init__(self):
+        self.dispatcher = None
+
+    def rpc_add(self, a, b):
+        return a + b
+
+    @blocking
+    def rpc_inner(self):
+        return threading.current_thread()
+
+    @blocking
+    def rpc_outer(self):
+        # like rpc_batch - calls another blocking method from executor
+        return self.dispatcher.rpc_inner(), threading.current_thread()
+
+class TestLoopDispatcher(unittest.TestCase):
+    def setUp(self):
+        self.loop = EventLoop(workers=1)
+        self.loop.start()
+        self.handler = Handler()
+        self.dispatcher = self.handler.dispatcher = LoopDispatcher(self.handler, self.loop)
+
+    def test_call(self):
+        self.assertEqual(self.dispatcher.rpc_add(1, 2), 3)
+
+    def test_reentrant_blocking(self):
+        # with one worker this would deadlock if inner call waited for the pool
+        result = []
+        thread = threading.Thread(target=lambda: result.append(self.dispatcher.rpc_outer()))
+        thread.daemon = True
+        thread.start()
+        thread.join(TIMEOUT)
+        self.assertEqual(len(result), 1)
+        inner, outer = result[0]
+        self.assertIs(inner, outer)
+        self.assertIsNot(inner, self.loop._thread)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import sys
+import os
+import unittest
+import struct
+import tempfile
+import StringIO
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from colobot import metafile
+
+KEY = metafile.cipher_keys['full']
+
+def encrypt(data, offset):
+    return ''.join( chr(KEY[(offset + i) % len(KEY)] ^ ord(ch))
+                    for i, ch in enumerate(data) )
+
+def make_archive(entries):
+    pos = 4 + len(entries) * struct.calcsize('14sii')
+    table = body = ''
+    for name, data in entries:
+        table += struct.pack('14sii', name, pos, len(data))
+        body += encrypt(data, pos)
+        pos += len(data)
+    return struct.pack('i', len(entries)) + encrypt(table, 4) + body
+
+class TestMetafile(unittest.TestCase):
+    entries = [('a.mod', ''.join( chr(i % 256) for i in xrange(1000) )),
+               ('b.txt', 'hello world')]
+
+    def test_decrypt(self):
+        data = 'some data to decrypt' * 10
+        for offset in (0, 5, 22, 23, 1000):
+            self.assertEqual(metafile.Cipher(KEY).decrypt(encrypt(data, offset), offset), data)
+
+    def test_read(self):
+        f = metafile.MetaFile(KEY, StringIO.StringIO(make_archive(self.entries)))
+        for name, data in self.entries:
+            self.assertEqual(f.read(name), data)
+
+    def test_mmap(self):
+        fd, path = tempfile.mkstemp()
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                out.write(make_archive(self.entries))
+            f = metafile.MetaFile.open_path(path)
+            data = dict(self.entries)['a.mod']
+            entry = f.open('a.mod')
+            entry.seek(100)
+            self.assertEqual(entry.read(10), data[100:110])
+            self.assertEqual(entry.tell(), 110)
+            self.assertEqual(entry.read(), data[110:])
+            self.assertEqual(entry.read(), '')
+        finally:
+            os.remove(path)
+
+if __name__ == '__main__':
+    unittest.main()
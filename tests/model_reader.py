@@ -46,5 +46,76 @@ f
         
         self.assertRaises(IndentationError, g3d.model.reader._parse, 'a\n   b\n c')
 
+class FakeLoader(object):
+    def __init__(self, files):
+        self.files = files
+        self.mtimes = dict( (name, 1) for name in files )
+        self.template_cache = {}
+        self.reads = 0
+
+    def read_file(self, name):
+        self.reads += 1
+        return self.files[name]
+
+    def get_mtime(self, name):
+        return self.mtimes[name]
+
+    def get_model(self, name):
+        return name
+
+class TestTemplates(unittest.TestCase):
+    def setUp(self):
+        self.loader = FakeLoader({
+            'a.model': 'group name=arm rotate=90,0,0\n    include name=b.model\n'
+                       'animation name=up\n    interpolate_to name=arm rotate=0,0,0 time=1\n',
+            'b.model': 'part model=x.mod name=hand translate=1,2,3 scale=2\n',
+        })
+
+    def test_instantiate(self):
+        model = g3d.model.reader.read(self.loader, 'a.model')
+        hand = model.objects['hand']
+        self.assertEqual(hand.objects, ['x.mod'])
+        self.assertEqual((hand.pos.x, hand.pos.y, hand.pos.z, hand.scale), (1, 2, 3, 2))
+        self.assertEqual(model.objects['arm'].objects, [hand])
+        self.assertEqual(model.animations['up'].anims[0][1].object, model.objects['arm'])
+        self.assertEqual(g3d.model.reader.get_dependencies(self.loader, 'a.model'),
+                         set(['a.model', 'b.model', 'x.mod']))
+
+    def test_cache(self):
+        first = g3d.model.reader.read(self.loader, 'a.model')
+        second = g3d.model.reader.read(self.loader, 'a.model')
+        self.assertEqual(self.loader.reads, 2)
+        self.assertTrue(first.objects['arm'] is not second.objects['arm'])
+        rotation = second.objects['arm'].rotation
+        first.objects['arm'].rotation = g3d.Quaternion()
+        self.assertTrue(second.objects['arm'].rotation is rotation)
+
+        self.loader.mtimes['b.model'] = 2
+        g3d.model.reader.read(self.loader, 'a.model')
+        self.assertEqual(self.loader.reads, 4)
+
+    def test_instance(self):
+        template = g3d.model.reader.read(self.loader, 'a.model').template
+        model = template.clone()
+        model.root.scale = 5
+        self.assertEqual((model.root.scale, template.root.scale), (5, 1))
+        self.assertTrue(model.root.objects is template.root.objects)
+
+        hand = model.objects['hand']
+        self.assertTrue(model.objects['arm'].objects[0] is hand)
+        self.assertTrue(model.root.objects[0] is model.objects['arm'])
+        self.assertTrue(template.objects['arm'].objects[0] is not hand)
+
+        animation = model.animations['up']
+        animation.init()
+        animation.tick(2)
+        self.assertTrue(model.objects['arm'].rotation is not template.objects['arm'].rotation)
+        self.assertTrue(template.animations['up'].anims[0][1].object is template.objects['arm'])
+
+    def test_instance_has_no_dict(self):
+        model = g3d.model.reader.read(self.loader, 'a.model')
+        for obj in (model, model.root, model.objects['arm']):
+            self.assertFalse(hasattr(obj, '__dict__'), type(obj))
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,88 @@
+import sys
+import os
+import unittest
+import tempfile
+import shutil
+import struct
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import g3d
+import g3d.pack
+import g3d.serialize
+import colobot.loader
+
+DATA = os.path.join(os.path.dirname(__file__), '..', 'data')
+PNG_HEADER = '\x89PNG\r\n\x1a\n' + struct.pack('!I4sII', 13, 'IHDR', 2, 2)
+
+class TexturedLoader(colobot.loader.Loader):
+    ' Decodes every texture to the same 2x2 image. '
+    def __init__(self):
+        colobot.loader.Loader.__init__(self, pixel_cache_path=None)
+
+    def _load_texture(self, input):
+        return g3d.create_rgbx_texture('\1' * 16, (2, 2))
+
+class TestPack(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'test.pack')
+        shutil.copy(os.path.join(DATA, 'models', 'ant1.mod.gz'), self.dir)
+        with open(os.path.join(self.dir, 'hello.txt'), 'w') as f:
+            f.write('hello world')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def make_loader(self):
+        loader = colobot.loader.Loader(enable_textures=False)
+        loader.add_directory(self.dir)
+        return loader
+
+    def test_cook(self):
+        loader = self.make_loader()
+        entries = g3d.pack.cook(loader, self.path)
+        self.assertEqual(entries['ant1.mod'].cooked[0], 'mesh')
+        self.assertEqual(entries['hello.txt'].cooked, None)
+
+        packed = colobot.loader.Loader(enable_textures=False)
+        packed.add_pack(self.path)
+        self.assertEqual(packed.read_file('hello.txt'), 'hello world')
+        self.assertEqual(packed.get_sha1('hello.txt'), loader.get_sha1('hello.txt'))
+
+        f = packed.index['hello.txt']()
+        f.seek(6)
+        self.assertEqual(f.read(), 'world')
+
+        s = g3d.serialize.Serializer(canonical=True)
+        self.assertEqual(s.add(packed.get_model('ant1.mod')),
+                         s.add(loader.get_model('ant1.mod')))
+
+    def test_cook_textures(self):
+        # ant1.mod uses ant.bmp
+        with open(os.path.join(self.dir, 'ant.png'), 'wb') as f:
+            f.write(PNG_HEADER)
+        loader = TexturedLoader()
+        loader.add_directory(self.dir)
+        entries = g3d.pack.cook(loader, self.path)
+        self.assertEqual(entries['ant.png'].cooked[0], 'texture')
+        self.assertEqual([ texture for texture, offset, length in entries['ant1.mod'].cooked[1] ],
+                         ['ant.png'])
+
+        packed = TexturedLoader()
+        packed.add_pack(self.path)
+        texture = packed.get_model('ant1.mod').triangles[0].texture
+        self.assertIs(texture, packed.get_texture('ant.png'))
+        self.assertEqual(texture.name, 'ant.png')
+        self.assertEqual(texture.sha1, loader.get_sha1('ant.png'))
+        self.assertEqual(texture.size, (2, 2))
+        self.assertEqual(texture.data, '\1' * 16)
+
+    def test_bad_pack(self):
+        with open(self.path, 'wb') as f:
+            f.write('not a pack at all')
+        with self.assertRaises(g3d.pack.PackError):
+            g3d.pack.Pack(self.path)
+
+if __name__ == '__main__':
+    unittest.main()
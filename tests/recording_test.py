@@ -0,0 +1,59 @@
+import sys
+import os
+import unittest
+import tempfile
+import shutil
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import g3d
+import g3d.serialize
+import colobot.recording
+from colobot.client.replay import ReplayClient, benchmark_decode
+
+class TestRecording(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'test.rec')
+        self.serializer = g3d.serialize.Serializer(canonical=True)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def record(self, blobs):
+        recorder = colobot.recording.Recorder(self.path, self.serializer.get_by_sha1,
+                                              self.serializer.get_dependencies_by_sha1)
+        recorder.add_terrain(self.serializer.add(g3d.Container()))
+        for data in blobs:
+            recorder.add_blob(self.serializer.serialize(data),
+                              [ model for ident, model in data[1] ])
+        recorder.close()
+
+    def test_roundtrip(self):
+        model = self.serializer.add(g3d.Container())
+        blobs = [
+            (1.0, [('a' * 9, model)], [], [], 0, None),
+            (1.1, [('b' * 9, model)], [], [], 1, (2, 2)),
+        ]
+        self.record(blobs)
+
+        recording = colobot.recording.Recording.load(self.path)
+        self.assertEqual(len(recording.blobs), 2)
+        self.assertIn(model, recording.resources)
+        self.assertIsNotNone(recording.terrain)
+
+        client = ReplayClient(recording, speed=0)
+        self.assertIsInstance(client.get_terrain('game'), g3d.Container)
+        channel = client.open_update_channel('game')
+        self.assertEqual(channel.recv(), recording.blobs[0][1])
+        self.assertEqual(len(benchmark_decode(recording)), 2)
+
+    def test_truncated(self):
+        self.record([(1.0, [], [], [], 0, None)])
+        with open(self.path, 'r+b') as f:
+            f.truncate(os.path.getsize(self.path) - 1)
+        with self.assertRaises(colobot.recording.RecordingError):
+            colobot.recording.Recording.load(self.path)
+
+if __name__ == '__main__':
+    unittest.main()
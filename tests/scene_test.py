@@ -0,0 +1,61 @@
+import sys
+import os
+import unittest
+import tempfile
+import shutil
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import colobot.game.scene_file as scene_file
+
+SCENE = '''
+Title text="Test"
+TerrainRelief image="textures\\\\relief11.bmp" factor=1.0
+CreateObject pos= 3.75;-2.50 dir=0.5 type=Titanium // comment
+CreateObject pos= 1; 2; 3 type=PowerCell run=1
+CreateObject pos= 0; 0 dir=1.0 type=Titanium
+'''
+
+class TestSceneFile(unittest.TestCase):
+    def setUp(self):
+        self.cache = tempfile.mkdtemp()
+        scene_file._compiled.clear()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache)
+
+    def test_compile(self):
+        scene = scene_file.compile(SCENE.splitlines())
+        self.assertEqual(scene.commands, [('TerrainRelief', {'image': 'textures\\\\relief11.bmp',
+                                                             'factor': 1.0})])
+        self.assertEqual(scene.types, ['Titanium', 'PowerCell'])
+        objects = [ scene.get_object(i) for i in xrange(len(scene.object_types)) ]
+        self.assertEqual([ o['type'] for o in objects ], ['Titanium', 'PowerCell', 'Titanium'])
+        self.assertEqual([ tuple(o['pos']) for o in objects ], [(3.75, -2.5, 0), (1, 2, 3), (0, 0, 0)])
+        self.assertEqual([ o['dir'] for o in objects ], [0.5, 0.0, 1.0])
+
+    def test_cache(self):
+        first = scene_file.get_compiled(SCENE, cache_path=self.cache)
+        self.assertEqual(len(os.listdir(self.cache)), 1)
+        self.assertTrue(scene_file.get_compiled(SCENE, cache_path=self.cache) is first)
+
+        scene_file._compiled.clear()
+        second = scene_file.get_compiled(SCENE, cache_path=self.cache)
+        self.assertTrue(second is not first)
+        self.assertEqual(second.types, first.types)
+        self.assertEqual(list(second.positions), list(first.positions))
+
+    def test_spawn_order(self):
+        scene = scene_file.compile('''
+CreateObject pos= 5; 0 type=Titanium
+CreateObject pos= 100; 100 type=WheeledGrabber
+CreateObject pos= 0; 0 type=UnknownThing
+CreateObject pos= 101; 100 type=Titanium
+CreateObject pos= 0; 0 type=BotFactory
+CreateObject pos= 100; 101 type=PowerCell
+'''.splitlines())
+        # selectable first (the first one is the center), then by distance
+        self.assertEqual(scene_file.spawn_order(scene), [1, 4, 3, 5, 0])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import sys
+import os
+import unittest
+import logging
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import g3d
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+class TestScheduler(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.scheduler = g3d.Scheduler(step=0.1, max_steps=3, clock=self.clock)
+        self.steps = []
+        self.scheduler.add_ticker(self.steps.append, name='ticker')
+
+    def advance(self, delta):
+        self.clock.now += delta
+        self.scheduler.tick()
+
+    def test_fixed_step(self):
+        self.scheduler.tick()
+        self.advance(0.05)
+        self.assertEqual(self.steps, [])
+        self.advance(0.07)
+        self.assertEqual(self.steps, [0.1])
+        self.advance(0.19)
+        self.assertEqual(self.steps, [0.1] * 3)
+
+    def test_max_steps(self):
+        self.scheduler.tick()
+        self.advance(1.0)
+        self.assertEqual(len(self.steps), 3)
+        self.assertAlmostEqual(self.scheduler.dropped_time, 0.7)
+        self.advance(0.1)
+        self.assertEqual(len(self.steps), 4)
+
+    def test_intervals(self):
+        calls = []
+        self.scheduler.add_interval(0.5, lambda: calls.append('a'))
+        self.scheduler.add_interval(0.2, lambda: calls.append('b'))
+        self.scheduler.call_later(0.3, lambda: calls.append('once'))
+        for i in xrange(6):
+            self.advance(0.1)
+        self.assertEqual(calls, ['b', 'once', 'b', 'a', 'b'])
+        self.assertAlmostEqual(self.scheduler.time_to_next(), 0.1)
+
+    def test_stats(self):
+        def slow(step):
+            self.clock.now += 0.02
+        self.scheduler.add_ticker(slow)
+        self.scheduler.tick()
+        self.advance(0.1)
+        self.advance(0.1)
+        stats = self.scheduler.stats['slow']
+        self.assertEqual(stats.calls, 2)
+        self.assertAlmostEqual(stats.average_time, 0.02)
+        self.assertEqual(self.scheduler.stats['ticker'].calls, 2)
+
+    def test_exception_doesnt_stop_others(self):
+        def fail(step):
+            raise ValueError()
+        scheduler = g3d.Scheduler(step=0.1, clock=self.clock)
+        calls = []
+        scheduler.add_ticker(fail)
+        scheduler.add_ticker(calls.append)
+        scheduler.add_interval(0.1, lambda: calls.append('interval'))
+        logging.disable(logging.ERROR)
+        try:
+            scheduler.tick()
+            self.clock.now += 0.1
+            scheduler.tick()
+        finally:
+            logging.disable(logging.NOTSET)
+        self.assertEqual(calls, [0.1, 'interval'])
+        self.assertEqual(scheduler.stats['fail'].calls, 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,12 +5,16 @@ import unittest
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
 
 import hashlib
+import random
+import weakref
+import gc
 
 import g3d
 import g3d.gl
 import g3d.camera_drivers
 import g3d.model
 import g3d.serialize
+import g3d.cache
 import colobot.loader
 
 class TestSerialize(unittest.TestCase):
@@ -31,5 +35,197 @@ class TestSerialize(unittest.TestCase):
         self.assertEqual( hashlib.sha1(s.get_by_sha1(sha1)).digest(), sha1 )
         self.assertEqual( s.get_dependencies(model), ['\x17,XO\xc6\xcd=T\xe0!\x184+P?\x03!\xb5\xc1\xc3'] )
 
+class TestCanonical(unittest.TestCase):
+    def make_triangles(self, textures):
+        V3, V2 = g3d.Vector3, g3d.Vector2
+        triangles = []
+        for i in xrange(12):
+            triangles.append(g3d.Triangle(
+                V3(i, 0, 0), V3(0, i, 0), V3(0, 0, i),
+                V3(0, 0, 1), V3(0, 0, 1), V3(0, 0, 1),
+                V2(0, 0), V2(i / 12., 0), V2(0, i / 12.),
+                textures[i % len(textures)]))
+        return triangles
+
+    def make_model(self, triangles):
+        obj = g3d.TriangleObject(triangles)
+        container = g3d.wrap(obj)
+        container.pos = g3d.Vector3(1, -0.0, 2.5)
+        return container
+
+    def make_textures(self):
+        return [ g3d.TextureWrapper(ch * 16, (2, 2)) for ch in 'ab' ] + [None]
+
+    def test_triangle_order(self):
+        triangles = self.make_triangles(self.make_textures())
+        shuffled = list(triangles)
+        random.Random(0).shuffle(shuffled)
+
+        s = g3d.serialize.Serializer(canonical=True)
+        self.assertEqual(s.add(self.make_model(triangles)),
+                         s.add(self.make_model(shuffled)))
+
+    def test_texture_identity(self):
+        # output must not depend on addresses of texture objects
+        s = g3d.serialize.Serializer(canonical=True)
+        for i in xrange(5):
+            self.assertEqual(s.add(self.make_model(self.make_triangles(self.make_textures()))),
+                             s.add(self.make_model(self.make_triangles(self.make_textures()))))
+
+    def test_dict_order(self):
+        keys = [ 'key%d' % i for i in xrange(100) ]
+        a = dict( (key, i) for i, key in enumerate(keys) )
+        b = {}
+        for key in reversed(keys):
+            b[key] = a[key]
+        for i in xrange(1000):
+            b['tmp%d' % i] = None
+        for i in xrange(1000):
+            del b['tmp%d' % i]
+
+        s = g3d.serialize.Serializer(canonical=True)
+        self.assertEqual(s.serialize(a), s.serialize(b))
+
+    def test_negative_zero(self):
+        s = g3d.serialize.Serializer(canonical=True)
+        self.assertEqual(s.serialize(g3d.Vector3(0.0, -0.0, 1)),
+                         s.serialize(g3d.Vector3(-0.0, 0.0, 1)))
+        self.assertEqual(s.serialize(-0.0), s.serialize(0.0))
+
+    def test_shared_values(self):
+        # equal values give the same bytes whether they are one object or not
+        s = g3d.serialize.Serializer(canonical=True)
+        v = g3d.Vector3(1, 2, 3)
+        self.assertEqual(s.add([v, v]), s.add([g3d.Vector3(1, 2, 3), g3d.Vector3(1, 2, 3)]))
+        name = 'abc'
+        self.assertEqual(s.add((name, name)), s.add(('ab' + 'c', ''.join('abc'))))
+        t = (1, 'x')
+        self.assertEqual(s.add([t, t]), s.add([(1, 'x'), tuple([1, 'x'])]))
+
+        shared = [v, v, (name, v), (name, v)]
+        uns = g3d.serialize.Unserializer()
+        sha1 = s.add(shared)
+        uns.add(sha1, s.get_by_sha1(sha1))
+        self.assertEqual(uns.load(sha1), shared)
+
+    def test_stable_hash(self):
+        # hash must stay the same between runs and machines - if this test fails
+        # after intentional format change, update the constant
+        s = g3d.serialize.Serializer(canonical=True)
+        model = self.make_model(self.make_triangles(self.make_textures()))
+        self.assertEqual(s.add(model).encode('hex'), '8dcf84f698bbda4d57379328e3e29f4dd5c60315')
+        self.assertEqual(s.add({'b': 1, 'a': [1.5, None, 'x']}).encode('hex'), '1f98e9b9b1e83dd319a7a4a7353ca0cb1d459654')
+
+def roundtrip(obj, lazy=False):
+    s = g3d.serialize.Serializer()
+    sha1 = s.add(obj)
+    uns = g3d.serialize.Unserializer(lazy=lazy)
+    for ident in [sha1] + s.get_dependencies_by_sha1(sha1):
+        uns.add(ident, s.get_by_sha1(ident))
+    return uns.load(sha1)
+
+class TestRefs(unittest.TestCase):
+    roundtrip = staticmethod(roundtrip)
+
+    def test_shared_object(self):
+        vec = g3d.Vector3(1, 2, 3)
+        a, b, c = self.roundtrip([vec, vec, g3d.Vector3(1, 2, 3)])
+        self.assertIs(a, b)
+        self.assertIsNot(a, c)
+        self.assertEqual(a, c)
+
+    def test_equal_values(self):
+        s = g3d.serialize.Serializer()
+        rotations = [ g3d.Quaternion() for i in xrange(100) ]
+        self.assertLess(len(s.serialize(rotations)), 100 * 12)
+
+        result = self.roundtrip(rotations + [rotations[5]])
+        self.assertEqual(len(set(map(id, result))), 100)
+        self.assertIs(result[5], result[100])
+        self.assertEqual((result[7].w, result[7].x), (1, 0))
+
+    def test_nested(self):
+        text = 'x' * 50
+        tri = g3d.TriangleObject([])
+        root = g3d.Container()
+        root.add(g3d.wrap(tri))
+        root.add(g3d.wrap(tri))
+        root.add(g3d.wrap(tri))
+        data = [root, {'a': text, 'b': text, 'c': (text, root)}]
+
+        new_root, d = self.roundtrip(data)
+        self.assertIs(d['c'][1], new_root)
+        self.assertEqual(d['a'], text)
+        parts = [ c.objects[0] for c in new_root.objects ]
+        self.assertIs(parts[0], parts[1])
+        self.assertIs(parts[0], parts[2])
+
+class TestLazy(unittest.TestCase):
+    def test_lazy_mesh(self):
+        texture = g3d.TextureWrapper('\xff' * 16, (2, 2))
+        triangles = TestCanonical('test_triangle_order').make_triangles([texture])
+        obj = roundtrip(g3d.wrap(g3d.TriangleObject(triangles)), lazy=True).objects[0]
+
+        self.assertIs(obj._triangles, None)
+        self.assertIs(obj.triangles[0].texture._data, None)
+        self.assertEqual(obj.triangles[3].c, g3d.Vector3(0, 0, 3))
+        self.assertEqual(obj.triangles[0].texture.size, (2, 2))
+        self.assertEqual(obj.triangles[0].texture.data, texture.data)
+
+        obj.release()
+        self.assertIs(obj._triangles, None)
+        self.assertEqual(len(obj.triangles), len(triangles))
+
+    def test_release_cache(self):
+        released = []
+        class Holder(object):
+            def release(self):
+                released.append(self)
+
+        cache = g3d.cache.ReleaseCache(budget=100)
+        a, b, c = Holder(), Holder(), Holder()
+        cache.touch(a, 50)
+        cache.touch(b, 40)
+        cache.touch(a, 50)
+        cache.touch(c, 30)
+        self.assertEqual(released, [b])
+        self.assertEqual(cache.size, 80)
+
+class TestBudget(unittest.TestCase):
+    budget = 20000
+
+    def make_model(self, i):
+        # like a scene with its own models - every one has new texture
+        texture = g3d.TextureWrapper(chr(i) * 16, (2, 2))
+        V3, V2 = g3d.Vector3, g3d.Vector2
+        triangles = [ g3d.Triangle(V3(i, j, 0), V3(0, i, j), V3(j, 0, i),
+                                   V3(0, 0, 1), V3(0, 0, 1), V3(0, 0, 1),
+                                   V2(0, 0), V2(1, 0), V2(0, 1), texture)
+                      for j in xrange(20) ]
+        return g3d.wrap(g3d.TriangleObject(triangles))
+
+    def test_bounded(self):
+        s = g3d.serialize.Serializer(canonical=True, budget=self.budget)
+        added = [ s.add(self.make_model(i)) for i in xrange(200) ]
+        self.assertTrue(s.blobs.size <= self.budget, s.blobs.size)
+        self.assertTrue(s.blobs.evictions > 0)
+        self.assertRaises(KeyError, s.get_by_sha1, added[0])
+
+        # the newest model is available with its dependencies
+        deps = s.get_dependencies_by_sha1(added[-1])
+        self.assertEqual(len(deps), 2) # mesh and texture
+        for sha1 in [added[-1]] + deps:
+            self.assertEqual(hashlib.sha1(s.get_by_sha1(sha1)).digest(), sha1)
+
+    def test_objects_not_kept(self):
+        s = g3d.serialize.Serializer(canonical=True)
+        model = self.make_model(1)
+        s.add(model)
+        s.serialize((model, [model]))
+        ref = weakref.ref(model)
+        del model
+        gc.collect()
+        self.assertIs(ref(), None)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,55 @@
+import sys
+import os
+import unittest
+import time
+import StringIO
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import colobot.game
+import colobot.control
+import g3d.loader
+import g3d.serialize
+from colobot.server.shard import WorkerPool
+
+def slow_call(game, seconds):
+    time.sleep(seconds)
+    return 'slow'
+
+# workers are forked after this, so they have it too
+colobot.game.Game.slow_call = slow_call
+
+class TestWorkerPool(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.pool = WorkerPool(g3d.loader.Loader(enable_textures=False), 2)
+
+    def unserialize(self, blob):
+        return g3d.serialize.Unserializer().load_from(StringIO.StringIO(blob))
+
+    def test_game_call_and_poll(self):
+        game = self.pool.create_game('roundtrip')
+        game.handle_input('conn', 'player', colobot.control.pack(1, colobot.control.VIEW, 0, 0, 100))
+        handler_id = game.worker.call('open_updates', 'roundtrip', 'conn')
+        time.sleep(0.2) # a few ticks of worker
+        blob, resources = game.worker.call('poll_updates', handler_id)
+        data = self.unserialize(blob)
+        self.assertEqual(data[4], 1) # input ack
+        self.assertEqual(resources, [])
+        game.worker.call('close_updates', handler_id)
+
+    def test_poll_during_game_call(self):
+        game = self.pool.create_game('slow')
+        handler_id = game.worker.call('open_updates', 'slow')
+        slow = game.worker.call_async('game_call', 'slow', 'slow_call', (1, ))
+        start = time.time()
+        game.worker.call('poll_updates', handler_id)
+        self.assertTrue(time.time() - start < 0.5)
+        self.assertEqual(slow.get(), 'slow')
+
+    def test_missing_resource(self):
+        # asks both workers
+        self.assertRaises(KeyError, self.pool.get_by_sha1, '\0' * 20)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import sys
+import os
+import unittest
+import threading
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from colobot.server.stats import Metrics, Histogram, MeteredDispatcher
+from colobot.server.server import ConnectionHandler
+
+class Handler(object):
+    def rpc_ok(self, x):
+        return x * 2
+
+    def rpc_fail(self):
+        raise KeyError('x')
+
+class TestStats(unittest.TestCase):
+    def test_histogram(self):
+        h = Histogram()
+        self.assertEqual(h.percentile(50), None)
+        for i in xrange(99):
+            h.add(0.001)
+        h.add(2.5)
+        self.assertEqual(h.count, 100)
+        self.assertTrue(0.001 <= h.percentile(50) < 0.002)
+        self.assertTrue(h.percentile(99) < 0.002)
+        self.assertEqual(h.percentile(100), 2.5)
+
+    def test_snapshot(self):
+        metrics = Metrics()
+        metrics.counter('a').add(3)
+        metrics.gauge('b', lambda: 7)
+        metrics.gauge('c', lambda: 1 / 0)
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot['a'], 3)
+        self.assertEqual(snapshot['b'], 7)
+        self.assertTrue(snapshot['c'].startswith('error'))
+
+    def test_dispatcher(self):
+        metrics = Metrics()
+        dispatcher = MeteredDispatcher(Handler(), metrics)
+        self.assertEqual(dispatcher.rpc_ok(2), 4)
+        self.assertRaises(KeyError, dispatcher.rpc_fail)
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot['rpc.ok']['count'], 1)
+        self.assertEqual(snapshot['rpc.ok.errors'], 0)
+        self.assertEqual(snapshot['rpc.fail.errors'], 1)
+
+    def test_histogram_threads(self):
+        h = Histogram()
+        def add():
+            for i in xrange(10000):
+                h.add(0.001)
+        threads = [ threading.Thread(target=add) for i in xrange(4) ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(h.count, 40000)
+        self.assertEqual(sum(h.buckets), 40000)
+
+class FakeUser(object):
+    def __init__(self, allowed):
+        self.allowed = allowed
+
+    def check_permission(self, name):
+        return self.allowed
+
+class FakeServer(object):
+    metrics = Metrics()
+
+class StatsHandler(ConnectionHandler):
+    ' ConnectionHandler without connection. '
+    def __init__(self, user):
+        self.user = user
+        self.server = FakeServer()
+
+class TestStatsPermission(unittest.TestCase):
+    def test_allowed(self):
+        self.assertEqual(StatsHandler(FakeUser(True)).rpc_stats(), {})
+
+    def test_denied(self):
+        self.assertRaises(RuntimeError, StatsHandler(FakeUser(False)).rpc_stats)
+
+    def test_not_logged_in(self):
+        self.assertRaises(RuntimeError, StatsHandler(None).rpc_stats)
+
+if __name__ == '__main__':
+    unittest.main()
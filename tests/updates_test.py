@@ -0,0 +1,235 @@
+import sys
+import os
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import colobot.game
+import g3d
+import g3d.serialize
+from colobot.client import merge_updates
+from colobot.server.server import UpdateChannelHandler, BlobSender
+from colobot.server.shard import RemoteUpdateChannelHandler, _PendingCall
+from colobot.server.stats import Metrics
+from g3d.math import Vector3
+
+def update(time, new=(), deleted=(), updates=(), ack=0, progress=None):
+    return (time, list(new), list(deleted), list(updates), ack, progress)
+
+class TestMerge(unittest.TestCase):
+    def test_positions_from_newer(self):
+        merged = merge_updates(update(1, updates=[('A', 1)], ack=1),
+                               update(2, updates=[('A', 2)], ack=2, progress=(1, 2)))
+        self.assertEqual(merged, update(2, updates=[('A', 2)], ack=2, progress=(1, 2)))
+
+    def test_keeps_new_and_deleted(self):
+        merged = merge_updates(update(1, new=[('A', 'm')], deleted=['B']),
+                               update(2, new=[('C', 'm')], deleted=['D']))
+        self.assertEqual(merged[1], [('A', 'm'), ('C', 'm')])
+        self.assertEqual(merged[2], ['B', 'D'])
+
+    def test_created_and_deleted(self):
+        merged = merge_updates(update(1, new=[('A', 'm')]), update(2, deleted=['A']))
+        self.assertEqual(merged[1], [])
+        self.assertEqual(merged[2], [])
+
+    def test_deleted_and_created_again(self):
+        merged = merge_updates(update(1, deleted=['A']), update(2, new=[('A', 'm')]))
+        # client removes the old object and adds the new one
+        self.assertEqual(merged[1], [('A', 'm')])
+        self.assertEqual(merged[2], ['A'])
+
+        merged = merge_updates(merged, update(3, deleted=['A']))
+        self.assertEqual(merged[1], [])
+        self.assertEqual(merged[2], ['A'])
+
+class FakeChannel(object):
+    closed = False
+
+    def send(self, blob):
+        pass
+
+    def busy(self):
+        return False
+
+    def close(self):
+        self.closed = True
+
+class FakeObject(object):
+    def __init__(self, x, y):
+        self.snapshot = (Vector3(x, y, 0), Vector3(), None)
+
+class TestInterest(unittest.TestCase):
+    def setUp(self):
+        self.game = colobot.game.Game(loader=None)
+        self.handler = UpdateChannelHandler(FakeChannel(), None, self.game, 'conn')
+        self.near = FakeObject(50, 0)
+        self.edge = FakeObject(0, 110)
+        self.far = FakeObject(500, 500)
+        self.objects = [self.near, self.edge, self.far]
+
+    def test_no_view(self):
+        self.assertEqual(self.handler.get_interesting(self.objects), set(self.objects))
+
+    def test_view(self):
+        self.game.views['conn'] = (0, 0, 100)
+        self.assertEqual(self.handler.get_interesting(self.objects), set([self.near]))
+
+    def test_other_view(self):
+        self.game.views['other'] = (0, 0, 100)
+        self.assertEqual(self.handler.get_interesting(self.objects), set(self.objects))
+
+    def test_hysteresis(self):
+        self.game.views['conn'] = (0, 0, 100)
+        # already sent objects are kept until they are 20% outside
+        self.handler.last_objects = set([self.edge, self.far])
+        self.assertEqual(self.handler.get_interesting(self.objects),
+                         set([self.near, self.edge]))
+
+class FakeHandle(object):
+    cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+class FakeRecorder(object):
+    def __init__(self):
+        self.blobs = []
+        self.closed = False
+
+    def add_blob(self, blob, resources):
+        self.blobs.append((blob, resources))
+
+    def close(self):
+        self.closed = True
+
+class FakeServer(object):
+    def __init__(self):
+        self.serializer = g3d.serialize.Serializer(canonical=True)
+        self.metrics = Metrics()
+
+class TestStop(unittest.TestCase):
+    def test_closed_channel_stops_handler(self):
+        channel = FakeChannel()
+        handler = UpdateChannelHandler(channel, None, colobot.game.Game(loader=None), 'conn')
+        handler.handle = FakeHandle()
+        channel.closed = True
+        handler.tick(0.1)
+        self.assertTrue(handler.stopped)
+        self.assertTrue(handler.handle.cancelled)
+
+    def test_records_blobs(self):
+        server = FakeServer()
+        game = colobot.game.Game(loader=None)
+        obj = FakeObject(0, 0)
+        obj.ident = 'a' * 9
+        obj.model = g3d.Container()
+        game.get_objects = lambda: [obj]
+        recorder = FakeRecorder()
+        handler = UpdateChannelHandler(FakeChannel(), server, game, 'conn', recorder)
+
+        handler.tick(0.1)
+        handler.tick(0.1)
+        model = server.serializer.add(obj.model)
+        self.assertEqual([ resources for blob, resources in recorder.blobs ], [[model], []])
+
+        handler.stop()
+        self.assertTrue(recorder.closed)
+
+    def test_stop_removes_view(self):
+        game = colobot.game.Game(loader=None)
+        game.views['conn'] = (0, 0, 100)
+        game.views['other'] = (0, 0, 100)
+        UpdateChannelHandler(FakeChannel(), None, game, 'conn').stop()
+        self.assertEqual(game.views.keys(), ['other'])
+
+class FailingChannel(object):
+    def __init__(self):
+        self.sent = []
+
+    def send(self, blob):
+        if blob == 'fail':
+            raise IOError('connection closed')
+        self.sent.append(blob)
+
+class InlineLoop(object):
+    ' Runs sends immediately, like EventLoop with instant worker pool. '
+    def send_async(self, channel, data, callback):
+        try:
+            channel.send(data)
+        except IOError as err:
+            callback(err)
+        else:
+            callback(None)
+
+class TestBlobSender(unittest.TestCase):
+    def test_event_loop_send(self):
+        channel = FailingChannel()
+        sender = BlobSender(channel, Metrics(), InlineLoop())
+        sender.send('a')
+        sender.send('bc')
+        self.assertEqual(channel.sent, ['a', 'bc'])
+        self.assertEqual((sender.outstanding, sender.pending), (0, 0))
+        self.assertFalse(sender.busy())
+
+    def test_event_loop_failure_closes(self):
+        sender = BlobSender(FailingChannel(), Metrics(), InlineLoop())
+        sender.send('fail')
+        self.assertTrue(sender.closed)
+        self.assertTrue(sender.busy())
+
+class SlowWorker(object):
+    ''' Answers polls only when told to. '''
+    def __init__(self):
+        self.polls = []
+
+    def call(self, name, *args):
+        return 'handler'
+
+    def call_async(self, name, *args):
+        pending = _PendingCall()
+        if name == 'poll_updates':
+            self.polls.append(pending)
+        return pending
+
+class FakeRemoteGame(object):
+    name = 'game'
+
+    def __init__(self, worker):
+        self.worker = worker
+
+class CallSoonLoop(object):
+    def __init__(self):
+        self.calls = []
+
+    def call_soon(self, func, *args):
+        self.calls.append((func, args))
+
+    def run(self):
+        calls, self.calls = self.calls, []
+        for func, args in calls:
+            func(*args)
+
+class TestRemotePolling(unittest.TestCase):
+    def test_slow_worker(self):
+        worker = SlowWorker()
+        channel = FailingChannel()
+        channel.closed = False
+        channel.busy = lambda: False
+        handler = RemoteUpdateChannelHandler(channel, FakeRemoteGame(worker))
+        loop = CallSoonLoop()
+
+        for i in xrange(5):
+            handler.tick_async(loop)
+        self.assertEqual(len(worker.polls), 1)
+
+        worker.polls[0].set('ok', ('blob', []))
+        self.assertEqual(channel.sent, [])
+        loop.run() # blob is sent from event loop
+        self.assertEqual(channel.sent, ['blob'])
+
+        handler.tick_async(loop)
+        self.assertEqual(len(worker.polls), 2)
+
+if __name__ == '__main__':
+    unittest.main()
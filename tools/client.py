@@ -28,10 +28,6 @@ import logging
 logging.basicConfig(level=logging.DEBUG)
 
 client = colobot.client.Client(sys.argv[1])
-if not client.authenticate_with_session():
-    login = raw_input('Username: ')
-    password = getpass.getpass()
-    client.authenticate_and_save(login, password)
 
 def open_window(name):
     global win
@@ -39,8 +35,28 @@ def open_window(name):
     win.setup()
     win.loop()
 
-client.create_game('game')
-client.load_scene('game', 'scene103.txt')
+def start_game(session=None):
+    ' Creates the game (logging in with session first) in one batch. '
+    with client.batch() as batch:
+        auth = batch.call('use_session', session) if session else None
+        created = batch.call('create_game', 'game')
+        loaded = batch.call('load_scene', 'game', 'scene103.txt')
+    return auth, created, loaded
+
+auth, created, loaded = start_game(client.load_session())
+try:
+    if auth is None:
+        raise colobot.client.BatchCallError('no saved session')
+    auth.get()
+except colobot.client.BatchCallError as err:
+    logging.info('Authentication with session failed: %s', err)
+    login = raw_input('Username: ')
+    password = getpass.getpass()
+    client.authenticate_and_save(login, password)
+    auth, created, loaded = start_game()
+
+created.get()
+loaded.get()
 #client.load_terrain('game', 'relief15.png')
 #client.rpc.call.create_static_object('game', 'wheeled-transporter.model')
 #client.rpc.call.create_static_object('game', 'wheeled-transporter.model')
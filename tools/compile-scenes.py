@@ -0,0 +1,54 @@
+#!/usr/bin/python
+# Copyright (C) 2012, Michal Zielinski <michal@zielinscy.org.pl>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+Compiles scene files, so the server doesn't have to parse them
+(see colobot.game.scene_file.get_compiled).
+'''
+import sys, os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import colobot.game.scene_file
+
+import argparse
+import glob
+import time
+
+parser = argparse.ArgumentParser(description='Precompile Colobot scene files.')
+parser.add_argument('paths', metavar='PATH', nargs='*', default=['data/scene'],
+                    help='scene files or directories (default: data/scene)')
+parser.add_argument('--cache', metavar='DIR', dest='cache',
+                    default=colobot.game.scene_file.CACHE_PATH,
+                    help='where to store compiled scenes (default: %(default)s)')
+
+args = parser.parse_args()
+
+files = []
+for path in args.paths:
+    if os.path.isdir(path):
+        files += sorted(glob.glob(os.path.join(path, '*.txt')))
+    else:
+        files.append(path)
+
+start = time.time()
+failed = 0
+for path in files:
+    try:
+        colobot.game.scene_file.get_compiled(open(path, 'rb').read(), cache_path=args.cache)
+    except SyntaxError as err:
+        print >>sys.stderr, '%s: %s' % (path, err)
+        failed += 1
+
+print 'compiled %d scenes in %.2f s (%d failed)' % (len(files) - failed, time.time() - start, failed)
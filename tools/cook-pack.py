@@ -0,0 +1,59 @@
+#!/usr/bin/python
+# Copyright (C) 2012, Michal Zielinski <michal@zielinscy.org.pl>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+Cooks game data into single pack file - models are stored pre-parsed and
+textures decoded (see g3d.pack). Use it with --pack option of server.py.
+'''
+import sys, os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import colobot
+colobot.setup_path()
+
+import colobot.loader
+import g3d.pack
+
+import argparse
+import glob
+import logging
+import time
+
+parser = argparse.ArgumentParser(description='Cook Colobot data into pack file.')
+parser.add_argument('output', metavar='OUTPUT',
+                    help='pack file to write')
+parser.add_argument('paths', metavar='DIR', nargs='*',
+                    help='directories to pack (default: all directories in data/)')
+parser.add_argument('--metafile', metavar='PATH', dest='metafiles', action='append', default=[],
+                    help='also pack content of original Colobot archive (colobot*.dat)')
+
+args = parser.parse_args()
+
+logging.basicConfig(level=logging.INFO)
+
+loader = colobot.loader.Loader()
+for path in args.paths or glob.glob('data/*'):
+    if os.path.isdir(path):
+        loader.add_directory(path)
+
+for path in args.metafiles:
+    loader.add_metafile(path)
+
+start = time.time()
+entries = g3d.pack.cook(loader, args.output)
+cooked = sum( 1 for entry in entries.values() if entry.cooked )
+print 'packed %d files (%d cooked) into %s (%.1f MB) in %.2f s' % (
+    len(entries), cooked, args.output, os.path.getsize(args.output) / 1024. / 1024.,
+    time.time() - start)
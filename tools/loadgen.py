@@ -0,0 +1,99 @@
+#!/usr/bin/python
+# Copyright (C) 2012, Michal Zielinski <michal@zielinscy.org.pl>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import sys, os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import colobot
+colobot.setup_path()
+
+import colobot.client.loadgen
+
+import argparse
+import logging
+import tempfile
+import shutil
+import glob
+
+DEFAULT_ADDRESS = 'tcp:localhost:2718'
+
+parser = argparse.ArgumentParser(description='Simulate many players connected to Colobot-py server.')
+parser.add_argument('--address', metavar='ADDRESS', dest='address',
+                    default=DEFAULT_ADDRESS,
+                    help='server address (default: %(default)s)')
+parser.add_argument('--players', metavar='N', dest='players', type=int, default=10,
+                    help='number of simulated players (default: %(default)s)')
+parser.add_argument('--games', metavar='N', dest='games', type=int, default=1,
+                    help='spread players over N games (default: %(default)s)')
+parser.add_argument('--duration', metavar='SECONDS', dest='duration', type=float, default=30,
+                    help='how long each player stays in game (default: %(default)s)')
+parser.add_argument('--login', metavar='LOGIN', dest='login', default='root',
+                    help='user used by all players (default: %(default)s)')
+parser.add_argument('--password', metavar='PASSWORD', dest='password', default='',
+                    help='password of LOGIN (default: empty)')
+parser.add_argument('--scene', metavar='SCENE', dest='scene', default='scene103.txt',
+                    help='scene loaded into games created by players (default: %(default)s)')
+parser.add_argument('--motor-interval', metavar='SECONDS', dest='motor_interval',
+                    type=float, default=0.5,
+                    help='send motor command every SECONDS seconds (default: %(default)s)')
+parser.add_argument('--update-interval', metavar='SECONDS', dest='update_interval',
+                    type=float, default=0.1,
+                    help='expected interval between updates, used to compute jitter'
+                    ' (default: %(default)s)')
+parser.add_argument('--ramp-up', metavar='SECONDS', dest='ramp_up', type=float, default=0.05,
+                    help='delay between starting consecutive players (default: %(default)s)')
+parser.add_argument('--local', dest='local', action='store_true',
+                    help='start server in this process (with temporary profile) on ADDRESS')
+parser.add_argument('--event-loop', dest='event_loop', action='store_true',
+                    help='with --local: run server in event loop mode')
+parser.add_argument('--workers', metavar='N', dest='workers', type=int, default=0,
+                    help='with --local: run games in N worker processes')
+parser.add_argument('--log', metavar='LEVEL', dest='logging',
+                    default='ERROR', choices=['INFO', 'DEBUG', 'ERROR'],
+                    help='logging level, one of: DEBUG, INFO, ERROR')
+
+args = parser.parse_args()
+
+logging.basicConfig(level=getattr(logging, args.logging.upper()))
+
+profile_path = None
+if args.local:
+    import colobot.server.models
+    import colobot.server.server
+    import colobot.loader
+
+    profile_path = tempfile.mkdtemp(prefix='colobot-loadgen-')
+    loader = colobot.loader.Loader()
+    for path in glob.glob('data/*'):
+        if os.path.isdir(path):
+            loader.add_directory(path)
+    server = colobot.server.server.Server(profile=colobot.server.models.Profile(profile_path),
+                                          loader=loader,
+                                          event_loop=args.event_loop,
+                                          workers=args.workers)
+    server.start(args.address)
+
+try:
+    generator = colobot.client.loadgen.LoadGenerator(
+        args.address, args.players, args.login, args.password,
+        games=args.games, ramp_up=args.ramp_up,
+        scene=args.scene, motor_interval=args.motor_interval,
+        update_interval=args.update_interval)
+    report = generator.run(args.duration)
+    print report.format()
+finally:
+    if profile_path:
+        shutil.rmtree(profile_path)
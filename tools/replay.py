@@ -0,0 +1,66 @@
+#!/usr/bin/python
+# Copyright (C) 2012, Michal Zielinski <michal@zielinscy.org.pl>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import sys, os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import colobot
+colobot.setup_path()
+
+import colobot.recording
+import colobot.client.replay
+
+import argparse
+import logging
+
+parser = argparse.ArgumentParser(description='Replay update stream recorded by server'
+                                 ' (see --record option of server.py).')
+parser.add_argument('path', metavar='RECORDING',
+                    help='recording file')
+parser.add_argument('--ui', dest='ui', action='store_true',
+                    help='show recording in game window instead of running benchmarks')
+parser.add_argument('--speed', metavar='FACTOR', dest='speed', type=float, default=1.0,
+                    help='with --ui: replay speed relative to recorded one,'
+                    ' 0 means as fast as possible (default: %(default)s)')
+parser.add_argument('--repeat', metavar='N', dest='repeat', type=int, default=1,
+                    help='run benchmarks N times (default: %(default)s)')
+parser.add_argument('--log', metavar='LEVEL', dest='logging',
+                    default='INFO', choices=['INFO', 'DEBUG', 'ERROR'],
+                    help='logging level, one of: DEBUG, INFO, ERROR')
+
+args = parser.parse_args()
+
+logging.basicConfig(level=getattr(logging, args.logging.upper()))
+
+recording = colobot.recording.Recording.load(args.path)
+print 'recording: %d blobs, %.1f KB, %.1fs, %d resources' % (
+    len(recording.blobs), recording.size / 1024., recording.duration,
+    len(recording.resources))
+
+if args.ui:
+    import colobot.client.ui
+
+    window = colobot.client.ui.UIWindow(
+        colobot.client.replay.ReplayClient(recording, args.speed), 'replay')
+    window.setup()
+    window.loop()
+else:
+    for i in xrange(args.repeat):
+        samples = colobot.client.replay.benchmark_decode(recording)
+        print 'decode: %s' % samples.summary()
+        samples, size = colobot.client.replay.benchmark_encode(recording)
+        print 'encode: %s, %.1f KB (recorded %.1f KB)' % (
+            samples.summary(), size / 1024., recording.size / 1024.)
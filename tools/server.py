@@ -43,6 +43,29 @@ parser.add_argument('--log', metavar='LEVEL', dest='logging',
                     default='INFO', choices=['INFO', 'DEBUG', 'ERROR'],
                     help='logging level, one of: DEBUG, INFO, ERROR')
 
+parser.add_argument('--event-loop', dest='event_loop', action='store_true',
+                    help='run RPC calls, game ticks and updates in one event loop thread')
+
+parser.add_argument('--workers', metavar='N', dest='workers', type=int, default=0,
+                    help='run games in N worker processes (default: run them in server process)')
+
+parser.add_argument('--prewarm', dest='prewarm', action='store_true',
+                    help='load all models on startup (and write their SHA1s to PROFILE/manifest.json)')
+
+parser.add_argument('--stats-interval', metavar='SECONDS', dest='stats_interval',
+                    type=float, default=None,
+                    help='write server metrics to log every SECONDS seconds')
+
+parser.add_argument('--metafile', metavar='PATH', dest='metafiles', action='append', default=[],
+                    help='load data directly from original Colobot archive (colobot*.dat),'
+                    ' can be given multiple times')
+
+parser.add_argument('--pack', metavar='PATH', dest='packs', action='append', default=[],
+                    help='load data from pack made by cook-pack.py, can be given multiple times')
+
+parser.add_argument('--record', metavar='DIR', dest='record_path', default=None,
+                    help='record output of update channels to files in DIR (see tools/replay.py)')
+
 args = parser.parse_args()
 
 logging.basicConfig(level=getattr(logging, args.logging.upper()))
@@ -54,4 +77,15 @@ for path in glob.glob('data/*'):
     if os.path.isdir(path):
         loader.add_directory(path)
 
-colobot.server.server.Server(profile=profile, loader=loader).run(args.address)
+for path in args.metafiles:
+    loader.add_metafile(path)
+
+for path in args.packs:
+    loader.add_pack(path)
+
+colobot.server.server.Server(profile=profile, loader=loader,
+                            event_loop=args.event_loop,
+                            workers=args.workers,
+                            stats_interval=args.stats_interval,
+                            prewarm=args.prewarm,
+                            record_path=args.record_path).run(args.address)
@@ -9,7 +9,7 @@ if len(sys.argv) != 3:
 
 path, output = sys.argv[1:]
 
-f = metafile.MetaFile(metafile.cipher_keys['full'], open(path))
+f = metafile.MetaFile.open_path(path)
 
 if not os.path.isdir(output):
     os.mkdir(output)